@@ -0,0 +1,371 @@
+import json
+import math
+import os
+import time
+from typing import Callable
+
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from brewmoth_server.broadcaster import Broadcaster
+from brewmoth_server.loggers.brewfather import BrewFatherLogging, brewfather_data_import
+from brewmoth_server.logging import UpdateThread
+from hardware_control.autotune import TUNING_RULES
+from hardware_control.sensor_sampler import SensorSampler
+from hardware_control.thermostat import read_settings_file, write_to_settings_file
+from utilities.chamber_config import chamber_configs, chamber_config, sensors_config, chamber_file
+from utilities.constants import *
+from utilities.control_channel import ControlClient
+from utilities.event_stream import format_event
+from utilities.file_handling import list_time_series
+from utilities.formatters import timestamp
+from utilities.metrics import Gauge, exposition
+from utilities.rollups import RollupStore
+from utilities.telemetry import TelemetryReader, telemetry_name, TELEMETRY_TYPE
+from utilities.time_series import TimeSeries
+
+'''
+The Brewmoth API, independent of the web framework serving it: the state shared by the requests, and what each
+request does. It is served by the Flask app in brewmoth.py behind uWSGI, or by the asyncio core in async_server.py.
+'''
+
+BATCH_FOLDER = MOTH_LOCATION + 'batches'
+CONFIG_DATA = dict()
+SAMPLER: SensorSampler = None
+UPDATE_THREAD: UpdateThread = None
+ROLLUPS = RollupStore()
+BROADCASTER = Broadcaster()
+STREAM_KEEP_ALIVE = 15  # Seconds between comments on an idle stream, so a closed connection is noticed
+# Sends a command to the thermostat and returns its reply, see ChamberScheduler.handle_command
+CONTROL: Callable[[dict], dict] = ControlClient(CONTROL_SOCKET).request
+
+# Set from the thermostat's telemetry on every scrape, as the thermostat usually runs in another process
+TARGET = Gauge("brewmoth_thermostat_target_celsius", "Temperature the thermostat is aiming for", ["chamber"])
+PELTIER_STATE = Gauge("brewmoth_thermostat_state", "Peltier state: 1 heating, -1 cooling, 0 off", ["chamber"])
+DUTY = Gauge("brewmoth_thermostat_duty", "Peltier power in PID and predictive control, from -1 to 1", ["chamber"])
+LAST_RUN = Gauge("brewmoth_thermostat_last_run_timestamp_seconds", "When the thermostat last ran, since the epoch",
+                 ["chamber"])
+
+
+def setup(start_brewfather: bool = True, config: dict = None, devices_folder: str = W1_DEVICES_FOLDER):
+    """
+    Loads the config and creates the sampler and the update thread, without starting them.
+
+    :param start_brewfather: Whether to send updates to Brewfather
+    :param config: the contents of a config.json type file, read from CONFIG_FILE if not given
+    :param devices_folder: Folder with the 1-wire devices, can be changed to point at a fake sysfs tree
+    """
+    global CONFIG_DATA
+    if config is None:
+        with open(CONFIG_FILE, 'r') as config_file:
+            config = json.loads(config_file.read())
+    CONFIG_DATA = config
+
+    # Summarise the existing logs once, the sampler then keeps the summaries up to date
+    oldest = time.time() - ROLLUPS.longest_window
+    for log in list_time_series():
+        try:
+            if os.path.getmtime(log) < oldest:
+                continue  # Last written before the oldest bucket the rollups keep
+
+            ROLLUPS.add_series(TimeSeries(log))
+        except Exception as e:
+            journal.write("Could not load temperature log " + log + ": " + str(e))
+
+    # One sampler for the sensors of all the chambers
+    global SAMPLER
+    SAMPLER = SensorSampler(sensors_config(CONFIG_DATA), devices_folder)
+    SAMPLER.add_listener(lambda reading: ROLLUPS.add(reading.time, reading.temperatures))
+    # Every reading is encoded once, whatever the number of subscribers
+    SAMPLER.add_listener(lambda reading: BROADCASTER.publish(reading_event(reading)))
+
+    loggers = []
+
+    # Every chamber is its own device in Brewfather, with its own pending reading
+    chambers = chamber_configs(CONFIG_DATA)
+    for index, chamber in enumerate(chambers):
+        if start_brewfather and CFG_BREWFATHER in chamber:
+            pending_file = BREWFATHER_PENDING_FILE
+            if index > 0:
+                pending_file = chamber_file("brewfather-pending", chamber[NAME], ".json")
+
+            logger = BrewFatherLogging(chamber, pending_file=pending_file)
+
+            if len(chambers) > 1:
+                logger.name = "Brewfather " + chamber[NAME]
+            loggers.append(logger)
+
+    if loggers or CFG_WRITE_TO_DISK in CONFIG_DATA:
+        global UPDATE_THREAD
+        UPDATE_THREAD = UpdateThread(sensors_config(CONFIG_DATA), loggers, SAMPLER)
+
+    journal.write("Initialized with config: \n" + json.dumps(CONFIG_DATA, indent=4))
+
+
+def settings_file_for(chamber: str = None) -> str:
+    """
+    :param chamber: Name of the chamber, the first chamber if not given
+    :return: Location of the chamber's set point file
+    """
+    try:
+        return chamber_config(CONFIG_DATA, chamber)[CFG_SET_POINT_FILE]
+    except KeyError as e:
+        raise ValueError(e.args[0])
+
+
+def control(message: dict) -> dict:
+    """
+    Sends a command to the thermostat.
+
+    :raises ConnectionError: If the thermostat isn't running
+    :raises ValueError: If the thermostat couldn't carry out the command
+    """
+    reply = CONTROL(message)
+
+    if CTL_ERROR in reply:
+        raise ValueError(reply[CTL_ERROR])
+
+    return reply
+
+
+def update_settings(changes: dict, chamber: str = None) -> dict:
+    """
+    Changes some of a chamber's settings. The running thermostat applies them straight away; if it isn't running,
+    they are written to the set point file for when it starts.
+
+    :param chamber: Name of the chamber, the first chamber if not given
+    :return: The previous value of each changed setting
+    """
+    message = {CTL_COMMAND: CTL_UPDATE, CTL_SETTINGS: changes}
+    if chamber is not None:
+        message[CLI_CHAMBER] = chamber
+
+    try:
+        return control(message)[CTL_PREVIOUS]
+    except ConnectionError as e:
+        journal.write("Writing the set point file, as the thermostat can't be reached: " + str(e))
+
+    settings_file = settings_file_for(chamber)
+    settings = read_settings_file(settings_file)
+    previous = {key: settings.get(key) for key in changes}
+    settings.update(changes)
+    write_to_settings_file(settings, settings_file)
+
+    return previous
+
+
+def reading_event(reading) -> str:
+    return format_event({STREAM_TIME: reading.time, STREAM_TEMPERATURES: reading.temperatures},
+                        event_id=str(reading.time))
+
+
+def import_batch(received_json: dict, chamber: str = None):
+    """
+    Stores a batch exported from Brewfather and sets its fermentation profile.
+
+    :param chamber: Name of the chamber, the first chamber if not given
+    """
+    time_stamp = timestamp() + ".batch"
+    batch_file_location = os.path.join(BATCH_FOLDER, time_stamp)
+    file = open(batch_file_location, "w")
+
+    # noinspection PyBroadException
+    try:
+        set_points = brewfather_data_import(received_json)
+
+        json_set_points = []
+        for set_point in set_points:
+            json_set_points.append(set_point.to_json())
+
+        update_settings({SP_TEMP: json_set_points}, chamber)
+    except Exception as e:
+        journal.write("Exception while parsing brewfather batch.")
+        journal.write(str(e))
+
+    file.write(json.dumps(received_json))
+    file.close()
+
+    journal.write("Received Brewfather batch" + batch_file_location)
+
+
+def query_history(args) -> (object, int):
+    """
+    Returns min/mean/max temperatures of one sensor over a time range.
+
+    :param args: The query parameters:
+                  - sensor: Name of the sensor
+                  - start, end: The time range in seconds since the epoch, defaults to the last day
+                  - resolution: Desired seconds between points, the closest pre-computed resolution is used
+    :return: The response and its HTTP status
+    """
+    try:
+        sensor = args['sensor']
+        end = float(args.get('end', time.time()))
+        start = float(args.get('start', end - 24 * 3600))
+        resolution = float(args.get('resolution', 0))
+    except (KeyError, ValueError) as e:
+        return {'error': "Bad history request: " + str(e)}, 400
+
+    try:
+        return ROLLUPS.query(sensor, start, end, resolution), 200
+    except KeyError as e:
+        return {'error': str(e)}, 404
+
+
+def telemetry_reader(chamber: dict) -> TelemetryReader:
+    """
+    Maps the telemetry buffer of a chamber. It's mapped again for every request, as the thermostat creates a new
+    buffer whenever it restarts.
+
+    :param chamber: The config of the chamber
+    :raises FileNotFoundError: If the thermostat isn't running
+    """
+    return TelemetryReader(telemetry_name(chamber.get(NAME, "Thermostat")))  # Named as the Thermostat names itself
+
+
+def query_metrics() -> str:
+    """
+    :return: The metrics of the sensors, the thermostat and the loggers, in the Prometheus text format
+    """
+    for chamber in chamber_configs(CONFIG_DATA):
+        name = chamber.get(NAME, "Thermostat")
+        try:
+            with telemetry_reader(chamber) as reader:
+                records = reader.recent(1)
+        except FileNotFoundError:
+            continue  # The last run time stops moving, which is what alerts should look for
+
+        if len(records):
+            TARGET.labels(name).set(float(records['target'][0]))
+            PELTIER_STATE.labels(name).set(int(records['state'][0]))
+            DUTY.labels(name).set(float(records['duty'][0]))
+            LAST_RUN.labels(name).set(float(records['time'][0]))
+
+    return exposition()
+
+
+def query_telemetry(args) -> (object, int):
+    """
+    Returns what the thermostat of a chamber did on each of its recent runs, read from its telemetry buffer.
+
+    :param args: The query parameters:
+                  - chamber: Name of the chamber, the first chamber if not given
+                  - seconds: Only return the runs of the last so many seconds, all the buffer holds by default
+                  - limit: Most runs to return
+    :return: The response, one list per field of TELEMETRY_TYPE with NaN as null, and its HTTP status
+    """
+    try:
+        chamber = chamber_config(CONFIG_DATA, args.get('chamber'))
+        seconds = args.get('seconds')
+        since = time.time() - float(seconds) if seconds is not None else None
+        limit = args.get('limit')
+        limit = int(limit) if limit is not None else None
+    except KeyError as e:
+        return {'error': e.args[0]}, 404
+    except ValueError as e:
+        return {'error': "Bad telemetry request: " + str(e)}, 400
+
+    try:
+        with telemetry_reader(chamber) as reader:
+            records = reader.recent(limit, since)
+    except FileNotFoundError:
+        return {'error': "No telemetry for " + chamber.get(NAME, "Thermostat") + ", the thermostat isn't running"}, 404
+
+    return {field: [None if isinstance(value, float) and math.isnan(value) else value
+                    for value in records[field].tolist()] for field in TELEMETRY_TYPE.names}, 200
+
+
+def run_command(data):
+    """
+    Carries out a command posted to /cli, e.g. by ./temps.
+
+    :param data: The posted JSON
+    :return: A message for the user, or the temperatures
+    """
+    try:
+        # Commands can name the chamber they are for, otherwise they go to the first one
+        chamber = data.get(CLI_CHAMBER) if isinstance(data, dict) else None
+        settings_file_for(chamber)  # Checks the chamber exists
+
+        if CLI_SET_TEMP in data:
+            set_point = data[CLI_SET_TEMP]
+
+            journal.write("Received temperature request:" + str(data))
+
+            try:
+                set_point = float(set_point)
+            except ValueError:
+                return "Error parsing requested temperature"
+
+            previous = update_settings({SP_TEMP: set_point, SP_STATE: ON}, chamber)
+
+            if previous[SP_STATE] != ON:
+                return_message = "Set temperature control to " + str(set_point)
+            else:
+                return_message = "Changed temperature set point to " + str(set_point)
+
+            journal.write(return_message)
+
+            return return_message
+
+        elif isinstance(data, dict) and CLI_SET_MODE in data:
+            control_settings = data[CLI_SET_MODE]
+
+            journal.write("Received control mode request:" + str(data))
+
+            if not isinstance(control_settings, dict):
+                return "Error parsing control mode request"
+
+            changes = {}
+
+            for key, value in control_settings.items():
+                if key == SP_MODE and value in (MODE_HYSTERESIS, MODE_PID, MODE_AUTOTUNE, MODE_PREDICTIVE):
+                    changes[SP_MODE] = value
+                elif key == SP_TUNING_RULE and value in TUNING_RULES:
+                    changes[SP_TUNING_RULE] = value
+                elif key in (SP_KP, SP_KI, SP_KD, SP_RATE_LIMIT, SP_FEED_FORWARD, SP_HORIZON):
+                    try:
+                        changes[key] = float(value)
+                    except (TypeError, ValueError):
+                        return "Error parsing " + key + " value " + str(value)
+                else:
+                    return "Unknown control setting " + str(key) + ": " + str(value)
+
+            update_settings(changes, chamber)
+
+            return_message = "Changed control settings to " + str(control_settings)
+            journal.write(return_message)
+
+            return return_message
+
+        elif data == CLI_GET_TEMP:
+            temperatures = SAMPLER.temperatures()
+
+            journal.write("Received request for temps, returning " + str(temperatures))
+
+            return temperatures
+        elif data == CLI_GET_STATE or isinstance(data, dict) and data.get(CLI_GET_STATE):
+            message = {CTL_COMMAND: CTL_GET_STATE}
+            if chamber is not None:
+                message[CLI_CHAMBER] = chamber
+
+            return control(message)[CTL_STATE]
+        elif data == CLI_OFF or isinstance(data, dict) and data.get(CLI_OFF):
+            previous = update_settings({SP_STATE: OFF}, chamber)
+
+            if previous[SP_STATE] == ON:
+                return_message = "Turned off temperature control."
+            else:
+                return_message = "Was asked to turn off, but temperature control is already off."
+
+            journal.write(return_message)
+            return return_message
+        else:
+            message = "Got the following post: " + str(data) + ", but don't know what to do with it."
+            journal.write(message)
+            return message
+
+    except Exception as e:
+        message = "Exception: " + str(e)
+        journal.write(message)
+        return message
@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+
+from aiohttp import web
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from brewmoth_server import api
+from brewmoth_server.broadcaster import TooManySubscribers
+from hardware_control.chambers import ChamberScheduler
+from utilities.constants import W1_DEVICES_FOLDER
+from utilities.event_stream import format_comment
+from utilities.metrics import CONTENT_TYPE
+
+'''
+Brewmoth on asyncio: the HTTP API, the sensor sampler, the loggers and the control loop of the chambers run as tasks
+on one event loop in one process, instead of a uWSGI worker with a thread per job next to a separate thermostat
+process with its own sampler. Whatever blocks runs in a thread: the sensor sweeps and the control passes each in a
+thread of their own, the loggers and the requests in the loop's default executor. Control passes and requests wait
+for the next sweep, so the sweep never queues behind them for a worker. Nothing polls: every task sleeps until its
+next deadline, a new reading or a set point file changing.
+'''
+
+
+async def cli(request: web.Request) -> web.Response:
+    if request.method != 'POST':
+        return web.Response(text="Received an incorrect post")
+
+    try:
+        data = await request.json()
+    except ValueError as e:
+        return web.Response(text="Exception: " + str(e))
+
+    # Commands wait for readings and write the set point files, so they run in the executor
+    result = await asyncio.to_thread(api.run_command, data)
+
+    if isinstance(result, dict):
+        return web.json_response(result)
+    return web.Response(text=result)
+
+
+async def history(request: web.Request) -> web.Response:
+    result, status = await asyncio.to_thread(api.query_history, request.query)
+
+    return web.json_response(result, status=status)
+
+
+async def telemetry(request: web.Request) -> web.Response:
+    result, status = api.query_telemetry(request.query)
+
+    return web.json_response(result, status=status)
+
+
+async def metrics(_: web.Request) -> web.Response:
+    return web.Response(body=api.query_metrics().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def brewfather(request: web.Request) -> web.Response:
+    if request.method != 'POST':
+        return web.Response(text="didn't get a post")
+
+    if request.content_type != 'application/json':
+        return web.Response(text="request was not a json")
+
+    await asyncio.to_thread(api.import_batch, await request.json(), request.query.get('chamber'))
+
+    return web.json_response({'success': True})
+
+
+async def stream(request: web.Request) -> web.StreamResponse:
+    """
+    Streams every new reading of the sensors as Server-Sent Events, the same as the /stream of the Flask app.
+    """
+    try:
+        subscription = api.BROADCASTER.subscribe(asyncio.get_running_loop())
+    except TooManySubscribers as e:
+        return web.json_response({'error': str(e)}, status=503)
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+    try:
+        await response.prepare(request)
+
+        latest = api.SAMPLER.reading
+        if latest is not None:
+            await response.write(api.reading_event(latest).encode())
+
+        skipped = 0
+        while True:
+            event = await subscription.next(api.STREAM_KEEP_ALIVE)
+            if event is None and subscription.closed:
+                break
+
+            if subscription.skipped > skipped:
+                await response.write(format_comment("skipped " + str(subscription.skipped - skipped) +
+                                                    " readings").encode())
+                skipped = subscription.skipped
+
+            await response.write((event if event is not None else format_comment("keep-alive")).encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        subscription.close()
+
+    return response
+
+
+def create_app(start_brewfather: bool = True, start_thermostat: bool = True, config: dict = None,
+               devices_folder: str = W1_DEVICES_FOLDER) -> web.Application:
+    """
+    :param start_brewfather: Whether to send updates to Brewfather
+    :param start_thermostat: Whether to run the control loop of the chambers, instead of the thermostat service
+    :param config: the contents of a config.json type file, read from CONFIG_FILE if not given
+    :param devices_folder: Folder with the 1-wire devices, can be changed to point at a fake sysfs tree
+    """
+    api.setup(start_brewfather, config, devices_folder)
+    scheduler = None
+    if start_thermostat:
+        scheduler = ChamberScheduler(api.CONFIG_DATA, api.SAMPLER, devices_folder=devices_folder, telemetry=True)
+        # The thermostat runs in this process, so commands don't need to go through the control socket
+        api.CONTROL = scheduler.handle_command
+
+    async def background_tasks(_):
+        tasks = [asyncio.create_task(api.SAMPLER.run_async())]
+        if api.UPDATE_THREAD is not None:
+            tasks.append(asyncio.create_task(api.UPDATE_THREAD.run_async()))
+        if scheduler is not None:
+            tasks.append(asyncio.create_task(scheduler.run_async()))
+
+        yield
+
+        if scheduler is not None:
+            scheduler.kill()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def end_streams(_):
+        api.BROADCASTER.close()
+
+    app = web.Application()
+    app.add_routes([
+        web.route('*', '/cli', cli),
+        web.get('/history', history),
+        web.get('/telemetry', telemetry),
+        web.get('/metrics', metrics),
+        web.route('*', '/brewfather', brewfather),
+        web.get('/stream', stream),
+    ])
+    app.cleanup_ctx.append(background_tasks)
+    app.on_shutdown.append(end_streams)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs Brewmoth, including the thermostat, on one event loop.')
+
+    parser.add_argument('--port', '-p', help='Port to listen on', type=int, default=6666)
+    parser.add_argument('--socket', '-s', help='Unix socket to listen on instead, e.g. behind nginx')
+    parser.add_argument('--no-thermostat', help='Leave the chambers to the thermostat service',
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    journal.write("Initializing Brewmoth on asyncio...")
+    application = create_app(start_thermostat=not args.no_thermostat)
+
+    if args.socket:
+        web.run_app(application, path=args.socket, print=None)
+    else:
+        web.run_app(application, host='0.0.0.0', port=args.port, print=None)
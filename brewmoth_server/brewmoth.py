@@ -1,22 +1,17 @@
 import json
-import os
 
-from flask import Flask, request
+from flask import Flask, Response, request
 # noinspection PyUnresolvedReferences
 from flask_cors import CORS
 # noinspection PyUnresolvedReferences
 from systemd import journal
 
-from brewmoth_server.loggers.brewfather import BrewFatherLogging, brewfather_data_import
-from brewmoth_server.logging import UpdateThread
-from hardware_control.temperature_sensors import *
-from hardware_control.thermostat import read_settings_file, write_to_settings_file
-from utilities.constants import *
-from utilities.formatters import timestamp
+from brewmoth_server import api
+from brewmoth_server.broadcaster import TooManySubscribers
+from utilities.event_stream import format_comment
+from utilities.metrics import CONTENT_TYPE
 
-BATCH_FOLDER = MOTH_LOCATION + 'batches'
 ALLOWED_EXTENSIONS = {'txt', 'json'}
-CONFIG_DATA = dict()
 
 app = Flask(__name__)
 CORS(app)
@@ -28,52 +23,23 @@ def initialize(start_brewfather: bool = True):
 
     :param start_brewfather: Whether to start the thread to send updates to Brewfather
     """
-    with open(CONFIG_FILE, 'r') as config_file:
-        file_contents = config_file.read()
-        global CONFIG_DATA
-        CONFIG_DATA = json.loads(file_contents)
+    api.setup(start_brewfather)
 
-    loggers = []
-
-    if start_brewfather and CFG_BREWFATHER in CONFIG_DATA:
-        loggers.append(BrewFatherLogging(CONFIG_DATA))
-
-    if loggers:
-        update_thread = UpdateThread(CONFIG_DATA, loggers)
-        update_thread.start()
-
-    journal.write("Initialized with config: \n" + json.dumps(CONFIG_DATA, indent=4))
+    api.SAMPLER.start()
+    if api.UPDATE_THREAD is not None:
+        api.UPDATE_THREAD.start()
 
 
 @app.route("/brewfather", methods=['GET', 'POST'])
 def save_post():
+    """
+    Takes a batch exported from Brewfather and sets its fermentation profile. The optional chamber query
+    parameter picks the chamber, the first one by default.
+    """
     if request.method == 'POST':
 
         if request.is_json:
-            received_json = request.get_json()
-            time_stamp = timestamp() + ".batch"
-            batch_file_location = os.path.join(BATCH_FOLDER, time_stamp)
-            file = open(batch_file_location, "w")
-
-            # noinspection PyBroadException
-            try:
-                set_points = brewfather_data_import(received_json)
-
-                json_set_points = []
-                for set_point in set_points:
-                    json_set_points.append(set_point.to_json())
-
-                settings = read_settings_file()
-                settings[SP_TEMP] = json_set_points
-                write_to_settings_file(settings)
-            except Exception as e:
-                journal.write("Exception while parsing brewfather batch.")
-                journal.write(str(e))
-
-            file.write(json.dumps(received_json))
-            file.close()
-
-            journal.write("Received Brewfather batch" + batch_file_location)
+            api.import_batch(request.get_json(), request.args.get('chamber'))
         else:
             return "request was not a json"
 
@@ -81,68 +47,77 @@ def save_post():
     return "didn't get a post"
 
 
-@app.route('/cli', methods=['GET', 'POST'])
-def hello():
-    try:
-        if request.method == 'POST':
-            data: dict = request.get_json()
-
-            if CLI_SET_TEMP in data:
-                set_point = data[CLI_SET_TEMP]
+@app.route('/history', methods=['GET'])
+def history():
+    """
+    Returns min/mean/max temperatures of one sensor over a time range, see api.query_history.
+    """
+    return api.query_history(request.args)
 
-                journal.write("Received temperature request:" + str(data))
 
-                try:
-                    set_point = float(set_point)
-                except ValueError:
-                    return "Error parsing requested temperature"
+@app.route('/telemetry', methods=['GET'])
+def telemetry():
+    """
+    Returns what the thermostat of a chamber did on each of its recent runs, see api.query_telemetry.
+    """
+    return api.query_telemetry(request.args)
 
-                settings = read_settings_file()
 
-                thermostat_on = settings[SP_STATE] == ON
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Returns the metrics of the sensors, the thermostat and the loggers for Prometheus to scrape.
+    """
+    return Response(api.query_metrics(), content_type=CONTENT_TYPE)
 
-                settings[SP_TEMP] = set_point
-                settings[SP_STATE] = ON
 
-                if not thermostat_on:
-                    return_message = "Set temperature control to " + str(set_point)
-                else:
-                    return_message = "Changed temperature set point to " + str(set_point)
+@app.route('/stream', methods=['GET'])
+def stream():
+    """
+    Streams every new reading of the sensors as Server-Sent Events, starting with the latest one. Each event's data
+    is a JSON object with the time of the reading, in seconds since the epoch, and the temperatures by sensor name.
+    A client that doesn't keep up misses readings rather than getting them late.
+    """
+    try:
+        subscription = api.BROADCASTER.subscribe()
+    except TooManySubscribers as e:
+        return {'error': str(e)}, 503
 
-                write_to_settings_file(settings)
+    latest = api.SAMPLER.reading
 
-                journal.write(return_message)
+    def events():
+        try:
+            if latest is not None:
+                yield api.reading_event(latest)
 
-                return return_message
+            skipped = 0
+            while True:
+                event = subscription.get(api.STREAM_KEEP_ALIVE)
+                if event is None and subscription.closed:
+                    return
 
-            elif data == CLI_GET_TEMP:
-                temperatures = read_temps(CONFIG_DATA)
+                if subscription.skipped > skipped:
+                    yield format_comment("skipped " + str(subscription.skipped - skipped) + " readings")
+                    skipped = subscription.skipped
 
-                journal.write("Received request for temps, returning " + str(temperatures))
+                yield event if event is not None else format_comment("keep-alive")
+        finally:
+            subscription.close()
 
-                return temperatures
-            elif data == CLI_OFF:
-                settings = read_settings_file()
-                thermostat_on = settings[SP_STATE] == ON
+    # X-Accel-Buffering stops nginx from holding the events back
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-                if thermostat_on:
-                    settings[SP_STATE] = OFF
-                    write_to_settings_file(settings)
-                    return_message = "Turned off temperature control."
-                else:
-                    return_message = "Was asked to turn off, but temperature control is already off."
 
-                journal.write(return_message)
-                return return_message
-            else:
-                message = "Got the following post: " + str(data) + ", but don't know what to do with it."
-                journal.write(message)
-                return message
+@app.route('/cli', methods=['GET', 'POST'])
+def hello():
+    try:
+        if request.method == 'POST':
+            return api.run_command(request.get_json())
 
-        else:
-            message = "Received an incorrect post"
-            journal.write(message)
-            return message
+        message = "Received an incorrect post"
+        journal.write(message)
+        return message
 
     except Exception as e:
         message = "Exception: " + str(e)
@@ -0,0 +1,133 @@
+import asyncio
+from collections import deque
+from threading import Condition
+from typing import Optional
+
+'''
+Fans every new temperature reading out to any number of stream subscribers. Each subscriber has its own small queue;
+a subscriber that doesn't keep up skips the oldest readings instead of making the queue grow, and never holds up
+the sampler or the other subscribers. Subscribers can wait in a thread, with get, or on an event loop, with next.
+'''
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+
+    def __init__(self, broadcaster: 'Broadcaster', max_queue: int, loop: asyncio.AbstractEventLoop = None):
+        self.broadcaster = broadcaster
+        self.queue = deque(maxlen=max_queue)
+        self.skipped = 0  # Messages dropped because the subscriber fell behind
+        self.closed = False
+        self.loop = loop
+        self.ready = asyncio.Event() if loop is not None else None
+
+    def notify(self):
+        """
+        Wakes up a subscriber waiting in next. Called with the broadcaster's condition held, from any thread.
+        """
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.ready.set)
+            except RuntimeError:
+                pass  # The loop has already been closed
+
+    def get(self, timeout: float) -> Optional[str]:
+        """
+        Waits for the next message.
+
+        :param timeout: Seconds to wait at most
+        :return: The message, or None if there was none in time or the subscription was closed
+        """
+        with self.broadcaster.condition:
+            self.broadcaster.condition.wait_for(lambda: self.queue or self.closed, timeout)
+
+            if self.queue:
+                return self.queue.popleft()
+
+            return None
+
+    async def next(self, timeout: float) -> Optional[str]:
+        """
+        Waits for the next message without blocking the event loop the subscription was made for.
+
+        :param timeout: Seconds to wait at most
+        :return: The message, or None if there was none in time or the subscription was closed
+        """
+        with self.broadcaster.condition:
+            if self.queue or self.closed:
+                return self.queue.popleft() if self.queue else None
+            self.ready.clear()
+
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        with self.broadcaster.condition:
+            return self.queue.popleft() if self.queue else None
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+
+    def __init__(self, max_queue: int = 10, max_subscribers: int = 16):
+        """
+        :param max_queue: Messages kept for a subscriber that hasn't taken them yet, older ones are skipped
+        :param max_subscribers: Most subscribers at once, as each holds on to a server thread under uWSGI
+        """
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.condition = Condition()
+        self.subscriptions = []
+        self.published = 0
+
+    def subscribe(self, loop: asyncio.AbstractEventLoop = None) -> Subscription:
+        """
+        :param loop: The event loop the subscriber waits on with next, if it doesn't wait in a thread with get
+        """
+        with self.condition:
+            if len(self.subscriptions) >= self.max_subscribers:
+                raise TooManySubscribers("Already streaming to " + str(len(self.subscriptions)) + " subscribers")
+
+            subscription = Subscription(self, self.max_queue, loop)
+            self.subscriptions.append(subscription)
+
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.condition:
+            subscription.closed = True
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+            subscription.notify()
+            self.condition.notify_all()
+
+    def publish(self, message: str):
+        """
+        Hands the message to every subscriber. This never blocks on a subscriber.
+        """
+        with self.condition:
+            for subscription in self.subscriptions:
+                if len(subscription.queue) == subscription.queue.maxlen:
+                    subscription.skipped += 1
+                subscription.queue.append(message)
+                subscription.notify()
+
+            self.published += 1
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        Ends all the subscriptions, e.g. when the server shuts down.
+        """
+        with self.condition:
+            for subscription in self.subscriptions:
+                subscription.closed = True
+                subscription.notify()
+            self.subscriptions = []
+            self.condition.notify_all()
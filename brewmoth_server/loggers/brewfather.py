@@ -1,3 +1,4 @@
+import time
 from datetime import datetime
 from typing import List
 
@@ -7,20 +8,41 @@ from systemd import journal
 
 from brewmoth_server.logging import Logger
 from hardware_control.temperature_sensors import *
-from utilities.constants import NAME, SENSOR_TYPE_MAIN, SENSOR_TYPE_ROOM
+from utilities.constants import NAME, SENSOR_TYPE_MAIN, SENSOR_TYPE_ROOM, BREWFATHER_PENDING_FILE, \
+    CFG_BREWFATHER_INTERVAL
+from utilities.pending_reading import PendingReading
 from utilities.time_temp_parser import SetPointType, SetPoint, sort_set_points
 
 url = 'http://log.brewfather.net/stream?id=OniWOwAOjMnLsM'
-json = {
-    "temp_unit": "C",  # C, F, K
-}
+temp_unit = "C"  # C, F, K
+posting_interval = 900  # Brewfather only accepts one post every 15 minutes
+posting_slack = 5  # Seconds early a post may be, as the logging job runs on the same period as the interval
 
 
 class BrewFatherLogging(Logger):
-
-    def __init__(self, config: dict):
+    """
+    Sends temperatures to a Brewfather custom stream.
+
+    Brewfather stamps a reading with the time it arrives and takes one post per interval, so readings can't be
+    back-dated and a backlog left by a Wi-Fi drop would take hours to send, all stamped wrong. Only the newest
+    reading is kept instead: every reading replaces the pending one, persisted to disk, and at most once per
+    posting interval the pending reading is posted. A post that fails raises, so the LoggerWorker retries it
+    with backoff; a retry posts the pending reading again without storing it again.
+    """
+    name = "Brewfather"
+
+    def __init__(self, config: dict, stream_url: str = url, pending_file: str = BREWFATHER_PENDING_FILE):
+        """
+        :param config: the contents of a config.json type file
+        :param stream_url: URL of the Brewfather custom stream
+        :param pending_file: Location of the JSON file holding the reading waiting to be sent
+        """
         super().__init__()
         self.config = config
+        self.url = stream_url
+        self.interval = config.get(CFG_BREWFATHER_INTERVAL, posting_interval)
+        self.last_post = None  # time.monotonic() at which the last successful post was started
+        self.failed_posts = 0
 
         for sensor in config[CFG_SENSORS]:
             if sensor[TYPE] == SENSOR_TYPE_MAIN:
@@ -31,18 +53,59 @@ class BrewFatherLogging(Logger):
         if not hasattr(self, 'main_sensor'):
             raise Exception("BrewFatherUpdater could not find the main temperature sensor information")
 
-        json["name"] = config[NAME]  # this will be the ID in Brewfather
-        journal.write("Initialized BrewFatherUpdater")
+        # A single session keeps the connection to Brewfather alive between posts
+        self.session = requests.Session()
+        self.pending = PendingReading(pending_file)
 
-    def log(self, temperatures: dict):
+        journal.write("Initialized BrewFatherUpdater" +
+                      (" with a reading waiting to be sent" if self.pending.get() is not None else ""))
+
+    def payload(self, temperatures: dict) -> dict:
+        payload = {
+            "name": self.config[NAME],  # this will be the ID in Brewfather
+            "temp_unit": temp_unit,
+        }
 
         for temperature in temperatures:
             if temperature == self.main_sensor:
-                json["temp"] = temperatures[temperature]
+                payload["temp"] = temperatures[temperature]
             if hasattr(self, 'room_sensor') and temperature == self.room_sensor:
-                json["ext_temp"] = temperatures[temperature]
+                payload["ext_temp"] = temperatures[temperature]
 
-        requests.post(url, data=json)
+        return payload
+
+    def log(self, temperatures: dict):
+        self.pending.store(self.payload(temperatures))
+        self.drain()
+
+    def retry(self, batch: List[dict]):
+        self.drain()
+
+    def drain(self):
+        """
+        Posts the pending reading, if the posting interval has passed since the last post.
+
+        :raises requests.RequestException: If the post failed, the reading stays pending
+        """
+        # Timed from the start of the posts, so the time a post takes doesn't push every other one past the interval
+        start = time.monotonic()
+        if self.last_post is not None and start - self.last_post < self.interval - posting_slack:
+            return
+
+        payload = self.pending.get()
+        if payload is None:
+            return
+
+        try:
+            response = self.session.post(self.url, data=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.failed_posts += 1
+            journal.write("Could not post to Brewfather, the reading stays pending: " + str(e))
+            raise
+
+        self.last_post = start
+        self.pending.clear()
 
 
 def brewfather_data_import(received_json: dict) -> List[SetPoint]:
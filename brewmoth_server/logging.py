@@ -1,72 +1,265 @@
 import time
-from threading import Thread
+from collections import deque
+from enum import Enum
+from threading import Thread, Condition, Event
 from typing import List
 
 # noinspection PyUnresolvedReferences
 from systemd import journal
-from hardware_control.temperature_sensors import read_temps
-from utilities.constants import CFG_WRITE_TO_DISK, NAME
-from utilities.file_handling import create_time_stamped_csv
-from utilities.formatters import timestamp
+from hardware_control.sensor_sampler import SensorSampler
+from utilities.constants import CFG_WRITE_TO_DISK, NAME, CFG_LOGGING_PERIOD, CFG_DISK_LOGGING_PERIOD, \
+    CFG_LOGGER_QUEUE_SIZE, CFG_LOGGER_OVERFLOW, CFG_SENSORS, CFG_COMMIT_RECORDS, CFG_COMMIT_SECONDS
+from utilities.file_handling import create_time_stamped_store
+from utilities.metrics import Histogram, Counter
+from utilities.periodic import PeriodicScheduler, PeriodicJob
+
+POST_LATENCY = Histogram("brewmoth_logger_post_seconds", "Time each call to a logging backend took", ["logger"])
+POST_FAILURES = Counter("brewmoth_logger_post_failures_total", "Calls to a logging backend that failed", ["logger"])
+DROPPED = Counter("brewmoth_logger_dropped_total", "Readings a logger dropped, unsent or from a full queue", ["logger"])
 
 
 class Logger:
+    name = "Logger"
+    batch_size = 1  # How many sets of temperatures the backend can take in one call to log_batch
+    timeout = 10  # Seconds a backend may spend on one call before giving up
 
     def log(self, temperatures: dict):
         pass
 
+    def log_batch(self, batch: List[dict]):
+        """
+        Logs several sets of temperatures, oldest first.
+        Backends that can send several readings at once should override this and set batch_size.
+        """
+        for temperatures in batch:
+            self.log(temperatures)
+
+    def retry(self, batch: List[dict]):
+        """
+        Tries again to log a batch after log_batch failed. Backends that keep what they were given, e.g. on disk,
+        should override this to only send it again.
+        """
+        self.log_batch(batch)
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "Drop oldest"
+    DROP_NEWEST = "Drop newest"
+    COALESCE = "Coalesce"  # Replace the newest queued reading, so only the latest is kept when a backend falls behind
+
 
-class UpdateThread(Thread):
-    keepAlive: bool = True
+class LoggerWorker(Thread):
+    """
+    Feeds one Logger from its own bounded queue and thread, so a slow or unreachable backend can't hold up
+    the other loggers or the sensor reads.
+    """
 
-    def __init__(self, config: dict, loggers: List[Logger], delay_ms: int = 900):
+    def __init__(self, logger: Logger, max_queue: int = 100, overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                 max_attempts: int = 5, backoff: float = 2, max_backoff: float = 300):
+        """
+        :param logger: The backend to send temperatures to
+        :param max_queue: Maximum number of readings waiting to be sent
+        :param overflow: What to do with new readings when the queue is full
+        :param max_attempts: How many times to try sending a batch before dropping it
+        :param backoff: Seconds to wait after the first failure, doubled after every following failure
+        :param max_backoff: Longest time to wait between attempts, in seconds
+        """
+        super().__init__()
+        self.daemon = True
+        self.logger = logger
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue = deque()
+        self.queue_changed = Condition()
+        self.stopping = Event()
+
+        self.sent = 0
+        self.dropped = 0
+        self.failures = 0
+        self.retries = 0
+        self.post_latency = 0.0  # Seconds the last call to the backend took
+        self.queue_latency = 0.0  # Seconds between queueing and sending for the last batch
+
+    def submit(self, temperatures: dict):
+        """
+        Queues temperatures to be logged. This never blocks.
+        """
+        with self.queue_changed:
+            if len(self.queue) >= self.max_queue:
+                if self.overflow is OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    DROPPED.labels(self.logger.name).inc()
+                    return
+                if self.overflow is OverflowPolicy.COALESCE:
+                    self.queue.pop()
+                else:
+                    self.queue.popleft()
+                self.dropped += 1
+                DROPPED.labels(self.logger.name).inc()
+
+            self.queue.append((time.monotonic(), temperatures))
+            self.queue_changed.notify()
+
+    def kill(self):
+        self.stopping.set()
+        with self.queue_changed:
+            self.queue_changed.notify()
+
+    def metrics(self) -> dict:
+        return {
+            "depth": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "retries": self.retries,
+            "post latency": self.post_latency,
+            "queue latency": self.queue_latency,
+        }
+
+    def next_batch(self) -> list:
+        with self.queue_changed:
+            self.queue_changed.wait_for(lambda: self.queue or self.stopping.is_set())
+
+            batch = []
+            while self.queue and len(batch) < self.logger.batch_size:
+                batch.append(self.queue.popleft())
+
+            return batch
+
+    def send(self, batch: list) -> bool:
+        """
+        Sends a batch to the backend, retrying with exponential backoff.
+
+        :return: Whether the batch was sent
+        """
+        wait = self.backoff
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                self.retries += 1
+                if self.stopping.wait(wait):
+                    return False
+                wait = min(wait * 2, self.max_backoff)
+
+            start = time.monotonic()
+            try:
+                if attempt == 0:
+                    self.logger.log_batch([temperatures for _, temperatures in batch])
+                else:
+                    self.logger.retry([temperatures for _, temperatures in batch])
+                self.post_latency = time.monotonic() - start
+                self.queue_latency = time.monotonic() - batch[0][0]
+                POST_LATENCY.labels(self.logger.name).observe(self.post_latency)
+                return True
+            except Exception as e:
+                self.post_latency = time.monotonic() - start
+                POST_LATENCY.labels(self.logger.name).observe(self.post_latency)
+                POST_FAILURES.labels(self.logger.name).inc()
+                journal.write(self.logger.name + " failed to log temperatures: " + str(e))
+
+        return False
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            batch = self.next_batch()
+            if not batch:
+                continue
+
+            if self.send(batch):
+                self.sent += len(batch)
+            else:
+                self.failures += 1
+                self.dropped += len(batch)
+                DROPPED.labels(self.logger.name).inc(len(batch))
+
+
+class UpdateThread(PeriodicScheduler):
+    """
+    Periodically sends the latest temperatures to the loggers and, if enabled, writes them to disk.
+    The loggers and the disk each have their own period, set in the config in seconds.
+    """
+
+    def __init__(self, config: dict, loggers: List[Logger], sampler: SensorSampler, period: float = 900):
+        """
+        :param config: the contents of a config.json type file
+        :param loggers: Loggers to send temperatures to
+        :param sampler: Sampler to take the temperatures from
+        :param period: Default period in seconds, used when the config doesn't set one
+        """
         super().__init__()
-        self.delay_ms = delay_ms
         self.loggers = loggers
-        self.setDaemon(True)
         self.config = config
+        self.sampler = sampler
+
+        overflow = OverflowPolicy(config.get(CFG_LOGGER_OVERFLOW, OverflowPolicy.DROP_OLDEST.value))
+        self.workers = [LoggerWorker(logger, config.get(CFG_LOGGER_QUEUE_SIZE, 100), overflow) for logger in loggers]
+
+        if loggers:
+            self.add_job(PeriodicJob("Loggers", config.get(CFG_LOGGING_PERIOD, period), self.log))
+
         self.write_to_disk = CFG_WRITE_TO_DISK in config
         if self.write_to_disk:
             journal.write("Will write data to disk")
-            self.csv = create_time_stamped_csv()
-            journal.write("Created file " + self.csv.name)
+            self.store = create_time_stamped_store([sensor[NAME] for sensor in config[CFG_SENSORS]],
+                                                   {NAME: config[NAME]},
+                                                   commit_records=config.get(CFG_COMMIT_RECORDS, 10),
+                                                   commit_seconds=config.get(CFG_COMMIT_SECONDS, 600))
+            journal.write("Created file " + self.store.name)
+            self.add_job(PeriodicJob("Disk", config.get(CFG_DISK_LOGGING_PERIOD, period), self.write))
 
-    def run(self) -> None:
+    def log(self):
+        temperatures = self.sampler.temperatures()
 
-        try:
-            next_read = time.time()
-            while self.keepAlive:
-                current_time = time.time()
-                if current_time > next_read:
-                    try:
-                        temperatures = read_temps(self.config)
+        for worker in self.workers:
+            worker.submit(temperatures)
 
-                        for logger in self.loggers:
-                            logger.log(temperatures)
+    def metrics(self) -> dict:
+        metrics = super().metrics()
 
-                        if self.write_to_disk:
-                            read = timestamp() + "," + self.config[NAME]
+        for worker in self.workers:
+            metrics[worker.logger.name] = worker.metrics()
 
-                            for temperature in temperatures:
-                                read += "," + str(temperatures[temperature])
+        return metrics
 
-                            read += "\n"
-                            self.csv.write(read)
-                            # `File` is buffered and therefore won't write straight to disk.
-                            # For debugging and making sure we don't miss any reads,
-                            # we force writer to write right-away with flush
-                            self.csv.flush()
+    def kill(self):
+        super().kill()
 
-                        next_read = current_time + self.delay_ms
-                    except Exception as e:
-                        print("Error:", str(e))
+        for worker in self.workers:
+            worker.kill()
 
-                time.sleep(0.5)  # This allows the thread to check for a kill signal
+    def write(self):
+        reading = self.sampler.latest()
 
-            journal.write("Logging thread finished")
+        self.store.append(reading.temperatures, reading.time)
 
+    def run(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+        try:
+            super().run()
+            journal.write("Logging thread finished")
         except Exception as e:
             print("Error:", str(e))
         finally:
             if self.write_to_disk:
-                self.csv.close()
+                self.store.close()
+
+    async def run_async(self):
+        """
+        Does the same as run, as a task on the running event loop. Each logger keeps its worker thread,
+        as the backends post with blocking requests.
+        """
+        for worker in self.workers:
+            worker.start()
+
+        try:
+            await super().run_async()
+            journal.write("Logging task finished")
+        finally:
+            for worker in self.workers:
+                worker.kill()
+            if self.write_to_disk:
+                self.store.close()
@@ -0,0 +1,148 @@
+import math
+from typing import Optional, Tuple
+
+from hardware_control.peltier_control import SoftwarePeltierDirectControl
+
+'''
+Åström–Hägglund relay autotuning.
+
+The Peltiers are switched between full heating and full cooling around the set point, like a thermostat without a
+dead band. The chamber then settles into an oscillation whose period is the ultimate period Pu of the process, and
+whose amplitude a gives the ultimate gain Ku = 4d / (π √(a² - ε²)), where d is the relay output (1, full power) and
+ε the relay hysteresis. The PID gains then follow from Ku and Pu with one of the classic tuning rules.
+'''
+
+RELAY_HYSTERESIS = 0.2  # Degrees, a few steps of the DS18B20's 0.0625 degree resolution so noise can't flip it
+RELAY_CYCLES = 3  # Oscillations that are averaged, after the first one which is still settling
+MAX_AUTOTUNE_TIME = 3 * 24 * 3600  # Seconds before giving up
+
+# Proportional gain as a fraction of Ku, and integral and derivative times as a fraction of Pu
+TUNING_RULES = {
+    "Ziegler-Nichols": (0.6, 1 / 2, 1 / 8),
+    "Tyreus-Luyben": (1 / 2.2, 2.2, 1 / 6.3),
+    "Pessen integral": (0.7, 0.4, 0.15),
+    "Some overshoot": (0.33, 1 / 2, 1 / 3),
+    "No overshoot": (0.2, 1 / 2, 1 / 3),
+}
+DEFAULT_TUNING_RULE = "Tyreus-Luyben"
+
+
+def tuning_gains(ultimate_gain: float, ultimate_period: float, rule: str = DEFAULT_TUNING_RULE) \
+        -> Tuple[float, float, float]:
+    """
+    :param ultimate_gain: Ku, in output per degree
+    :param ultimate_period: Pu, in seconds
+    :param rule: One of TUNING_RULES
+    :return: The proportional, integral and derivative gains
+    """
+    if rule not in TUNING_RULES:
+        raise ValueError("Unknown tuning rule '" + rule + "', use one of " + ", ".join(TUNING_RULES))
+
+    gain_factor, integral_factor, derivative_factor = TUNING_RULES[rule]
+    kp = gain_factor * ultimate_gain
+    ki = kp / (integral_factor * ultimate_period)
+    kd = kp * derivative_factor * ultimate_period
+
+    return kp, ki, kd
+
+
+class RelayAutotune:
+    """
+    Runs the relay experiment one sample at a time, so it can be driven by the thermostat's control loop.
+    """
+
+    def __init__(self, set_point: float, start_time: float, hysteresis: float = RELAY_HYSTERESIS,
+                 cycles: int = RELAY_CYCLES, max_time: float = MAX_AUTOTUNE_TIME):
+        """
+        :param set_point: Temperature to oscillate around
+        :param start_time: When the experiment starts, in seconds
+        :param hysteresis: How far past the set point the temperature has to go before the relay switches
+        :param cycles: Number of oscillations to measure
+        :param max_time: Seconds after which the experiment fails if it hasn't finished
+        """
+        self.set_point = set_point
+        self.start_time = start_time
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.max_time = max_time
+
+        self.state = SoftwarePeltierDirectControl.State.OFF
+        self.extreme = None  # Highest temperature while cooling, or lowest while heating
+        self.peak = None
+        self.trough = None
+        self.last_rise = None  # Time the relay last switched to cooling
+        self.periods = []
+        self.amplitudes = []
+        self.failed = False
+
+    @property
+    def done(self) -> bool:
+        # The first oscillation is dropped, as it still depends on where the temperature started
+        return len(self.periods) > self.cycles
+
+    def update(self, time_stamp: float, temp: float) -> SoftwarePeltierDirectControl.State:
+        """
+        :param time_stamp: Time of the read, in seconds
+        :param temp: The measured temperature
+        :return: What the Peltiers should do next
+        """
+        if time_stamp - self.start_time > self.max_time:
+            self.failed = True
+
+        if self.done or self.failed:
+            return SoftwarePeltierDirectControl.State.OFF
+
+        if self.state is SoftwarePeltierDirectControl.State.COOL:
+            self.extreme = max(self.extreme, temp)
+
+            if temp < self.set_point - self.hysteresis:
+                self.peak = self.extreme
+                self.state = SoftwarePeltierDirectControl.State.HEAT
+                self.extreme = temp
+
+        elif self.state is SoftwarePeltierDirectControl.State.HEAT:
+            self.extreme = min(self.extreme, temp)
+
+            if temp > self.set_point + self.hysteresis:
+                self.trough = self.extreme
+                self.state = SoftwarePeltierDirectControl.State.COOL
+                self.extreme = temp
+
+                if self.last_rise is not None and self.peak is not None:
+                    self.periods.append(time_stamp - self.last_rise)
+                    self.amplitudes.append((self.peak - self.trough) / 2)
+                self.last_rise = time_stamp
+
+        elif temp > self.set_point:
+            self.state = SoftwarePeltierDirectControl.State.COOL
+            self.extreme = temp
+        else:
+            self.state = SoftwarePeltierDirectControl.State.HEAT
+            self.extreme = temp
+
+        return self.state
+
+    def ultimate(self) -> Optional[Tuple[float, float]]:
+        """
+        :return: The ultimate gain Ku and ultimate period Pu in seconds, or None if the experiment hasn't finished
+        """
+        if not self.done:
+            return None
+
+        periods = self.periods[1:]
+        amplitudes = self.amplitudes[1:]
+        period = sum(periods) / len(periods)
+        amplitude = sum(amplitudes) / len(amplitudes)
+
+        # The oscillation can't be smaller than the hysteresis, but a coarse sensor can make it look like it
+        amplitude = max(amplitude, self.hysteresis * 1.1)
+        ultimate_gain = 4 / (math.pi * math.sqrt(amplitude ** 2 - self.hysteresis ** 2))
+
+        return ultimate_gain, period
+
+    def gains(self, rule: str = DEFAULT_TUNING_RULE) -> Optional[Tuple[float, float, float]]:
+        ultimate = self.ultimate()
+        if ultimate is None:
+            return None
+
+        return tuning_gains(*ultimate, rule)
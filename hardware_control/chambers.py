@@ -0,0 +1,285 @@
+import asyncio
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+from threading import Lock
+from typing import List
+
+import numpy as np
+
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from hardware_control.sensor_sampler import SensorSampler
+from hardware_control.thermostat import Thermostat
+from utilities.chamber_config import chamber_configs
+from utilities.clock import Clock
+from utilities.constants import *
+from utilities.control_channel import ControlServer
+from utilities.settings_channel import wait_for_any, write_settings_atomically, wait_for_any_async
+from utilities.telemetry import TelemetryWriter, telemetry_name
+
+# Used for the set point file of a chamber that doesn't have one yet
+DEFAULT_SETTINGS = {
+    SP_TEMP: 20,
+    SP_SAMPLING: 5,
+    SP_HEAT_TOLERANCE: 1,
+    SP_COOL_TOLERANCE: 0.1,
+    SP_MODE: MODE_HYSTERESIS,
+    SP_STATE: OFF,
+}
+LOOP_CPU_BUDGET = 0.05  # Seconds of CPU a pass over all the chambers may take before it gets reported
+
+
+def create_settings_file(path: str):
+    """
+    Writes DEFAULT_SETTINGS to the path, unless there already is a file.
+    """
+    if not os.path.exists(path):
+        journal.write("Creating set point file " + path)
+        write_settings_atomically(path, DEFAULT_SETTINGS)
+
+
+class ChamberScheduler:
+    """
+    Runs the thermostats of all the chambers in the config from one control loop, so they share one process,
+    one sensor sampler and one pigpio connection. Each chamber keeps its own set point file, profile, sampling
+    period and control mode: every pass runs the thermostats that are due, or whose settings changed,
+    and then sleeps until the next one is due or any set point file changes.
+    """
+
+    def __init__(self, config: dict, sampler: SensorSampler = None, clock: Clock = None,
+                 devices_folder: str = W1_DEVICES_FOLDER, control_socket: str = None, telemetry: bool = False):
+        """
+        :param config: the contents of a config.json type file, with or without CFG_CHAMBERS
+        :param sampler: Sampler reading the sensors of all the chambers, see sensors_config
+        :param clock: Where the control loop gets the time from, the real time by default
+        :param devices_folder: Folder with the 1-wire devices, can be changed to point at a fake sysfs tree
+        :param control_socket: If given, run answers the commands of the web server on this Unix socket,
+                               see handle_command
+        :param telemetry: Whether to record every run of the thermostats in shared memory, see utilities/telemetry.py
+        """
+        self.clock = clock if clock is not None else Clock()
+        self.control_socket = control_socket
+        self.lock = Lock()  # Held while the thermostats run, so commands apply between passes
+        self.sampler = sampler
+        self.telemetry = telemetry
+        self.telemetry_writers: List[TelemetryWriter] = []
+        self.thermostats: List[Thermostat] = []
+
+        for chamber in chamber_configs(config):
+            create_settings_file(chamber[CFG_SET_POINT_FILE])
+            self.thermostats.append(Thermostat(chamber, sampler, clock=self.clock, devices_folder=devices_folder))
+
+        self.next_reads = [self.clock.time()] * len(self.thermostats)
+        self.failed = set()  # Thermostats whose last sample failed, they only run again when next due
+        self.alive = True
+        self.loop_cpu_time = 0.0  # Seconds of CPU the last pass took
+
+    def __enter__(self):
+        journal.write("Chamber control starting")
+        self.process = Process(target=self.run)
+        self.process.daemon = True
+        self.process.start()
+
+    def __exit__(self, e_t, e_v, trc):
+        self.kill()
+
+    def kill(self):
+        self.alive = False
+        for thermostat in self.thermostats:
+            thermostat.kill()
+
+    def iterate(self) -> float:
+        """
+        Runs the thermostats that are due. A thermostat that fails is turned off, and tried again at its next
+        sample without holding up the other chambers.
+
+        :return: The time the next thermostat is due, in seconds since the epoch
+        """
+        cpu_start = time.thread_time()
+
+        with self.lock:
+            for index, thermostat in enumerate(self.thermostats):
+                settings_changed = index not in self.failed and thermostat.settings.changed()
+
+                if self.clock.time() < self.next_reads[index] and not settings_changed:
+                    continue
+
+                self.run_thermostat(index)
+
+        self.loop_cpu_time = time.thread_time() - cpu_start
+        if self.loop_cpu_time > LOOP_CPU_BUDGET:
+            journal.write("Controlling " + str(len(self.thermostats)) + " chambers took " +
+                          str(round(self.loop_cpu_time * 1000, 1)) + " ms of CPU")
+
+        return min(self.next_reads)
+
+    def run_thermostat(self, index: int):
+        """
+        Runs one sample of a thermostat. A thermostat that fails is turned off, and tried again at its next sample.
+        """
+        thermostat = self.thermostats[index]
+        now = self.clock.time()
+        start = time.perf_counter()
+
+        try:
+            self.next_reads[index] = thermostat.iterate()
+            self.failed.discard(index)
+        except Exception as e:
+            thermostat.log("Control failed, turning the Peltiers off until the next sample: " + str(e))
+            thermostat.set_state(False)
+            self.next_reads[index] = now + thermostat.sampling
+            self.failed.add(index)
+
+        if self.telemetry_writers:
+            self.record(index, now, time.perf_counter() - start)
+
+    def record(self, index: int, now: float, duration: float):
+        """
+        Appends what a thermostat just did to its telemetry buffer.
+        """
+        thermostat = self.thermostats[index]
+        on = thermostat.on and thermostat.last_temp is not None
+
+        self.telemetry_writers[index].append(
+            now, thermostat.last_temp if on else np.nan, thermostat.target_temp, thermostat.heating_threshold,
+            thermostat.cooling_threshold, thermostat.previous_state.value, thermostat.duty,
+            thermostat.fan_speed if thermostat.on else 0, duration)
+
+    def open_telemetry(self):
+        """
+        Creates the telemetry buffers, in the process running the control loop, if telemetry is turned on.
+        """
+        if not self.telemetry:
+            return
+
+        try:
+            for thermostat in self.thermostats:
+                self.telemetry_writers.append(TelemetryWriter(telemetry_name(thermostat.name)))
+        except OSError as e:
+            journal.write("Could not create the telemetry buffers, running without them: " + str(e))
+            self.close_telemetry()
+
+    def close_telemetry(self):
+        for writer in self.telemetry_writers:
+            writer.close()
+        self.telemetry_writers = []
+
+    def thermostat_for(self, chamber: str = None) -> int:
+        """
+        :param chamber: Name of the chamber, the first chamber if not given
+        :return: The index of the chamber's thermostat
+        """
+        if chamber is None:
+            return 0
+
+        for index, thermostat in enumerate(self.thermostats):
+            if thermostat.name == chamber:
+                return index
+
+        raise ValueError("No chamber named '" + str(chamber) + "'")
+
+    def handle_command(self, message: dict) -> dict:
+        """
+        Answers a command from the web server, between two passes of the control loop:
+         - CTL_GET_STATE: the live state of the chamber's thermostat
+         - CTL_UPDATE: changes some of the chamber's settings and runs its thermostat straight away. The settings
+           are written to its set point file as well, so they survive a restart. The reply has the live state
+           after the change, and the previous value of every setting in CTL_PREVIOUS.
+
+        :param message: The command, and the name of the chamber in CLI_CHAMBER unless it's the first one
+        """
+        command = message.get(CTL_COMMAND)
+
+        with self.lock:
+            index = self.thermostat_for(message.get(CLI_CHAMBER))
+            thermostat = self.thermostats[index]
+
+            if command == CTL_GET_STATE:
+                return {CTL_STATE: thermostat.live_state()}
+
+            if command == CTL_UPDATE:
+                changes = message[CTL_SETTINGS]
+                settings = dict(thermostat.settings.read())
+                previous = {key: settings.get(key) for key in changes}
+
+                settings.update(changes)
+                write_settings_atomically(thermostat.settings.path, settings)
+                thermostat.settings.read()  # So the control loop doesn't run it again for the same change
+
+                self.failed.discard(index)
+                self.run_thermostat(index)
+
+                return {CTL_STATE: thermostat.live_state(), CTL_PREVIOUS: previous}
+
+        raise ValueError("Unknown command " + str(command))
+
+    def watchers(self) -> list:
+        """
+        :return: The settings of the chambers that should be run straight away when they change
+        """
+        return [thermostat.settings for index, thermostat in enumerate(self.thermostats) if index not in self.failed]
+
+    def run(self) -> None:
+        control_server = None
+        try:
+            # The sampler thread has to be started in the process running the control loop
+            if self.sampler is not None and not self.sampler.is_alive():
+                self.sampler.start()
+
+            journal.write("Controlling chambers " + ", ".join(thermostat.name for thermostat in self.thermostats))
+            self.open_telemetry()
+
+            if self.control_socket is not None:
+                control_server = ControlServer(self.control_socket, self.handle_command)
+                control_server.start()
+
+            while self.alive:
+                next_read = self.iterate()
+
+                # Sleep until the next read, but wake up straight away if any chamber's settings change
+                wait_for_any(self.watchers(), next_read - self.clock.time())
+
+        except BaseException as e:
+            journal.write(traceback.format_exc())
+            journal.write("Exception occurred:" + str(e))
+        finally:
+            journal.write("Chamber control loop stopped")
+            if control_server is not None:
+                control_server.kill()
+            for thermostat in self.thermostats:
+                thermostat.set_state(False)
+            self.close_telemetry()
+
+    async def run_async(self):
+        """
+        Does the same as run, as a task on the running event loop instead of in a process of its own. The
+        thermostats run in a thread of the control loop's own, as they wait for readings and drive the Peltiers,
+        so a pass never waits for a worker of the loop's default executor busy with requests.
+        The sampler has to be run on the same loop, see SensorSampler.run_async.
+        """
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chamber-control")
+
+        try:
+            journal.write("Controlling chambers " + ", ".join(thermostat.name for thermostat in self.thermostats))
+            self.open_telemetry()
+
+            while self.alive:
+                next_read = await loop.run_in_executor(executor, self.iterate)
+
+                # Sleep until the next read, but wake up straight away if any chamber's settings change
+                await wait_for_any_async(self.watchers(), next_read - self.clock.time())
+
+        except Exception as e:
+            journal.write(traceback.format_exc())
+            journal.write("Exception occurred:" + str(e))
+        finally:
+            journal.write("Chamber control loop stopped")
+            for thermostat in self.thermostats:
+                thermostat.set_state(False)
+            self.close_telemetry()
+            executor.shutdown(wait=False)
@@ -1,13 +1,24 @@
-import pigpio
-
-pins = pigpio.pi()
+from hardware_control import gpio
 
 fan_pin = 19
 frequency = 25000  # 25 kHz
 max_duty_cycle = 1000000  # from pigpiod
 
+# Only these pins can do hardware PWM, and there are only two channels: 12 and 18 share one, 13 and 19 the other.
+# pigpio applies a duty cycle to every pin of the channel, so two fans can't be on the same channel, see
+# check_chambers_are_independent. Fans of any further chambers use pigpio's software PWM, which tops out at 8 kHz.
+hardware_pwm_channels = {12: 0, 18: 0, 13: 1, 19: 1}
+hardware_pwm_pins = tuple(hardware_pwm_channels)
+software_frequency = 8000  # Hz
+software_range = 1000
+
 
-def set_fan_speed(speed):
+def set_fan_speed(speed, pin: int = fan_pin):
+    """
+    :param speed: From 0 to 1, anything between 0 and 0.1 runs the fan at 0.1
+    :param pin: Pin the fan's PWM wire is connected to
+    """
+    pins = gpio.pi()
 
     if not pins.connected:
         raise Exception("Could not connect to pigpio")
@@ -21,6 +32,12 @@ def set_fan_speed(speed):
     if speed > 1:
         speed = 1
 
+    if pin not in hardware_pwm_pins:
+        gpio.set_PWM_frequency(pin, software_frequency)
+        gpio.set_PWM_range(pin, software_range)
+        gpio.set_PWM_dutycycle(pin, int(speed * software_range))
+        return
+
     speed = int(speed * max_duty_cycle)
 
-    pins.hardware_PWM(fan_pin, frequency, speed)
+    pins.hardware_PWM(pin, frequency, speed)
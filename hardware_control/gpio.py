@@ -0,0 +1,117 @@
+from typing import Iterable
+
+'''
+All pigpio access goes through the connection returned by pi(), so the whole process shares one connection to
+pigpiod and the hardware can be swapped for a stand-in, e.g. the simulation in hardware_control.simulation.
+
+Every pigpio call is a round-trip over the socket to pigpiod, so this module also offers a few cheaper ways to
+drive the pins: whole groups of pins are switched with one bank write, and PWM settings are only sent when they
+change. The caches assume this process is the only one changing the PWM settings of its pins.
+'''
+
+OUTPUT = 1  # pigpio.OUTPUT
+
+backend = None
+outputs = set()  # Pins set up as plain outputs, which the bank writes can drive
+pwm_ranges = {}
+pwm_frequencies = {}
+
+
+def pi():
+    """
+    :return: The pigpio connection, opened on first use
+    """
+    global backend
+
+    if backend is None:
+        import pigpio
+
+        backend = pigpio.pi()
+
+    return backend
+
+
+def use_backend(new_backend):
+    """
+    Replaces the pigpio connection with anything that offers the same methods.
+    """
+    global backend
+    backend = new_backend
+
+    # The new connection may have any settings
+    outputs.clear()
+    pwm_ranges.clear()
+    pwm_frequencies.clear()
+
+
+def pin_mask(pins: Iterable[int]) -> int:
+    """
+    :return: The bits of the given pins, for the bank writes
+    """
+    mask = 0
+    for pin in pins:
+        if not 0 <= pin < 32:
+            raise ValueError("Only GPIO 0 to 31 can be written as a bank, not " + str(pin))
+        mask |= 1 << pin
+
+    return mask
+
+
+def claim_outputs(pins: Iterable[int]):
+    """
+    Makes the pins plain outputs, set low, the first time they are used. The bank writes only change the level of
+    a pin, they neither set its mode nor stop PWM running on it, while a normal write does both.
+    """
+    for pin in pins:
+        if pin not in outputs:
+            pi().write(pin, 0)
+            outputs.add(pin)
+
+
+def write_bank(high: Iterable[int], low: Iterable[int]):
+    """
+    Switches pins with at most two round-trips: first all the low pins are cleared in one go, then all the high
+    pins are set. Pins that must never be on together, like the two sides of an H-bridge, are therefore never
+    both on, not even briefly.
+
+    :param high: Pins to switch on
+    :param low: Pins to switch off
+    """
+    high = list(high)
+    low = list(low)
+    claim_outputs(high + low)
+
+    high_mask = pin_mask(high)
+    low_mask = pin_mask(low) & ~high_mask
+    pins = pi()
+
+    if low_mask:
+        pins.clear_bank_1(low_mask)
+    if high_mask:
+        pins.set_bank_1(high_mask)
+
+
+def set_PWM_range(pin: int, pwm_range: int):
+    """
+    pigpio's set_PWM_range, only sent if the range changed.
+    """
+    if pwm_ranges.get(pin) != pwm_range:
+        pi().set_PWM_range(pin, pwm_range)
+        pwm_ranges[pin] = pwm_range
+
+
+def set_PWM_frequency(pin: int, frequency: int):
+    """
+    pigpio's set_PWM_frequency, only sent if the frequency changed.
+    """
+    if pwm_frequencies.get(pin) != frequency:
+        pi().set_PWM_frequency(pin, frequency)
+        pwm_frequencies[pin] = frequency
+
+
+def set_PWM_dutycycle(pin: int, duty_cycle: int):
+    """
+    pigpio's set_PWM_dutycycle. The pin is no longer a plain output afterwards, see claim_outputs.
+    """
+    outputs.discard(pin)
+    pi().set_PWM_dutycycle(pin, duty_cycle)
@@ -2,13 +2,10 @@
 import os
 from enum import Enum
 
-import pigpio
-
-from hardware_control.fan_control import set_fan_speed
+from hardware_control import gpio, wave_pwm
+from hardware_control.fan_control import set_fan_speed, fan_pin
 from hardware_control.slow_pwm import SlowPWM
 
-pin_control = pigpio.pi()
-
 
 class SoftwarePeltierDirectControl:
     # Pins for cooling
@@ -22,38 +19,37 @@ class SoftwarePeltierDirectControl:
         COOL = -1
         OFF = 0
 
+    def __init__(self, heating_pins: list = None, cooling_pins: list = None):
+        """
+        :param heating_pins: Pins that make the Peltiers heat, heating_pin_numbers by default
+        :param cooling_pins: Pins that make the Peltiers cool, cooling_pin_numbers by default
+        """
+        if heating_pins is not None:
+            self.heating_pin_numbers = heating_pins
+
+        if cooling_pins is not None:
+            self.cooling_pin_numbers = cooling_pins
+
     def stop(self):
         """
         Turns off peltiers.
         """
-        for pin in self.cooling_pin_numbers:
-            pin_control.write(pin, 0)
-
-        for pin in self.heating_pin_numbers:
-            pin_control.write(pin, 0)
+        gpio.write_bank([], self.cooling_pin_numbers + self.heating_pin_numbers)
 
     def set_state(self, state: State):
         """
         Starts, stops or modifies the pwm control of the peltiers.
+        The gates of the other direction are always switched off before any are switched on, in one bank write each.
 
         :param state: Set state to heat, cool or off
         """
 
         if state is self.State.OFF:
             self.stop()
+        elif state is self.State.HEAT:
+            gpio.write_bank(self.heating_pin_numbers, self.cooling_pin_numbers)
         else:
-            if state is self.State.HEAT:
-                for pin in self.cooling_pin_numbers:
-                    pin_control.write(pin, 0)
-
-                for pin in self.heating_pin_numbers:
-                    pin_control.write(pin, 1)
-            else:
-                for pin in self.cooling_pin_numbers:
-                    pin_control.write(pin, 1)
-
-                for pin in self.heating_pin_numbers:
-                    pin_control.write(pin, 0)
+            gpio.write_bank(self.cooling_pin_numbers, self.heating_pin_numbers)
 
 
 class SoftwarePeltierPWMControl:
@@ -63,26 +59,54 @@ class SoftwarePeltierPWMControl:
     # Pins for heating
     heating_pin_numbers = [22, 25]
 
-    def __init__(self, frequency):
+    def __init__(self, frequency, heating_pins: list = None, cooling_pins: list = None, fan: int = fan_pin):
+        """
+        :param frequency: PWM frequency in Hz
+        :param heating_pins: Pins that make the Peltiers heat, heating_pin_numbers by default
+        :param cooling_pins: Pins that make the Peltiers cool, cooling_pin_numbers by default
+        :param fan: Pin of the fan that gets turned off along with the Peltiers
+        """
         self.frequency = frequency
+        self.fan_pin = fan
+
+        if heating_pins is not None:
+            self.heating_pin_numbers = heating_pins
+
+        if cooling_pins is not None:
+            self.cooling_pin_numbers = cooling_pins
 
-        self.cooling_pins_control = SlowPWM(self.cooling_pin_numbers,
-                                            frequency=self.frequency,
-                                            duty_cycle=0)
-        self.heating_pins_control = SlowPWM(self.heating_pin_numbers,
-                                            frequency=self.frequency,
-                                            duty_cycle=0)
+        self.cooling_pins_control = self.create_pwm(self.cooling_pin_numbers)
+        self.heating_pins_control = self.create_pwm(self.heating_pin_numbers)
 
         self.cooling_pins_control.start()
         self.heating_pins_control.start()
 
-    def stop(self):
+    def create_pwm(self, pins: list):
+        """
+        :return: What drives the pins of one direction, at zero duty cycle
+        """
+        return SlowPWM(pins, frequency=self.frequency, duty_cycle=0)
+
+    def set_duty_cycles(self, heating: float, cooling: float):
+        """
+        Sets the duty cycle of both directions, switching one off before switching the other on.
+        """
+        if heating > 0:
+            self.cooling_pins_control.duty_cycle = cooling
+            self.heating_pins_control.duty_cycle = heating
+        else:
+            self.heating_pins_control.duty_cycle = heating
+            self.cooling_pins_control.duty_cycle = cooling
+
+    def stop(self, fans: bool = True):
         """
         Turns off peltiers.
+
+        :param fans: Whether to turn the fan off too, or leave it at the speed it was set to
         """
-        self.cooling_pins_control.duty_cycle = 0
-        self.heating_pins_control.duty_cycle = 0
-        set_fan_speed(0)
+        self.set_duty_cycles(0, 0)
+        if fans:
+            set_fan_speed(0, self.fan_pin)
 
     def kill(self):
         """
@@ -97,7 +121,8 @@ class SoftwarePeltierPWMControl:
         """
         Starts, stops or modifies the pwm control of the peltiers.
 
-        :param duty_cycle: Duty cycle from -1 to 1. 1 will heat, -1 will cool, 0 will stop the peltiers.
+        :param duty_cycle: Duty cycle from -1 to 1. 1 will heat, -1 will cool, 0 will stop the peltiers and the fan,
+                           see stop to leave the fan running.
         """
 
         if not -1 <= duty_cycle <= 1:
@@ -106,16 +131,27 @@ class SoftwarePeltierPWMControl:
         heat = duty_cycle > 0
         duty_cycle = abs(duty_cycle)
 
-        if duty_cycle is 0:
+        if duty_cycle == 0:
             self.stop()
             return
 
         if heat:
-            self.cooling_pins_control.duty_cycle = 0
-            self.heating_pins_control.duty_cycle = duty_cycle
+            self.set_duty_cycles(duty_cycle, 0)
         else:
-            self.cooling_pins_control.duty_cycle = duty_cycle
-            self.heating_pins_control.duty_cycle = 0
+            self.set_duty_cycles(0, duty_cycle)
+
+
+class WavePeltierPWMControl(SoftwarePeltierPWMControl):
+    """
+    SoftwarePeltierPWMControl with the PWM played back by pigpiod from a DMA wave instead of toggled by a Python
+    thread, see wave_pwm. Both directions change with one new wave, whose dead time keeps them from overlapping.
+    """
+
+    def create_pwm(self, pins: list):
+        return wave_pwm.WavePWM(pins, frequency=self.frequency, duty_cycle=0)
+
+    def set_duty_cycles(self, heating: float, cooling: float):
+        wave_pwm.set_duty_cycles({self.heating_pins_control: heating, self.cooling_pins_control: cooling})
 
 
 # Hardware PWM constants
@@ -139,32 +175,28 @@ def set_hw_pwm_peltier_control(power):
 
     power = int(power * pwm_range)
 
-    pin_control.set_PWM_range(SoftwarePeltierPWMControl.cooling_pin_numbers[0], pwm_range)
-    pin_control.set_PWM_range(SoftwarePeltierPWMControl.cooling_pin_numbers[1], pwm_range)
-    pin_control.set_PWM_range(SoftwarePeltierPWMControl.heating_pin_numbers[0], pwm_range)
-    pin_control.set_PWM_range(SoftwarePeltierPWMControl.heating_pin_numbers[1], pwm_range)
+    heating_pins = SoftwarePeltierPWMControl.heating_pin_numbers
+    cooling_pins = SoftwarePeltierPWMControl.cooling_pin_numbers
 
-    pin_control.set_PWM_frequency(SoftwarePeltierPWMControl.cooling_pin_numbers[0], pwm_frequency)
-    pin_control.set_PWM_frequency(SoftwarePeltierPWMControl.cooling_pin_numbers[1], pwm_frequency)
-    pin_control.set_PWM_frequency(SoftwarePeltierPWMControl.heating_pin_numbers[0], pwm_frequency)
-    pin_control.set_PWM_frequency(SoftwarePeltierPWMControl.heating_pin_numbers[1], pwm_frequency)
+    # Only sent the first time, or when they change
+    for pin in cooling_pins + heating_pins:
+        gpio.set_PWM_range(pin, pwm_range)
+        gpio.set_PWM_frequency(pin, pwm_frequency)
 
     if power == 0:
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.cooling_pin_numbers[0], 0)
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.cooling_pin_numbers[1], 0)
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.heating_pin_numbers[0], 0)
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.heating_pin_numbers[1], 0)
+        for pin in cooling_pins + heating_pins:
+            gpio.set_PWM_dutycycle(pin, 0)
 
     elif heat:
         # It's important to first turn off the other gates
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.cooling_pin_numbers[0], 0)
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.cooling_pin_numbers[1], 0)
+        for pin in cooling_pins:
+            gpio.set_PWM_dutycycle(pin, 0)
 
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.heating_pin_numbers[0], power)
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.heating_pin_numbers[1], power)
+        for pin in heating_pins:
+            gpio.set_PWM_dutycycle(pin, power)
     else:  # Will cool
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.heating_pin_numbers[0], 0)
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.heating_pin_numbers[1], 0)
+        for pin in heating_pins:
+            gpio.set_PWM_dutycycle(pin, 0)
 
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.cooling_pin_numbers[0], power)
-        pin_control.set_PWM_dutycycle(SoftwarePeltierPWMControl.cooling_pin_numbers[1], power)
+        for pin in cooling_pins:
+            gpio.set_PWM_dutycycle(pin, power)
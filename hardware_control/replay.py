@@ -0,0 +1,312 @@
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from hardware_control import gpio
+from hardware_control.fan_control import set_fan_speed
+from hardware_control.simulation import ThermalModel, SimulatedPi, FakeW1Bus, SimulatedChamber, AveragedPeltierPWM
+from hardware_control.temperature_sensors import read_temp
+from hardware_control.thermostat import Thermostat
+from utilities.clock import SimulatedClock
+from utilities.constants import NAME, CFG_SENSORS, CFG_SENSOR_SERIAL, TYPE, SENSOR_TYPE_MAIN, SENSOR_TYPE_ROOM, \
+    CFG_FAN_SPEED, SP_STATE, ON, MODE_PID, MODE_PREDICTIVE, SP_TEMP, SP_SAMPLING, SP_HEAT_TOLERANCE, \
+    SP_COOL_TOLERANCE, SP_TARGET, SP_DATE, SP_RAMP
+from utilities.settings_channel import write_settings_atomically
+from utilities.time_series import TimeSeries
+from utilities.time_temp_parser import compile_profile, TIME_STAMP_FORMAT
+
+'''
+Replays temperature profiles through control strategies on the simulated chamber, in simulated time,
+and measures how well each strategy tracks the profile and what it costs.
+'''
+
+MAIN_SERIAL = "28-000000000001"
+ROOM_SERIAL = "28-000000000002"
+
+
+def benchmark_profile() -> dict:
+    """
+    A two week fermentation: a hold, a ramp up for a diacetyl rest and a cold crash.
+    """
+    start = datetime(2021, 8, 5, 17, 30)
+    set_points = [
+        {SP_TARGET: 12, SP_DATE: start},
+        {SP_TARGET: 12, SP_DATE: start + timedelta(days=5)},
+        {SP_TARGET: 16, SP_DATE: start + timedelta(days=7), TYPE: SP_RAMP},
+        {SP_TARGET: 16, SP_DATE: start + timedelta(days=10)},
+        {SP_TARGET: 2, SP_DATE: start + timedelta(days=10, hours=1)},
+    ]
+
+    for set_point in set_points:
+        set_point[SP_DATE] = set_point[SP_DATE].strftime(TIME_STAMP_FORMAT)
+
+    return {
+        SP_TEMP: set_points,
+        SP_SAMPLING: 30,
+        SP_HEAT_TOLERANCE: 1,
+        SP_COOL_TOLERANCE: 0.1,
+    }
+
+
+def ambient_from_log(path: str, sensor: str) -> Callable[[float], float]:
+    """
+    Uses a logged room temperature trace as the ambient temperature of a simulation.
+    The start of the log lines up with the start of the simulation.
+
+    :param path: A binary temperature log
+    :param sensor: Name of the room temperature sensor in the log
+    :return: A function of the simulation time, in seconds, for ThermalModel's ambient parameter
+    """
+    series = TimeSeries(path)
+    temps = np.array(series.sensor(sensor), dtype=np.float64)
+    valid = ~np.isnan(temps)
+    times = (series.times[valid] - series.times[valid][0]).astype(np.float64)
+    temps = temps[valid]
+
+    return lambda seconds: float(np.interp(seconds, times, temps))
+
+
+class ReplayMetrics:
+    """
+    Collects what happened during a replay and summarises it.
+    """
+
+    def __init__(self, settle_band: float = 0.5):
+        """
+        :param settle_band: How close, in degrees, the temperature has to stay to the target to count as settled
+        """
+        self.settle_band = settle_band
+        self.times = []
+        self.temps = []
+        self.targets = []
+        self.durations = []
+        self.duties = []
+        self.cpu_times = []
+
+    def record(self, time_stamp: float, temp: float, target: float, duty: float, duration: float, cpu_time: float):
+        self.times.append(time_stamp)
+        self.temps.append(temp)
+        self.targets.append(target)
+        self.duties.append(duty)
+        self.durations.append(duration)
+        self.cpu_times.append(cpu_time)
+
+    def steps(self, targets: np.ndarray) -> list:
+        """
+        :return: Indices at which the target jumps by more than the settle band, plus the start
+        """
+        jumps = np.nonzero(np.abs(np.diff(targets)) > self.settle_band)[0] + 1
+
+        return [0] + jumps.tolist()
+
+    def result(self, energy: float) -> dict:
+        """
+        :param energy: Heat pumped by the Peltiers during the replay, in J
+        """
+        times = np.array(self.times)
+        temps = np.array(self.temps)
+        targets = np.array(self.targets)
+        durations = np.array(self.durations)
+        duties = np.array(self.duties)
+        errors = temps - targets
+
+        overshoot = 0.0
+        settling_times = []
+        steps = self.steps(targets)
+        for step, start in enumerate(steps):
+            end = steps[step + 1] if step + 1 < len(steps) else len(times)
+            step_errors = errors[start:end]
+
+            # The direction we need to move in to reach the target
+            direction = -np.sign(step_errors[0])
+            if direction == 0:
+                continue
+
+            crossed = np.nonzero(direction * step_errors >= 0)[0]
+            if len(crossed):
+                overshoot = max(overshoot, float(np.max(direction * step_errors[crossed[0]:])))
+
+            unsettled = np.nonzero(np.abs(step_errors) > self.settle_band)[0]
+            if len(unsettled):
+                settle_index = min(start + unsettled[-1] + 1, len(times) - 1)
+                settling_times.append(float(times[settle_index] - times[start]))
+
+        states = np.sign(duties)
+        state_changes = int(np.count_nonzero(np.diff(states)))
+
+        return {
+            "rms error": float(np.sqrt(np.sum(errors ** 2 * durations) / np.sum(durations))),
+            "max error": float(np.max(np.abs(errors))),
+            "overshoot": overshoot,
+            "mean settling time": float(np.mean(settling_times)) if settling_times else 0.0,
+            "max settling time": float(np.max(settling_times)) if settling_times else 0.0,
+            "peltier energy kWh": energy / 3.6e6,
+            "peltier duty hours": float(np.sum(np.abs(duties) * durations) / 3600),
+            "state changes": state_changes,
+            "iterations": len(times),
+            "cpu time per iteration us": float(np.mean(self.cpu_times) * 1e6),
+        }
+
+
+class ControlStrategy:
+    """
+    Something that controls the simulated chamber during a replay.
+    """
+    name = "Strategy"
+
+    def start(self, replay: 'Replay'):
+        """
+        Called once before the replay starts, after the simulated hardware has been set up.
+        """
+        pass
+
+    def control(self, now: float) -> Tuple[Optional[float], float]:
+        """
+        Runs one iteration of the control loop.
+
+        :param now: Simulated time in seconds since the epoch
+        :return: The Peltier duty from -1 to 1, or None if the strategy set the pins directly,
+                 and the time the strategy next wants to run
+        """
+        raise NotImplementedError()
+
+
+class ThermostatStrategy(ControlStrategy):
+    """
+    The Thermostat class itself, driven through its iterate method with the replay's simulated clock.
+    In PID and predictive mode its Peltier PWM is replaced by AveragedPeltierPWM.
+    """
+    name = "Thermostat"
+
+    def __init__(self, settings: dict = None):
+        """
+        :param settings: Entries to add to, or replace in, the replay's set point settings
+        """
+        self.settings = settings or {}
+
+    def start(self, replay: 'Replay'):
+        replay.write_settings(self.settings)
+        self.pwm_control = AveragedPeltierPWM()
+        self.thermostat = Thermostat(replay.config, settings_file=replay.settings_file, clock=replay.clock,
+                                     devices_folder=replay.devices_folder, pwm_control=self.pwm_control)
+
+    def control(self, now: float) -> Tuple[Optional[float], float]:
+        next_time = self.thermostat.iterate()
+
+        if self.thermostat.mode in (MODE_PID, MODE_PREDICTIVE):
+            return self.pwm_control.duty_cycle, next_time
+
+        return None, next_time
+
+
+class SimplePIDStrategy(ControlStrategy):
+    """
+    The simple_pid controller from utilities/pid-test.py, with the gains and settings used there.
+    """
+    name = "simple_pid"
+
+    def __init__(self, kp: float = 1.65, ki: float = 0.00407, kd: float = 145.2, sample_time: float = 30,
+                 output_limits: Tuple[float, float] = (-1, 1)):
+        self.gains = (kp, ki, kd)
+        self.sample_time = sample_time
+        self.output_limits = output_limits
+
+    def start(self, replay: 'Replay'):
+        # noinspection PyUnresolvedReferences
+        from simple_pid import PID
+
+        self.replay = replay
+        self.pid = PID(*self.gains)
+        self.pid.output_limits = self.output_limits
+        self.pid.proportional_on_measurement = True
+        set_fan_speed(replay.config[CFG_FAN_SPEED])
+
+    def control(self, now: float) -> Tuple[Optional[float], float]:
+        self.pid.setpoint = self.replay.profile.temp_at(now)
+        duty = self.pid(read_temp(self.replay.temp_file), dt=self.sample_time)
+
+        return duty, now + self.sample_time
+
+
+class Replay:
+    """
+    A simulated chamber following a temperature profile, in simulated time.
+    """
+
+    def __init__(self, settings: dict, days: float, model: Callable[[], ThermalModel] = ThermalModel,
+                 start: float = None, fan_speed: float = 0.4, min_step: float = 1):
+        """
+        :param settings: Contents of a set point file with the temperature profile to follow
+        :param days: Length of the replay
+        :param model: Creates a fresh thermal model for every strategy
+        :param start: Simulated start time in seconds since the epoch, defaults to the start of the profile
+        :param fan_speed: Fan speed the strategies should use
+        :param min_step: Shortest time step of the simulation, in seconds
+        """
+        self.settings = dict(settings)
+        self.settings[SP_STATE] = ON
+        self.profile = compile_profile(self.settings)
+        self.start_time = start if start is not None else self.profile.times[0]
+        self.duration = days * 24 * 3600
+        self.model = model
+        self.min_step = min_step
+
+        self.config = {
+            NAME: "Replay",
+            CFG_SENSORS: [
+                {NAME: "Temperature", CFG_SENSOR_SERIAL: MAIN_SERIAL, TYPE: SENSOR_TYPE_MAIN},
+                {NAME: "Room Temperature", CFG_SENSOR_SERIAL: ROOM_SERIAL, TYPE: SENSOR_TYPE_ROOM},
+            ],
+            CFG_FAN_SPEED: fan_speed,
+        }
+
+    def write_settings(self, overrides: dict):
+        settings = dict(self.settings)
+        settings.update(overrides)
+        write_settings_atomically(self.settings_file, settings)
+
+    def run(self, strategy: ControlStrategy) -> dict:
+        """
+        Replays the profile with the given strategy.
+
+        :return: The metrics of the run, see ReplayMetrics.result
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            self.devices_folder = os.path.join(folder, "devices")
+            self.settings_file = os.path.join(folder, "set_point.json")
+            self.write_settings({})
+
+            self.clock = SimulatedClock(self.start_time)
+            self.pins = SimulatedPi()
+            gpio.use_backend(self.pins)
+
+            model = self.model()
+            bus = FakeW1Bus(self.devices_folder)
+            self.chamber = SimulatedChamber(model, self.pins, bus, MAIN_SERIAL, ROOM_SERIAL)
+            self.temp_file = bus.location(MAIN_SERIAL)
+
+            strategy.start(self)
+            metrics = ReplayMetrics()
+            end = self.start_time + self.duration
+
+            while self.clock.time() < end:
+                now = self.clock.time()
+
+                cpu_start = time.process_time()
+                duty, next_time = strategy.control(now)
+                cpu_time = time.process_time() - cpu_start
+
+                if duty is None:
+                    duty = self.chamber.peltier_duty()
+
+                dt = max(next_time - now, self.min_step)
+                metrics.record(now, model.wort_temp, self.profile.temp_at(now), duty, dt, cpu_time)
+
+                self.chamber.step(dt, duty)
+                self.clock.advance(dt)
+
+            return metrics.result(model.energy)
@@ -0,0 +1,195 @@
+from collections import deque
+from typing import Optional
+
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from utilities.constants import CFG_SENSORS, NAME, CFG_FILTER, CFG_PROCESS_NOISE, CFG_MEASUREMENT_NOISE, \
+    CFG_FILTER_WINDOW, CFG_MAX_RATE, FILTER_KALMAN, FILTER_MEDIAN, FILTER_NONE
+
+'''
+Cleans up temperature reads before anything uses them.
+
+DS18B20 probes report 85.0 C after a power-on reset and -127.0 C when the driver can't talk to them, and the odd
+read is simply wrong despite passing the CRC check. Those reads are thrown away, as is any read that moved further
+from the current estimate than the temperature could have in the time since. What is left is smoothed with either a
+Kalman filter or a running median.
+'''
+
+SENTINEL_TEMPERATURES = (85.0, -127.0)
+MAX_REJECTIONS = 5  # After this many rejected reads in a row the sensor is trusted again, e.g. after moving a probe
+RATE_MARGIN = 1.0  # Degrees a read may be off by on top of the maximum rate, for sensor noise
+
+
+class KalmanFilter:
+    """
+    One dimensional Kalman filter for a temperature that drifts as a random walk.
+    """
+
+    def __init__(self, process_noise: float, measurement_noise: float):
+        """
+        :param process_noise: How much the real temperature can wander, as a variance per second
+        :param measurement_noise: Variance of the sensor's noise
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.estimate = None
+        self.variance = None
+
+    def update(self, measurement: float, dt: float) -> float:
+        if self.estimate is None:
+            self.estimate = measurement
+            self.variance = self.measurement_noise
+            return self.estimate
+
+        self.variance += self.process_noise * dt
+        gain = self.variance / (self.variance + self.measurement_noise)
+        self.estimate += gain * (measurement - self.estimate)
+        self.variance *= 1 - gain
+
+        return self.estimate
+
+    def reset(self):
+        self.estimate = None
+
+
+class MedianFilter:
+    """
+    Median of the last few reads.
+    """
+
+    def __init__(self, window: int):
+        self.window = deque(maxlen=window)
+        self.estimate = None
+
+    def update(self, measurement: float, dt: float) -> float:
+        self.window.append(measurement)
+        ordered = sorted(self.window)
+        middle = len(ordered) // 2
+
+        if len(ordered) % 2:
+            self.estimate = ordered[middle]
+        else:
+            self.estimate = (ordered[middle - 1] + ordered[middle]) / 2
+
+        return self.estimate
+
+    def reset(self):
+        self.window.clear()
+        self.estimate = None
+
+
+class PassThroughFilter:
+
+    def __init__(self):
+        self.estimate = None
+
+    def update(self, measurement: float, dt: float) -> float:
+        self.estimate = measurement
+        return measurement
+
+    def reset(self):
+        self.estimate = None
+
+
+class SensorFilter:
+    """
+    Filters the reads of one sensor.
+    """
+
+    def __init__(self, name: str, smoother, max_rate: float):
+        """
+        :param name: Name of the sensor, for the journal
+        :param smoother: KalmanFilter, MedianFilter or PassThroughFilter
+        :param max_rate: Fastest the temperature can change, in degrees per second
+        """
+        self.name = name
+        self.smoother = smoother
+        self.max_rate = max_rate
+        self.last_time = None
+        self.rejections = 0
+        self.rejected = 0
+
+    def reject(self, temp: float, reason: str):
+        self.rejections += 1
+        self.rejected += 1
+        journal.write("Rejected read of " + str(temp) + "C from '" + self.name + "': " + reason)
+
+    def update(self, temp: float, time_stamp: float) -> Optional[float]:
+        """
+        :param temp: The raw read
+        :param time_stamp: Time of the read in seconds
+        :return: The filtered temperature, or None if the read was rejected and there is no earlier estimate
+        """
+        estimate = self.smoother.estimate
+        dt = time_stamp - self.last_time if self.last_time is not None else 0.0
+
+        if estimate is not None and self.rejections >= MAX_REJECTIONS:
+            journal.write("Sensor '" + self.name + "' kept reporting far from " + str(estimate) +
+                          "C, starting over from its latest read")
+            self.smoother.reset()
+            estimate = None
+
+        if estimate is not None and abs(temp - estimate) > self.max_rate * dt + RATE_MARGIN:
+            self.reject(temp, "changed faster than " + str(self.max_rate) + "C per second")
+            return estimate
+
+        if temp in SENTINEL_TEMPERATURES and (estimate is None or abs(temp - estimate) > RATE_MARGIN):
+            self.reject(temp, "sensor error value")
+            return estimate
+
+        self.rejections = 0
+        self.last_time = time_stamp
+
+        return self.smoother.update(temp, dt)
+
+
+class FilterStage:
+    """
+    Filters for all the sensors in a config, which every sweep of read_temps goes through.
+    """
+
+    def __init__(self, config: dict):
+        """
+        :param config: the contents of a config.json type file. The filter is set with CFG_FILTER, CFG_PROCESS_NOISE,
+                       CFG_MEASUREMENT_NOISE, CFG_FILTER_WINDOW and CFG_MAX_RATE, which are all optional.
+        """
+        self.kind = config.get(CFG_FILTER, FILTER_KALMAN)
+        self.process_noise = config.get(CFG_PROCESS_NOISE, 0.0001)  # Degrees squared per second
+        self.measurement_noise = config.get(CFG_MEASUREMENT_NOISE, 0.01)  # Degrees squared
+        self.window = config.get(CFG_FILTER_WINDOW, 5)  # Reads
+        self.max_rate = config.get(CFG_MAX_RATE, 0.1)  # Degrees per second
+
+        if self.kind not in (FILTER_KALMAN, FILTER_MEDIAN, FILTER_NONE):
+            raise ValueError("Unknown sensor filter '" + str(self.kind) + "'")
+
+        self.filters = {sensor[NAME]: self.create(sensor[NAME]) for sensor in config[CFG_SENSORS]}
+
+    def create(self, name: str) -> SensorFilter:
+        if self.kind == FILTER_KALMAN:
+            smoother = KalmanFilter(self.process_noise, self.measurement_noise)
+        elif self.kind == FILTER_MEDIAN:
+            smoother = MedianFilter(self.window)
+        else:
+            smoother = PassThroughFilter()
+
+        return SensorFilter(name, smoother, self.max_rate)
+
+    def apply(self, temperatures: dict, time_stamp: float) -> dict:
+        """
+        :param temperatures: Raw temperatures keyed by sensor name, as returned by read_temps
+        :param time_stamp: Time of the reads in seconds
+        :return: The filtered temperatures in the same form. Sensors whose read was rejected without an earlier
+                 estimate to fall back on are left out, like sensors that could not be read.
+        """
+        filtered = dict()
+
+        for name, temp in temperatures.items():
+            if name not in self.filters:
+                self.filters[name] = self.create(name)
+
+            estimate = self.filters[name].update(float(temp), time_stamp)
+            if estimate is not None:
+                filtered[name] = str(round(estimate, 4))
+
+        return filtered
@@ -0,0 +1,227 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Condition, Event
+
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from hardware_control.sensor_filter import FilterStage
+from hardware_control.temperature_sensors import read_temps
+from utilities.clock import Clock
+from utilities.constants import CFG_SAMPLING_PERIOD, CFG_MAX_READ_AGE, W1_DEVICES_FOLDER
+from utilities.metrics import Histogram, Gauge
+
+TEMPERATURE = Histogram("brewmoth_temperature_celsius", "Filtered temperatures read from each sensor", ["sensor"],
+                        buckets=(-5, 0, 5, 8, 10, 12, 14, 16, 17, 18, 19, 20, 21, 22, 23, 24, 26, 28, 30, 35, 40,
+                                 50, 65, 80, 100))
+LAST_READING = Gauge("brewmoth_last_reading_timestamp_seconds", "When the sensors were last read, since the epoch")
+
+
+class Reading:
+    """
+    One sweep of the temperature sensors.
+    """
+
+    def __init__(self, temperatures: dict, read_time: float, monotonic_time: float, raw: dict = None):
+        """
+        :param temperatures: Filtered temperatures keyed by sensor name, in the same form as read_temps returns them
+        :param read_time: When the sweep finished, from time.time()
+        :param monotonic_time: When the sweep finished, from time.monotonic()
+        :param raw: The temperatures before filtering
+        """
+        self.temperatures = temperatures
+        self.raw = raw if raw is not None else temperatures
+        self.time = read_time
+        self.monotonic_time = monotonic_time
+
+    def age(self) -> float:
+        """
+        :return: How many seconds ago this reading was taken
+        """
+        return time.monotonic() - self.monotonic_time
+
+
+class SensorSampler(Thread):
+    """
+    Owns the 1-wire bus: sweeps all the sensors in the config at a fixed period and keeps the latest reading
+    in memory, so any number of consumers can be served without causing extra bus traffic.
+    Every sweep goes through the filter stage once, and all consumers get the filtered temperatures.
+    """
+
+    def __init__(self, config: dict, devices_folder: str = W1_DEVICES_FOLDER, clock: Clock = None):
+        """
+        :param config: the contents of a config.json type file, including a CFG_SENSORS entry
+        :param devices_folder: Folder with the 1-wire devices, can be changed to point at a fake sysfs tree
+        :param clock: If given, the readings and the filter take their time stamps from it instead of the real time,
+                      e.g. to run the sampler in simulated time
+        """
+        super().__init__()
+        self.daemon = True
+        self.config = config
+        self.devices_folder = devices_folder
+        self.clock = clock
+        self.period = config.get(CFG_SAMPLING_PERIOD, 5)  # Seconds
+        self.max_age = config.get(CFG_MAX_READ_AGE, 2 * self.period)  # Seconds
+        self.filter = FilterStage(config)
+        self.alive = True
+        self.reading = None
+        self.listeners = []
+        self.new_reading = Condition()
+        self.wake_up = Event()
+        self.loop = None  # The event loop, when run as a task with run_async
+        self.async_wake_up = None
+
+    def add_listener(self, listener):
+        """
+        Registers a function that gets called, from the sampler thread or event loop, with every new Reading.
+        """
+        self.listeners.append(listener)
+
+    def kill(self):
+        self.alive = False
+        self.request_sweep()
+
+    def request_sweep(self):
+        """
+        Wakes the sampler up to sweep the sensors straight away. Can be called from any thread.
+        """
+        self.wake_up.set()
+
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.async_wake_up.set)
+            except RuntimeError:
+                pass  # The loop has already been closed
+
+    def latest(self, max_age: float = None) -> Reading:
+        """
+        Returns the most recent reading. If it is older than max_age, this asks the sampler for a new sweep and
+        waits for it.
+
+        :param max_age: Maximum age of the reading in seconds, defaults to the config's CFG_MAX_READ_AGE
+        :raises IOError: If there is no reading younger than max_age, e.g. because the sweep failed
+        """
+        if max_age is None:
+            max_age = self.max_age
+
+        with self.new_reading:
+            if self.reading is not None and self.reading.age() <= max_age:
+                return self.reading
+
+            requested = time.monotonic()
+            self.request_sweep()
+            self.new_reading.wait_for(lambda: self.reading is not None and self.reading.monotonic_time >= requested,
+                                      timeout=max(max_age, self.period) + self.period)
+
+            if self.reading is None:
+                raise IOError("No temperature reading available")
+
+            # The sweep failed, an old reading mustn't be passed off as a fresh one
+            if self.reading.age() > max_age:
+                raise IOError("Latest temperature reading is " + str(round(self.reading.age(), 1)) +
+                              " seconds old, the sensors could not be read since")
+
+            return self.reading
+
+    def temperatures(self, max_age: float = None) -> dict:
+        """
+        Returns the most recent temperatures, keyed by sensor name. See latest.
+        """
+        return self.latest(max_age).temperatures
+
+    def sample(self):
+        """
+        Reads all the sensors and publishes the result.
+        """
+        self.publish(read_temps(self.config, self.devices_folder))
+
+    def publish(self, raw: dict):
+        """
+        Filters a sweep of the sensors and hands the reading to whoever is waiting for it, and to the listeners.
+
+        :param raw: The temperatures as read by read_temps
+        """
+        monotonic_time = time.monotonic()
+
+        if self.clock is None:
+            # The filter works on the monotonic time, so it isn't thrown by the wall clock being set
+            reading = Reading(self.filter.apply(raw, monotonic_time), time.time(), monotonic_time, raw)
+        else:
+            read_time = self.clock.time()
+            reading = Reading(self.filter.apply(raw, read_time), read_time, monotonic_time, raw)
+
+        with self.new_reading:
+            self.reading = reading
+            self.new_reading.notify_all()
+
+        LAST_READING.set(reading.time)
+        for name, temperature in reading.temperatures.items():
+            TEMPERATURE.labels(name).observe(float(temperature))
+
+        for listener in self.listeners:
+            try:
+                listener(reading)
+            except Exception as e:
+                journal.write("Sensor sampler listener failed: " + str(e))
+
+    def run(self) -> None:
+        journal.write("Sensor sampler started, reading every " + str(self.period) + " seconds")
+
+        next_read = time.monotonic()
+        while self.alive:
+            try:
+                self.sample()
+            except Exception as e:
+                journal.write("Sensor sampler failed to read temperatures: " + str(e))
+
+            next_read += self.period
+            now = time.monotonic()
+            if next_read < now:
+                next_read = now
+
+            # Someone asking for a fresh reading wakes us up early, and the schedule restarts from there
+            if self.wake_up.wait(next_read - now):
+                next_read = time.monotonic()
+            self.wake_up.clear()
+
+        journal.write("Sensor sampler finished")
+
+    async def run_async(self):
+        """
+        Does the same as run, as a task on the running event loop instead of in a thread of its own.
+        The sensors are read in a thread of the sampler's own, as reading them blocks for up to a second;
+        the filter and the listeners run on the loop. The thread isn't shared with the loop's default executor,
+        where the thermostats and the requests wait in latest: they could otherwise take every worker and leave
+        none for the sweep they are waiting for.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.async_wake_up = asyncio.Event()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sensor-sampler")
+        journal.write("Sensor sampler started on the event loop, reading every " + str(self.period) + " seconds")
+
+        try:
+            next_read = time.monotonic()
+            while self.alive:
+                try:
+                    raw = await self.loop.run_in_executor(executor, read_temps, self.config, self.devices_folder)
+                    self.publish(raw)
+                except Exception as e:
+                    journal.write("Sensor sampler failed to read temperatures: " + str(e))
+
+                next_read += self.period
+                now = time.monotonic()
+                if next_read < now:
+                    next_read = now
+
+                try:
+                    await asyncio.wait_for(self.async_wake_up.wait(), next_read - now)
+                    next_read = time.monotonic()
+                except asyncio.TimeoutError:
+                    pass
+                self.async_wake_up.clear()
+        finally:
+            self.loop = None
+            executor.shutdown(wait=False)
+            journal.write("Sensor sampler finished")
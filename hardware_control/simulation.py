@@ -0,0 +1,410 @@
+import os
+from typing import Callable, Union
+
+from hardware_control.fan_control import fan_pin, max_duty_cycle, hardware_pwm_pins
+from hardware_control.peltier_control import SoftwarePeltierDirectControl
+
+'''
+A simulated fermentation chamber, so the control code can be run and measured without a Raspberry Pi.
+
+It has three parts:
+ - ThermalModel: a lumped model of the chamber air, the wort, the Peltiers, the fan and the room around it.
+ - SimulatedPi: a stand-in for a pigpio connection that remembers what was written to each pin.
+   Install it with hardware_control.gpio.use_backend so the normal peltier and fan code drives the model.
+ - FakeW1Bus: a folder laid out like /sys/bus/w1/devices, with w1_slave files that read_temp can parse.
+
+SimulatedChamber ties them together: every call to step works out the Peltier power and fan speed from the pins,
+advances the model and updates the sensor files. Since the model is stepped explicitly, a simulation runs as fast
+as the computer allows rather than in real time.
+'''
+
+WATER_HEAT_CAPACITY = 4186  # J/(kg K)
+
+
+class ThermalModel:
+    """
+    Two lumped heat capacities: the chamber air, which the Peltiers heat or cool and which leaks heat to the room,
+    and the wort, which only exchanges heat with the air. The fan increases both the heat exchange between
+    the air and the wort, and how much heat the Peltiers can pump.
+    """
+
+    def __init__(self,
+                 wort_mass: float = 20,
+                 air_heat_capacity: float = 8000,
+                 peltier_power: float = 120,
+                 heating_efficiency: float = 1.5,
+                 wort_coupling: float = 4,
+                 fan_coupling: float = 12,
+                 fan_peltier_floor: float = 0.3,
+                 leakage: float = 1.5,
+                 ambient: Union[float, Callable[[float], float]] = 20,
+                 temperature: float = None):
+        """
+        :param wort_mass: Mass of the wort in kg
+        :param air_heat_capacity: Heat capacity of the chamber air and walls, in J/K
+        :param peltier_power: Heat pumped out of the chamber at full cooling power, in W
+        :param heating_efficiency: Heat put in when heating, relative to peltier_power.
+                                   Above 1 because the Peltiers' own electrical power ends up in the chamber.
+        :param wort_coupling: Heat transfer between air and wort with the fan off, in W/K
+        :param fan_coupling: Extra heat transfer between air and wort with the fan at full speed, in W/K
+        :param fan_peltier_floor: Fraction of the Peltier power available with the fan off
+        :param leakage: Heat transfer between the chamber and the room, in W/K
+        :param ambient: Room temperature, either a constant or a function of the simulation time in seconds
+        :param temperature: Starting temperature of the air and wort, defaults to the room temperature
+        """
+        self.wort_heat_capacity = wort_mass * WATER_HEAT_CAPACITY
+        self.air_heat_capacity = air_heat_capacity
+        self.peltier_power = peltier_power
+        self.heating_efficiency = heating_efficiency
+        self.wort_coupling = wort_coupling
+        self.fan_coupling = fan_coupling
+        self.fan_peltier_floor = fan_peltier_floor
+        self.leakage = leakage
+        self.ambient = ambient
+        self.time = 0.0
+
+        if temperature is None:
+            temperature = self.ambient_temp()
+
+        self.air_temp = temperature
+        self.wort_temp = temperature
+        self.energy = 0.0  # Heat pumped by the Peltiers so far, in J, regardless of direction
+
+    def ambient_temp(self) -> float:
+        if callable(self.ambient):
+            return self.ambient(self.time)
+        return self.ambient
+
+    def peltier_heat(self, duty: float, fan_speed: float) -> float:
+        """
+        :param duty: Peltier power from -1 (full cooling) to 1 (full heating)
+        :param fan_speed: From 0 to 1
+        :return: Heat put into the chamber air, in W
+        """
+        power = self.peltier_power * (self.fan_peltier_floor + (1 - self.fan_peltier_floor) * fan_speed)
+
+        if duty > 0:
+            return duty * power * self.heating_efficiency
+        return duty * power
+
+    def step(self, dt: float, duty: float, fan_speed: float):
+        """
+        Advances the model.
+
+        :param dt: Time step in seconds
+        :param duty: Peltier power from -1 (full cooling) to 1 (full heating)
+        :param fan_speed: From 0 to 1
+        """
+        coupling = self.wort_coupling + self.fan_coupling * fan_speed
+        peltier_heat = self.peltier_heat(duty, fan_speed)
+
+        # Explicit Euler is only stable for steps well under the air's time constant, so split long steps up
+        max_step = self.air_heat_capacity / (coupling + self.leakage) / 4
+        steps = max(int(dt / max_step) + 1, 1)
+        sub_step = dt / steps
+
+        for _ in range(steps):
+            ambient = self.ambient_temp()
+            air_flow = peltier_heat \
+                + self.leakage * (ambient - self.air_temp) \
+                + coupling * (self.wort_temp - self.air_temp)
+            wort_flow = coupling * (self.air_temp - self.wort_temp)
+
+            self.air_temp += air_flow * sub_step / self.air_heat_capacity
+            self.wort_temp += wort_flow * sub_step / self.wort_heat_capacity
+            self.time += sub_step
+
+        self.energy += abs(peltier_heat) * dt
+
+
+class SimulatedPi:
+    """
+    Stand-in for pigpio.pi() that keeps the pin levels and PWM settings in memory.
+    Only the calls used by Brewmoth are implemented.
+    """
+
+    def __init__(self):
+        self.connected = True
+        self.levels = {}
+        self.pwm_ranges = {}
+        self.pwm_frequencies = {}
+        self.pwm_duty_cycles = {}
+        self.hardware_pwm = {}  # pin -> (frequency, duty cycle out of 1000000)
+        self.modes = {}
+        self.waves = {}  # wave id -> pulses
+        self.new_wave = []
+        self.wave_playing = None
+        self.waves_created = 0
+        self.calls = 0  # Number of calls, each of which would be a round-trip to pigpiod
+
+    def set_mode(self, pin: int, mode: int):
+        self.calls += 1
+        self.modes[pin] = mode
+
+    def get_mode(self, pin: int) -> int:
+        self.calls += 1
+        return self.modes.get(pin, 0)
+
+    def write(self, pin: int, level: int):
+        # Like pigpio, a write makes the pin an output and stops any PWM on it
+        self.calls += 1
+        self.modes[pin] = 1
+        self.levels[pin] = 1 if level else 0
+        self.pwm_duty_cycles.pop(pin, None)
+
+    def read(self, pin: int) -> int:
+        self.calls += 1
+        return self.levels.get(pin, 0)
+
+    def read_bank_1(self) -> int:
+        self.calls += 1
+        bits = 0
+        for pin, level in self.levels.items():
+            if level:
+                bits |= 1 << pin
+        return bits
+
+    def set_bank_1(self, bits: int):
+        # Unlike write, the bank writes only change the levels, PWM carries on
+        self.calls += 1
+        for pin in range(32):
+            if bits & (1 << pin):
+                self.levels[pin] = 1
+
+    def clear_bank_1(self, bits: int):
+        self.calls += 1
+        for pin in range(32):
+            if bits & (1 << pin):
+                self.levels[pin] = 0
+
+    def set_PWM_range(self, pin: int, pwm_range: int):
+        self.calls += 1
+        self.pwm_ranges[pin] = pwm_range
+
+    def get_PWM_range(self, pin: int) -> int:
+        self.calls += 1
+        return self.pwm_ranges.get(pin, 255)
+
+    def set_PWM_frequency(self, pin: int, frequency: int):
+        self.calls += 1
+        self.pwm_frequencies[pin] = frequency
+
+    def get_PWM_frequency(self, pin: int) -> int:
+        self.calls += 1
+        return self.pwm_frequencies.get(pin, 800)
+
+    def set_PWM_dutycycle(self, pin: int, duty_cycle: int):
+        self.calls += 1
+        self.modes[pin] = 1
+        self.pwm_duty_cycles[pin] = duty_cycle
+        self.levels[pin] = 1 if duty_cycle > 0 else 0
+
+    def get_PWM_dutycycle(self, pin: int) -> int:
+        self.calls += 1
+        return self.pwm_duty_cycles.get(pin, 0)
+
+    def hardware_PWM(self, pin: int, frequency: int, duty_cycle: int):
+        self.calls += 1
+        self.hardware_pwm[pin] = (frequency, duty_cycle)
+
+    def wave_add_new(self):
+        self.calls += 1
+        self.new_wave = []
+
+    def wave_add_generic(self, pulses: list) -> int:
+        self.calls += 1
+        self.new_wave += list(pulses)
+        return len(self.new_wave)
+
+    def wave_create(self) -> int:
+        self.calls += 1
+        wave_id = self.waves_created
+        self.waves_created += 1
+        self.waves[wave_id] = self.new_wave
+        self.new_wave = []
+        return wave_id
+
+    def wave_send_using_mode(self, wave_id: int, mode: int) -> int:
+        # Switches straight away, where pigpiod waits for the end of the current wave in the sync modes
+        self.calls += 1
+        self.wave_playing = wave_id
+        return len(self.waves[wave_id])
+
+    def wave_tx_at(self) -> int:
+        self.calls += 1
+        return self.wave_playing if self.wave_playing is not None else 9999  # pigpio.NO_TX_WAVE
+
+    def wave_tx_stop(self):
+        self.calls += 1
+        self.wave_playing = None
+
+    def wave_delete(self, wave_id: int):
+        self.calls += 1
+        if wave_id == self.wave_playing:
+            raise RuntimeError("Wave " + str(wave_id) + " was deleted while playing")
+        del self.waves[wave_id]
+
+    def wave_output(self, pin: int):
+        """
+        :return: The average output of a pin from 0 to 1 while the wave plays, or None if the wave doesn't drive it
+        """
+        pulses = self.waves[self.wave_playing]
+        bit = 1 << pin
+
+        if not any((pulse.gpio_on | pulse.gpio_off) & bit for pulse in pulses):
+            return None
+
+        # The level at the start of a period is the one the previous period ended with
+        level = self.levels.get(pin, 0)
+        for pulse in pulses:
+            level = 1 if pulse.gpio_on & bit else 0 if pulse.gpio_off & bit else level
+
+        high = 0
+        for pulse in pulses:
+            level = 1 if pulse.gpio_on & bit else 0 if pulse.gpio_off & bit else level
+            high += level * pulse.delay
+
+        return high / sum(pulse.delay for pulse in pulses)
+
+    def stop(self):
+        self.connected = False
+
+    def output(self, pin: int) -> float:
+        """
+        :return: The average output of a pin from 0 to 1, taking software PWM and waves into account
+        """
+        if self.wave_playing is not None:
+            output = self.wave_output(pin)
+            if output is not None:
+                return output
+
+        if pin in self.pwm_duty_cycles:
+            return self.pwm_duty_cycles[pin] / self.pwm_ranges.get(pin, 255)
+
+        return self.levels.get(pin, 0)
+
+
+class FakeW1Bus:
+    """
+    A folder laid out like /sys/bus/w1/devices, for read_temp and read_temps to read from.
+    """
+
+    def __init__(self, folder: str, resolution: float = 0.0625):
+        """
+        :param folder: Folder to create the fake devices in
+        :param resolution: Temperature steps the sensors report in, 0.0625 C for a DS18B20 at 12 bits
+        """
+        self.folder = folder
+        self.resolution = resolution
+        self.written = {}
+
+    def location(self, serial: str) -> str:
+        return os.path.join(self.folder, serial, 'w1_slave')
+
+    def write(self, serial: str, temperature: float, crc_ok: bool = True):
+        """
+        Sets the temperature a sensor reports, in the same format as the DS18B20 kernel driver.
+        """
+        crc = "YES" if crc_ok else "NO"
+        milli_degrees = int(round(round(temperature / self.resolution) * self.resolution * 1000))
+
+        # Only touch the file when what it reports changes, which keeps long simulations fast
+        if self.written.get(serial) == (milli_degrees, crc):
+            return
+        self.written[serial] = (milli_degrees, crc)
+
+        os.makedirs(os.path.join(self.folder, serial), exist_ok=True)
+
+        with open(self.location(serial), 'w') as w1_slave:
+            w1_slave.write("72 01 4b 46 7f ff 0e 10 57 : crc=57 " + crc + "\n"
+                           "72 01 4b 46 7f ff 0e 10 57 t=" + str(milli_degrees) + "\n")
+
+
+class AveragedPeltierPWM:
+    """
+    Stand-in for SoftwarePeltierPWMControl that only remembers the duty cycle. Slow software PWM toggles the pins
+    in real time, so a simulation passes this duty cycle to SimulatedChamber.step as an average instead.
+    """
+
+    def __init__(self):
+        self.duty_cycle = 0.0
+
+    def set_pwm(self, duty_cycle: float):
+        if not -1 <= duty_cycle <= 1:
+            raise ValueError("Duty cycle has to be between -1 and 1")
+        self.duty_cycle = duty_cycle
+
+    def stop(self, fans: bool = True):
+        self.duty_cycle = 0.0
+
+    def kill(self):
+        self.stop()
+
+
+class SimulatedChamber:
+    """
+    A ThermalModel driven by the pins of a SimulatedPi and reported through a FakeW1Bus.
+    """
+
+    def __init__(self, model: ThermalModel, pins: SimulatedPi, bus: FakeW1Bus, main_serial: str,
+                 room_serial: str = None,
+                 heating_pins: list = SoftwarePeltierDirectControl.heating_pin_numbers,
+                 cooling_pins: list = SoftwarePeltierDirectControl.cooling_pin_numbers, fan: int = fan_pin):
+        """
+        :param model: The thermal model of the chamber
+        :param pins: Pin stub the control code writes to
+        :param bus: Fake 1-wire bus the control code reads from
+        :param main_serial: Serial number of the sensor in the wort
+        :param room_serial: Serial number of the sensor measuring the room, if any
+        :param heating_pins: Pins that make the Peltiers heat
+        :param cooling_pins: Pins that make the Peltiers cool
+        :param fan: Pin of the chamber's fan
+        """
+        self.model = model
+        self.pins = pins
+        self.bus = bus
+        self.main_serial = main_serial
+        self.room_serial = room_serial
+        self.heating_pins = heating_pins
+        self.cooling_pins = cooling_pins
+        self.fan_pin = fan
+        self.write_sensors()
+
+    def peltier_duty(self) -> float:
+        """
+        :return: Peltier power from -1 (full cooling) to 1 (full heating). If both directions are switched on
+                 at once the H-bridge would short, which the simulation treats as an error.
+        """
+        heating = min(self.pins.output(pin) for pin in self.heating_pins)
+        cooling = min(self.pins.output(pin) for pin in self.cooling_pins)
+
+        if heating > 0 and cooling > 0:
+            raise RuntimeError("Heating and cooling are switched on at the same time")
+
+        return heating - cooling
+
+    def fan_speed(self) -> float:
+        if self.fan_pin not in hardware_pwm_pins:
+            return self.pins.output(self.fan_pin)
+
+        _, duty_cycle = self.pins.hardware_pwm.get(self.fan_pin, (0, 0))
+        return duty_cycle / max_duty_cycle
+
+    def write_sensors(self):
+        self.bus.write(self.main_serial, self.model.wort_temp)
+
+        if self.room_serial is not None:
+            self.bus.write(self.room_serial, self.model.ambient_temp())
+
+    def step(self, dt: float, duty: float = None):
+        """
+        Advances the simulation by dt seconds with the current pin states.
+
+        :param duty: Peltier power to use instead of the one set by the pins. Slow software PWM toggles the pins
+                     in real time, so when simulating it the average duty cycle is passed in here instead.
+        """
+        if duty is None:
+            duty = self.peltier_duty()
+
+        self.model.step(dt, duty, self.fan_speed())
+        self.write_sensors()
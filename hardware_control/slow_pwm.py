@@ -1,103 +1,323 @@
 import time
-from threading import Thread
+import traceback
+from threading import Thread, Condition, Event
 
-from gpiozero import OutputDevice
-from gpiozero.pins.pigpio import PiGPIOFactory
+# noinspection PyUnresolvedReferences
+from systemd import journal
 
+from hardware_control import gpio
 
-class SlowPWM(Thread):
-    factory = PiGPIOFactory()
+SWITCH_RETRY = 1  # Seconds before switching pins that failed to switch again
+
+
+class BackendPin:
+    """
+    An output pin switched through the process's one pigpio connection, see gpio.pi, with the methods of the gpiozero
+    OutputDevice that SlowPWM drives when it is given a pin factory.
+    """
+
+    def __init__(self, number: int):
+        self.number = number
+        self.off()
+
+    def on(self):
+        gpio.write_bank([self.number], [])
+
+    def off(self):
+        gpio.write_bank([], [self.number])
+
+    def close(self):
+        pass
+
+
+class PWMScheduler(Thread):
+    """
+    A single timer thread that drives any number of SlowPWM pin groups.
+
+    Instead of polling the clock, the scheduler works out when the next edge of any of its pin groups is due
+    and sleeps on a condition variable until then. Changing the duty cycle of a pin group notifies the
+    condition, so the change takes effect straight away rather than at the next edge.
+
+    On every wake-up the new state of all the groups is worked out first, then every group that goes off is switched
+    off before any group is switched on, so groups that must never be on together, like the two sides of an
+    H-bridge, don't overlap when the duty moves from one to the other.
+
+    A group that fails to switch, e.g. because the pigpio connection dropped, is tried again every SWITCH_RETRY
+    seconds, and no group is switched on while any group failed to switch off. Should the thread die anyway, it
+    switches all its groups off and is finished: SlowPWM moves its groups to a new scheduler.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.daemon = True
+        self.condition = Condition()
+        self.groups = []
+        self.failing = set()  # Groups whose last switch failed
+        self.running = False
+        self.finished = False
+
+    def add(self, group: 'SlowPWM'):
+        """
+        Starts driving the given pin group. The scheduler thread is started if it isn't running yet.
+
+        :raises RuntimeError: If the scheduler thread has already finished
+        """
+        with self.condition:
+            if self.finished:
+                raise RuntimeError("The PWM scheduler has stopped")
+
+            if group not in self.groups:
+                group.period_start = time.monotonic()
+                self.groups.append(group)
+            self.condition.notify()
+
+            needs_starting = not self.running
+            self.running = True
+
+        if needs_starting:
+            self.start()
+
+    def remove(self, group: 'SlowPWM'):
+        """
+        Stops driving the given pin group. The pins are left in whatever state they were in.
+        """
+        with self.condition:
+            if group in self.groups:
+                self.groups.remove(group)
+            self.condition.notify()
+
+    def notify(self):
+        """
+        Wakes up the scheduler so it re-calculates its edges, e.g. after a duty cycle change.
+        """
+        with self.condition:
+            self.condition.notify()
+
+    def try_switch(self, group: 'SlowPWM', on: bool) -> bool:
+        """
+        Switches a group, journaling when it starts and stops failing rather than on every attempt.
+
+        :return: Whether the switch succeeded
+        """
+        try:
+            group.switch(on)
+        except Exception as e:
+            group.turned_on = None  # Some of the pins may have switched, so the state is set again on the next try
+            if group not in self.failing:
+                self.failing.add(group)
+                journal.write("Could not switch PWM pins " + str(group.pin_numbers) + ": " + str(e))
+            return False
+
+        if group in self.failing:
+            self.failing.discard(group)
+            journal.write("PWM pins " + str(group.pin_numbers) + " switching again")
+        return True
+
+    def run(self) -> None:
+        try:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    next_edge = None
+                    switching_on = []
+                    failed = False
+
+                    for group in self.groups:
+                        should_be_on, edge = group.next_state(now)
+
+                        if should_be_on != group.turned_on:
+                            if should_be_on:
+                                switching_on.append(group)
+                            elif not self.try_switch(group, False):
+                                failed = True
+
+                        if next_edge is None or edge < next_edge:
+                            next_edge = edge
+
+                    # A group that failed to switch off could overlap with one going on, they wait for the retry
+                    if not failed:
+                        for group in switching_on:
+                            if not self.try_switch(group, True):
+                                failed = True
+
+                    if failed:
+                        next_edge = now + SWITCH_RETRY if next_edge is None else min(next_edge, now + SWITCH_RETRY)
+
+                    if next_edge is None:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(max(next_edge - time.monotonic(), 0))
+        except Exception as e:
+            journal.write(traceback.format_exc())
+            journal.write("PWM scheduler stopped, switching its pins off: " + str(e))
+        finally:
+            with self.condition:
+                self.finished = True
+                self.running = False
+                if SlowPWM.scheduler is self:
+                    SlowPWM.scheduler = None
+
+                # Nothing drives the pins any more, so none may be left on
+                for group in self.groups:
+                    try:
+                        group.switch(False)
+                    except Exception:
+                        pass
+
+
+class SlowPWM:
     pins_in_use = {}
+    scheduler = None
 
-    def __init__(self, pins: list, frequency: float = 1, duty_cycle: float = 0.5):
+    def __init__(self, pins: list, frequency: float = 1, duty_cycle: float = 0.5,
+                 scheduler: PWMScheduler = None, pin_factory=None):
         """
         This class is meant to do PWM at very low frequencies of 2 pins simultaneously
 
         :param pins: List of GPIO pin-numbers to control
         :param frequency: Frequency in Hz (<100)
         :param duty_cycle: Duty cycle (0 - 1)
+        :param scheduler: The scheduler thread driving the pins; by default all instances share one thread
+        :param pin_factory: gpiozero pin factory, e.g. gpiozero's mock pins; by default the pins are switched through
+                            the pigpio connection in hardware_control.gpio
         """
-        super().__init__()
-
         if not 0 <= duty_cycle <= 1:
             raise ValueError("Duty cycle has to be between 0 and 1")
 
         if frequency > 100:
             raise ValueError("Frequency has to be less than 100Hz")
 
-        self.duty_cycle = duty_cycle
+        self.uses_shared_scheduler = scheduler is None
+        if scheduler is None:
+            scheduler = SlowPWM.shared_scheduler()
+
+        self._duty_cycle = duty_cycle
         self.frequency = frequency
-        self.on = True
-        self.daemon = True  # TODO: is this needed?
+        self.period = 1 / frequency
+        self.period_start = time.monotonic()
+        self.turned_on = False
+        self.on = False
+        self.stopped = Event()
+        self.scheduler = scheduler
 
+        self.pin_numbers = list(pins)
         self.pins = []
 
         for pin_number in pins:
-            if pin_number not in self.pins_in_use:
+            if pin_factory is None:
+                self.pins.append(BackendPin(pin_number))
+                continue
+
+            key = (id(pin_factory), pin_number)
+            if key not in self.pins_in_use:
+                from gpiozero import OutputDevice
+
                 pin_device = OutputDevice(pin_number,
-                                          pin_factory=SlowPWM.factory,
+                                          pin_factory=pin_factory,
                                           active_high=True,
                                           initial_value=False)
-                self.pins_in_use[pin_number] = pin_device
+                self.pins_in_use[key] = pin_device
             else:
-                pin_device = self.pins_in_use[pin_number]
+                pin_device = self.pins_in_use[key]
 
             self.pins.append(pin_device)
 
-    def stop(self):
+    @staticmethod
+    def shared_scheduler() -> PWMScheduler:
         """
-        This stops the slow PWM control and sets the pin output to off.
+        :return: The scheduler shared by all the instances not given one, a new one if the last one finished
         """
-        self.on = False
+        if SlowPWM.scheduler is None:
+            SlowPWM.scheduler = PWMScheduler()
+        return SlowPWM.scheduler
 
-        for pin in self.pins:
-            pin.off()
+    @property
+    def duty_cycle(self) -> float:
+        return self._duty_cycle
 
-    def kill(self):
-        """
-        This stops the output and kills the connection to the underlying pigpio service.
-        This will render the object unusable.
-        """
-        self.stop()
-        self.join()
-        for pin in self.pins:
-            pin.close()
+    @duty_cycle.setter
+    def duty_cycle(self, duty_cycle: float):
+        if not 0 <= duty_cycle <= 1:
+            raise ValueError("Duty cycle was set incorrectly. "
+                             "It has to be between 0 and 1, not " + str(duty_cycle))
 
-    def run(self) -> None:
+        self._duty_cycle = duty_cycle
+        if self.on and self.scheduler.finished:
+            self.schedule()
+        else:
+            self.scheduler.notify()
+
+    def next_state(self, now: float) -> (bool, float):
         """
-        SlowPWM is implemented as a thread and this is the function that gets called when
-        the thread gets started.
+        Works out the state the pins should have at the given time, without changing them.
+        This is called by the scheduler thread.
+
+        :param now: Current time, from time.monotonic()
+        :return: Whether the pins should be on, and the time at which they next need to change
         """
-        period = int((1 / self.frequency) * 1000000000)  # period in nanoseconds
-        on_time = int(period * self.duty_cycle)  # duty_cycle in nanoseconds
+        elapsed = now - self.period_start
+        if elapsed >= self.period:
+            # Skip whole periods so the edges don't drift if the scheduler wakes up late
+            self.period_start += self.period * int(elapsed // self.period)
+            elapsed = now - self.period_start
+
+        on_time = self.period * self._duty_cycle
+        should_be_on = elapsed < on_time
+
+        if should_be_on and self._duty_cycle < 1:
+            return should_be_on, self.period_start + on_time
 
-        turned_off = False
+        return should_be_on, self.period_start + self.period
 
-        start = time.time_ns()
-        if self.duty_cycle > 0:
-            for pin in self.pins:
+    def switch(self, on: bool):
+        """
+        Switches all the pins on or off.
+        """
+        for pin in self.pins:
+            if on:
                 pin.on()
-        else:
-            turned_off = True
+            else:
+                pin.off()
+        self.turned_on = on
 
-        try:
-            while self.on:
-                time_lapsed_since_start = time.time_ns() - start
+    def start(self):
+        """
+        Starts the PWM output on the pins.
+        """
+        self.on = True
+        self.stopped.clear()
+        self.schedule()
 
-                if not 0 <= self.duty_cycle <= 1:
-                    raise ValueError("Duty cycle was set incorrectly. "
-                                     "It has to be between 0 and 1, not " + str(self.duty_cycle))
+    def schedule(self):
+        """
+        Hands the pins to the scheduler, a new shared one if the thread of the last one died.
+        """
+        if self.scheduler.finished and self.uses_shared_scheduler:
+            journal.write("Restarting the PWM scheduler for pins " + str(self.pin_numbers))
+            self.scheduler = SlowPWM.shared_scheduler()
+        self.scheduler.add(self)
+
+    def stop(self):
+        """
+        This stops the slow PWM control and sets the pin output to off.
+        """
+        self.on = False
+        self.scheduler.remove(self)
 
-                if self.duty_cycle != 1 and not turned_off and time_lapsed_since_start >= on_time:
-                    for pin in self.pins:
-                        pin.off()
-                    turned_off = True
+        self.switch(False)
+        self.stopped.set()
 
-                if self.duty_cycle != 0 and turned_off and time_lapsed_since_start >= period:
-                    start = time.time_ns()
-                    for pin in self.pins:
-                        pin.on()
-                    turned_off = False
+    def join(self, timeout: float = None):
+        """
+        Blocks until the PWM output has been stopped.
+        """
+        self.stopped.wait(timeout)
 
-        finally:
-            self.stop()
+    def kill(self):
+        """
+        This stops the output and closes the pins, gpiozero pins release their connection to the pin factory.
+        This will render the object unusable.
+        """
+        self.stop()
+        for pin in self.pins:
+            pin.close()
@@ -1,33 +1,81 @@
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, Future
+from threading import Lock
 
 # noinspection PyUnresolvedReferences
 from systemd import journal
-from utilities.constants import CFG_SENSORS, ERROR_NO_SENSORS, CFG_SENSOR_SERIAL, NAME, TYPE
-
-
-def sensor_location(sensor_id: str):
+from utilities.constants import CFG_SENSORS, ERROR_NO_SENSORS, CFG_SENSOR_SERIAL, NAME, TYPE, W1_DEVICES_FOLDER, \
+    CFG_SENSOR_TIMEOUT, CFG_SENSOR_ATTEMPTS
+from utilities.metrics import Histogram, Counter
+
+# Each DS18B20 read blocks for a full conversion, so sensors are read from their own threads.
+# The pool is shared and grows up to this many threads; a probe that hangs only ties up its own thread.
+MAX_READ_THREADS = 8
+read_pool = ThreadPoolExecutor(max_workers=MAX_READ_THREADS, thread_name_prefix="w1-read")
+# The last read of every w1_slave file. A probe isn't read again until its last read has finished, so a hung probe
+# holds on to one thread of the pool instead of a new one every sweep.
+pending_reads = {}
+pending_reads_lock = Lock()
+
+READ_LATENCY = Histogram("brewmoth_sensor_read_seconds", "Time a sensor read took, including CRC retries",
+                         ["sensor"], buckets=(0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10))
+CRC_RETRIES = Counter("brewmoth_sensor_crc_retries_total", "Sensor reads repeated because the CRC check failed",
+                      ["sensor"])
+
+
+def sensor_location(sensor_id: str, devices_folder: str = W1_DEVICES_FOLDER):
     """
     From a given sensor serial (e.g. 28-3c01b556f57f) construct a full on disk location to the temperatures file
      for the sensor.
+
+    :param devices_folder: Folder with the 1-wire devices, can be changed to point at a fake sysfs tree
     """
-    return '/sys/bus/w1/devices/' + sensor_id + '/w1_slave'
+    return os.path.join(devices_folder, sensor_id, 'w1_slave')
 
 
-def read_temps(config: dict) -> dict:
+def read_temps(config: dict, devices_folder: str = W1_DEVICES_FOLDER) -> dict:
     """
     Returns a dictionary of temperature reads, with sensor names as the keys.
 
+    All sensors are read concurrently, so a sweep costs a single conversion time rather than one per sensor.
+    Each sensor gets CFG_SENSOR_TIMEOUT seconds and CFG_SENSOR_ATTEMPTS CRC checks (both optional in the config),
+    so a dead probe is left out of the results instead of stalling the sweep. A probe whose read from an earlier
+    sweep still hasn't returned is left out straight away, as timed out.
+
     :param config: the contents of a config.json type file, including a CFG_SENSORS entry
+    :param devices_folder: Folder with the 1-wire devices, can be changed to point at a fake sysfs tree
     """
+    timeout = config.get(CFG_SENSOR_TIMEOUT, 2)
+    attempts = config.get(CFG_SENSOR_ATTEMPTS, 5)
+
+    reads = dict()
+    with pending_reads_lock:
+        for sensor in config[CFG_SENSORS]:
+            file = sensor_location(sensor[CFG_SENSOR_SERIAL], devices_folder)
+            read = pending_reads.get(file)
+
+            if read is not None and not read.done():
+                # Still hung on an earlier sweep, don't tie up another thread with it
+                read = Future()
+                read.set_exception(TimeoutError())
+            else:
+                read = read_pool.submit(timed_read_temp, sensor[NAME], file, attempts)
+                pending_reads[file] = read
+
+            reads[sensor[NAME]] = read
+
+    deadline = time.monotonic() + timeout
 
     temperatures = dict()
-    for sensor in config[CFG_SENSORS]:
+    for name, read in reads.items():
         try:
-            file = sensor_location(sensor[CFG_SENSOR_SERIAL])
-            temp = str(read_temp(file))
-            temperatures[sensor[NAME]] = temp
+            temp = str(read.result(max(deadline - time.monotonic(), 0)))
+            temperatures[name] = temp
+        except TimeoutError:
+            journal.write("Timed out getting reading '" + name + "'")
         except Exception as e:
-            journal.write("Failed to get reading '" + sensor + "':", str(e))
+            journal.write("Failed to get reading '" + name + "': " + str(e))
 
     if not temperatures:
         message = 'read_temps_to_dict: ' + ERROR_NO_SENSORS
@@ -37,7 +85,8 @@ def read_temps(config: dict) -> dict:
     return temperatures
 
 
-def get_location_for_sensor(config_dictionary: dict, required_sensor_type: str) -> str:
+def get_location_for_sensor(config_dictionary: dict, required_sensor_type: str,
+                            devices_folder: str = W1_DEVICES_FOLDER) -> str:
     """
     For a given sensor type, return the on disk location of the sensor data
     """
@@ -46,7 +95,21 @@ def get_location_for_sensor(config_dictionary: dict, required_sensor_type: str)
 
     for sensor in config_dictionary[CFG_SENSORS]:
         if sensor[TYPE] == required_sensor_type:
-            return sensor_location(sensor[CFG_SENSOR_SERIAL])
+            return sensor_location(sensor[CFG_SENSOR_SERIAL], devices_folder)
+
+    raise Exception(required_sensor_type + " sensor not found in config.json file!")
+
+
+def get_name_for_sensor(config_dictionary: dict, required_sensor_type: str) -> str:
+    """
+    For a given sensor type, return the name of the sensor, as used in the dictionaries returned by read_temps
+    """
+    if CFG_SENSORS not in config_dictionary:
+        raise Exception("No 'Temperature sensors' entry found in config.json file!")
+
+    for sensor in config_dictionary[CFG_SENSORS]:
+        if sensor[TYPE] == required_sensor_type:
+            return sensor[NAME]
 
     raise Exception(required_sensor_type + " sensor not found in config.json file!")
 
@@ -76,9 +139,33 @@ def read_temp_raw(device_file):
     return lines
 
 
-def read_temp(device_file):
+def timed_read_temp(name: str, device_file, attempts: int = None):
+    """
+    Does the same as read_temp, recording how long the read took under the sensor's name.
+    """
+    start = time.monotonic()
+    try:
+        return read_temp(device_file, attempts, name)
+    finally:
+        READ_LATENCY.labels(name).observe(time.monotonic() - start)
+
+
+def read_temp(device_file, attempts: int = None, name: str = None):
+    """
+    Reads the temperature from a DS18B20 w1_slave file, re-reading it while the CRC check fails.
+
+    :param device_file: Location of the w1_slave file
+    :param attempts: How many reads to try before giving up; tries forever if None
+    :param name: Name of the sensor, to count the CRC retries under; they aren't counted without one
+    """
     lines = read_temp_raw(device_file)
     while lines[0].strip()[-3:] != 'YES':
+        if attempts is not None:
+            attempts -= 1
+            if attempts <= 0:
+                raise IOError("CRC check kept failing for " + device_file)
+        if name is not None:
+            CRC_RETRIES.labels(name).inc()
         time.sleep(0.2)
         lines = read_temp_raw(device_file)
     equals_pos = lines[1].find('t=')
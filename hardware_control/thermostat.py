@@ -1,85 +1,169 @@
 import json
-import time
 import traceback
-from datetime import datetime
 from json.decoder import JSONDecodeError
 from multiprocessing import Process
+from typing import Optional
 
 # noinspection PyUnresolvedReferences
 from systemd import journal
 
-from hardware_control.fan_control import set_fan_speed
-from hardware_control.peltier_control import SoftwarePeltierDirectControl
+from hardware_control.autotune import RelayAutotune, DEFAULT_TUNING_RULE
+from hardware_control.fan_control import set_fan_speed, fan_pin
+from hardware_control.peltier_control import SoftwarePeltierDirectControl, SoftwarePeltierPWMControl, \
+    WavePeltierPWMControl
+from hardware_control.sensor_filter import FilterStage
+from hardware_control.sensor_sampler import SensorSampler
 from hardware_control.temperature_sensors import read_temp, check_sensor_types_are_present, \
-    get_location_for_sensor
+    get_location_for_sensor, get_name_for_sensor
+from utilities.clock import Clock
 from utilities.constants import *
-from utilities.time_temp_parser import get_temp_for_time, parse_json_temps
-
-
-def read_settings_file():
-    attempts = 20
-    while attempts > 0:
-        try:
-            with open(SET_POINT_FILE, 'a+') as set_point_file:
-                set_point_file.seek(0)
-                if set_point_file:
-                    settings_string = set_point_file.read()
-                    if len(settings_string) < 1:
-                        continue
-                    return json.loads(settings_string)
-        except (JSONDecodeError, TypeError):
-            raise TypeError("File contents not parseable to JSON")
-        finally:
-            attempts -= 1
-    raise IOError("Could not read settings file")
-
-
-def write_to_settings_file(settings):
-    attempts = 20
-    while attempts > 0:
-        try:
-            # Trick to check the file is not open elsewhere
-            with open(SET_POINT_FILE, 'w+') as set_point_file:
-                set_point_file.seek(0)
-                set_point_file.write(json.dumps(settings, indent=2))
-                set_point_file.truncate()
-                return
-        finally:
-            attempts -= 1
-
-    raise IOError("Could not write to settings file")
+from utilities.pid import PIDController
+from utilities.predictive import PredictiveController
+from utilities.settings_channel import SettingsWatcher, write_settings_atomically
+from utilities.time_temp_parser import compile_profile
+
+# Used for any PID setting missing from the set point file.
+# Tuned on the simulated chamber with tests/control_benchmark.py.
+PID_DEFAULTS = {
+    SP_KP: 1.2,
+    SP_KI: 0.0003,
+    SP_KD: 0,
+    SP_RATE_LIMIT: 0.01,
+    SP_FEED_FORWARD: 0.02,
+}
+PID_PWM_FREQUENCY = 0.2  # Hz
+PREDICTIVE_HORIZON = 6  # Hours
+
+
+def read_settings_file(path: str = SET_POINT_FILE):
+    # The file is always replaced atomically (see write_to_settings_file), so it is never seen half-written
+    try:
+        with open(path, 'r') as set_point_file:
+            return json.load(set_point_file)
+    except (JSONDecodeError, TypeError):
+        raise TypeError("File contents not parseable to JSON")
+    except OSError:
+        raise IOError("Could not read settings file")
+
+
+def write_to_settings_file(settings, path: str = SET_POINT_FILE):
+    try:
+        write_settings_atomically(path, settings)
+    except OSError:
+        raise IOError("Could not write to settings file")
+
+
+def hysteresis_state(current_temp: float, target_temp: float, heating_threshold: float,
+                     cooling_threshold: float) -> SoftwarePeltierDirectControl.State:
+    """
+    On/off control: heat below the heating threshold, cool above the cooling threshold and otherwise do nothing.
+    """
+    if not heating_threshold <= current_temp <= cooling_threshold:
+        if current_temp > target_temp:
+            return SoftwarePeltierDirectControl.State.COOL
+        elif current_temp < target_temp:
+            return SoftwarePeltierDirectControl.State.HEAT
+
+    return SoftwarePeltierDirectControl.State.OFF
 
 
 class Thermostat:
 
-    def __init__(self, config: dict):
-        with open(SET_POINT_FILE, 'r') as set_point_file:
-            settings = json.load(set_point_file)
+    def __init__(self, config: dict, sampler: SensorSampler = None, settings_file: str = None,
+                 clock: Clock = None, devices_folder: str = W1_DEVICES_FOLDER,
+                 pwm_control: SoftwarePeltierPWMControl = None):
+        """
+        :param config: the contents of a config.json type file, or the config of one chamber (see chamber_config)
+        :param sampler: If given, temperatures are taken from the sampler's cache instead of reading the sensor
+        :param settings_file: Location of the set point file, the config's CFG_SET_POINT_FILE or SET_POINT_FILE
+                              by default
+        :param clock: Where the control loop gets the time from, the real time by default
+        :param devices_folder: Folder with the 1-wire devices, can be changed to point at a fake sysfs tree
+        :param pwm_control: Drives the Peltiers in PID mode, created when PID mode is first used if not given.
+                            The config's CFG_PELTIER_PWM picks the kind, see peltier_control.
+        """
+        if settings_file is None:
+            settings_file = config.get(CFG_SET_POINT_FILE, SET_POINT_FILE)
+
+        self.name = config.get(NAME, "Thermostat")
+        self.clock = clock if clock is not None else Clock()
+        self.settings = SettingsWatcher(settings_file)
+        settings = self.settings.read()
 
         if CFG_FAN_SPEED not in config:
             config[CFG_FAN_SPEED] = 0.4
 
         self.config = config
         self.fan_speed = config[CFG_FAN_SPEED]
+        self.fan_pin = config.get(CFG_FAN_PIN, fan_pin)
+        self.heating_pins = config.get(CFG_HEATING_PINS, SoftwarePeltierDirectControl.heating_pin_numbers)
+        self.cooling_pins = config.get(CFG_COOLING_PINS, SoftwarePeltierDirectControl.cooling_pin_numbers)
 
         check_sensor_types_are_present(config, SENSOR_TYPE_MAIN)
 
-        self.temp_file = get_location_for_sensor(config, SENSOR_TYPE_MAIN)
+        self.temp_file = get_location_for_sensor(config, SENSOR_TYPE_MAIN, devices_folder)
+        self.temp_name = get_name_for_sensor(config, SENSOR_TYPE_MAIN)
+        self.sampler = sampler
+        self.filter = FilterStage(config) if sampler is None else None  # The sampler filters its own reads
+
+        # The room sensor is optional, it's only used for the PID feed-forward
+        self.room_file = None
+        self.room_name = None
+        if any(sensor[TYPE] == SENSOR_TYPE_ROOM for sensor in config[CFG_SENSORS]):
+            self.room_file = get_location_for_sensor(config, SENSOR_TYPE_ROOM, devices_folder)
+            self.room_name = get_name_for_sensor(config, SENSOR_TYPE_ROOM)
 
         # Read temperature profile from file and get target for current date/time
-        self.target_temp = get_temp_for_time(parse_json_temps(settings), datetime.now())  # Celsius
+        self.profile = compile_profile(settings)
+        self.target_temp = self.profile.temp_at(self.clock.time())  # Celsius
 
         self.heating_threshold = self.target_temp - settings[SP_HEAT_TOLERANCE]  # Celsius
         self.cooling_threshold = self.target_temp + settings[SP_COOL_TOLERANCE]  # Celsius
         self.sampling = settings[SP_SAMPLING]  # Seconds
         self.alive = True
         self.on = False
-        self.peltier_control = SoftwarePeltierDirectControl()
+        self.mode = MODE_HYSTERESIS
+        self.pid = PIDController(PID_DEFAULTS[SP_KP], PID_DEFAULTS[SP_KI], PID_DEFAULTS[SP_KD],
+                                 rate_limit=PID_DEFAULTS[SP_RATE_LIMIT],
+                                 feed_forward=PID_DEFAULTS[SP_FEED_FORWARD])
+        self.last_pid_time = None
+        self.autotune = None
+        self.predictive = PredictiveController(PREDICTIVE_HORIZON * 3600)
+        self.last_room_temp = None
+        self.last_temp = None  # The temperature the control last acted on
+        self.last_read_time = None
+        self.next_read = None
+        self.duty = 0.0
+        self.pwm_control = pwm_control
+        self.peltier_control = SoftwarePeltierDirectControl(self.heating_pins, self.cooling_pins)
         self.set_state(False)  # Always best to ensure we start with everything off
         self.previous_state = SoftwarePeltierDirectControl.State.OFF
 
+    def log(self, message: str):
+        """
+        Writes to the journal, naming the chamber as a moth can control several.
+        """
+        journal.write(self.name + ": " + message)
+
+    def live_state(self) -> dict:
+        """
+        :return: What the thermostat is doing, as sent over the control channel
+        """
+        return {
+            TS_ON: self.on,
+            TS_MODE: self.mode,
+            TS_TARGET: self.target_temp,
+            TS_HEATING_THRESHOLD: self.heating_threshold,
+            TS_COOLING_THRESHOLD: self.cooling_threshold,
+            TS_PELTIER_STATE: self.previous_state.name,
+            TS_DUTY: self.duty,
+            TS_LAST_READ: self.last_temp,
+            TS_LAST_READ_TIME: self.last_read_time,
+            TS_NEXT_READ: self.next_read,
+        }
+
     def __enter__(self):
-        journal.write("Thermostat thread starting")
+        self.log("Thermostat thread starting")
         self.process = Process(target=self.run)
         self.process.daemon = True
         self.process.start()
@@ -95,76 +179,271 @@ class Thermostat:
         """
         self.on = on
         if not on:
+            self.stop_pwm()
+            self.mode = MODE_HYSTERESIS
             self.peltier_control.set_state(SoftwarePeltierDirectControl.State.OFF)
             self.previous_state = SoftwarePeltierDirectControl.State.OFF
-            set_fan_speed(0)
-            journal.write("Thermostat control turned off")
+            set_fan_speed(0, self.fan_pin)
+            self.log("Thermostat control turned off")
         else:
-            journal.write("Thermostat control turned on")
-            set_fan_speed(self.fan_speed)
+            self.log("Thermostat control turned on")
+            set_fan_speed(self.fan_speed, self.fan_pin)
 
     def kill(self):
-        journal.write("Thermostat will get killed")
+        self.log("Thermostat will get killed")
         self.set_state(False)
         self.alive = False
         self.peltier_control.set_state(SoftwarePeltierDirectControl.State.OFF)
-        journal.write("Thermostat finished kill process")
+        if self.pwm_control is not None:
+            self.pwm_control.kill()
+        self.log("Thermostat finished kill process")
+
+    def stop_pwm(self):
+        if self.pwm_control is not None:
+            self.pwm_control.stop(fans=False)  # The thermostat sets the fan speed itself
+        self.duty = 0.0
+
+    def read_current_temp(self) -> float:
+        """
+        Reads the main temperature sensor, from the sampler's cache if there is one.
+        """
+        if self.sampler is None:
+            return self.filtered_read(self.temp_name, self.temp_file)
+
+        return float(self.sampler.latest(self.sampling).temperatures[self.temp_name])
+
+    def filtered_read(self, name: str, file: str) -> float:
+        filtered = self.filter.apply({name: read_temp(file, name=name)}, self.clock.time())
+
+        if name not in filtered:
+            raise IOError("No valid read from '" + name + "' yet")
+
+        return float(filtered[name])
+
+    def read_room_temp(self) -> Optional[float]:
+        """
+        Reads the room sensor, if there is one. If it can't be read the previous read is used,
+        or None if there is none so the controllers do without.
+        """
+        if self.room_name is None:
+            return None
 
-    def run(self) -> None:
         try:
-            journal.write("Initialized thermostat with " +
-                          str(self.target_temp) + "C set-point, " +
-                          str(self.cooling_threshold) + "C cooling threshold, and " +
-                          str(self.heating_threshold) + "C heating threshold, and " +
-                          str(self.sampling) + " seconds sampling")
+            if self.sampler is None:
+                self.last_room_temp = self.filtered_read(self.room_name, self.room_file)
+            else:
+                self.last_room_temp = float(self.sampler.latest(self.sampling).temperatures[self.room_name])
+        except (IOError, KeyError, ValueError) as e:
+            self.log("Could not read the room temperature: " + str(e))
 
-            next_read = time.time()
-            while self.alive:
-                current_time = time.time()
+        return self.last_room_temp
+
+    def start_pwm(self):
+        """
+        Hands the Peltiers over from the on/off control to PWM, carrying on at the power it was giving.
+        """
+        if self.pwm_control is None:
+            # Same gates as the on/off control, so all modes heat and cool the same way
+            pwm_class = SoftwarePeltierPWMControl
+            if self.config.get(CFG_PELTIER_PWM, PWM_THREAD) == PWM_WAVE:
+                pwm_class = WavePeltierPWMControl
+
+            self.pwm_control = pwm_class(PID_PWM_FREQUENCY, heating_pins=self.heating_pins,
+                                         cooling_pins=self.cooling_pins, fan=self.fan_pin)
+
+        if self.mode not in (MODE_PID, MODE_PREDICTIVE):
+            self.duty = float(self.previous_state.value)
+            self.peltier_control.stop()
+            self.previous_state = SoftwarePeltierDirectControl.State.OFF
+
+    def set_duty(self, duty: float):
+        if duty != self.duty:
+            if duty == 0:
+                self.pwm_control.stop(fans=False)
+            else:
+                self.pwm_control.set_pwm(float(duty))
+            self.duty = duty
 
-                if current_time > next_read:
-                    settings = read_settings_file()
-                    read_state = settings[SP_STATE] == ON
+    def use_hysteresis(self):
+        """
+        Switches from PID or predictive control back to on/off control.
+        """
+        self.log("Switching to hysteresis control")
+        self.stop_pwm()
+        self.peltier_control.stop()
+        self.mode = MODE_HYSTERESIS
+        self.previous_state = SoftwarePeltierDirectControl.State.OFF
+
+    def autotune_control(self, settings: dict, current_time: float, current_temp: float):
+        """
+        Runs the relay autotune experiment. Once it's done, the gains it found are written to the settings file
+        and the thermostat switches to PID control.
+        """
+        if self.mode != MODE_AUTOTUNE:
+            self.log("Starting PID autotune around " + str(self.target_temp) + "C")
+            self.stop_pwm()
+            self.autotune = RelayAutotune(self.target_temp, current_time)
+            self.mode = MODE_AUTOTUNE
+
+        state = self.autotune.update(current_time, current_temp)
+
+        if self.previous_state != state:
+            self.peltier_control.set_state(state)
+            self.previous_state = state
+
+        settings = dict(settings)
+
+        if self.autotune.failed:
+            self.log("PID autotune did not settle into an oscillation, switching to hysteresis control")
+            settings[SP_MODE] = MODE_HYSTERESIS
+        elif self.autotune.done:
+            ultimate_gain, ultimate_period = self.autotune.ultimate()
+            rule = settings.get(SP_TUNING_RULE, DEFAULT_TUNING_RULE)
+            settings[SP_KP], settings[SP_KI], settings[SP_KD] = self.autotune.gains(rule)
+            settings[SP_MODE] = MODE_PID
+
+            self.log("PID autotune found an ultimate gain of " + str(ultimate_gain) + " and period of " +
+                     str(ultimate_period) + " seconds, giving " + rule + " gains of " +
+                     str((settings[SP_KP], settings[SP_KI], settings[SP_KD])))
+        else:
+            return
+
+        # Switches to the new mode on the next sample, as the settings file changed
+        write_settings_atomically(self.settings.path, settings)
 
-                    if read_state != self.on:
-                        self.set_state(read_state)
+    def pid_control(self, settings: dict, current_time: float, current_temp: float, room_temp: Optional[float]):
+        """
+        Sets the Peltier power with the PID controller, picking up any change to the gains in the settings.
+        """
+        gains = {key: settings.get(key, default) for key, default in PID_DEFAULTS.items()}
+        if (gains[SP_KP], gains[SP_KI], gains[SP_KD], gains[SP_FEED_FORWARD]) != \
+                (self.pid.kp, self.pid.ki, self.pid.kd, self.pid.feed_forward):
+            self.log("Using PID gains " + str(gains))
 
-                    if self.on:
-                        # Read temperature profile from file and get target for current date/time
+        self.pid.set_gains(gains[SP_KP], gains[SP_KI], gains[SP_KD], gains[SP_FEED_FORWARD])
+        self.pid.rate_limit = gains[SP_RATE_LIMIT]
+        self.pid.set_target(self.target_temp)
 
-                        temp_set_point = get_temp_for_time(parse_json_temps(settings), datetime.now())
-                        if temp_set_point != self.target_temp:
-                            journal.write("Changed temperature set point to " + str(temp_set_point))
-                            self.target_temp = temp_set_point
+        if self.mode != MODE_PID:
+            self.log("Switching to PID control")
+            self.start_pwm()
 
-                        self.heating_threshold = self.target_temp - settings[SP_HEAT_TOLERANCE]
-                        self.cooling_threshold = self.target_temp + settings[SP_COOL_TOLERANCE]
-                        self.sampling = settings[SP_SAMPLING]
+            # Carry on from the power the previous control was giving
+            self.pid.reset(self.duty, current_temp, room_temp)
+            self.last_pid_time = current_time
+            self.mode = MODE_PID
 
-                        current_temp = read_temp(self.temp_file)
+        self.set_duty(self.pid.update(current_temp, current_time - self.last_pid_time, room_temp))
+        self.last_pid_time = current_time
+
+    def predictive_control(self, settings: dict, current_time: float, current_temp: float,
+                           room_temp: Optional[float]):
+        """
+        Sets the Peltier power with the predictive controller, looking ahead along the temperature profile.
+        """
+        self.predictive.horizon = settings.get(SP_HORIZON, PREDICTIVE_HORIZON) * 3600
+
+        if self.mode != MODE_PREDICTIVE:
+            self.log("Switching to predictive control with " + str(self.predictive.identifier.model()))
+            self.start_pwm()
+            self.predictive.output = self.duty
+            self.mode = MODE_PREDICTIVE
+
+        self.set_duty(self.predictive.update(current_time, current_temp, self.profile.temp_at, room_temp))
+
+    def iterate(self) -> float:
+        """
+        Runs one sample of the control loop: re-reads the settings if they changed, reads the temperature
+        and sets the Peltiers.
+
+        :return: The time the next sample is due, in seconds since the epoch
+        """
+        current_time = self.clock.time()
 
-                        if not self.heating_threshold <= current_temp <= self.cooling_threshold:
-                            if current_temp > self.target_temp:
-                                state = SoftwarePeltierDirectControl.State.COOL
-                            elif current_temp < self.target_temp:
-                                state = SoftwarePeltierDirectControl.State.HEAT
-                            else:
-                                state = SoftwarePeltierDirectControl.State.OFF
-                        else:
-                            state = SoftwarePeltierDirectControl.State.OFF
+        settings = self.settings.read()
+        read_state = settings[SP_STATE] == ON
 
-                        if self.previous_state != state:
-                            self.peltier_control.set_state(state)
-                            self.previous_state = state
-                            journal.write("Set peltier state to " + str(state))
-                        next_read = current_time + self.sampling
+        if read_state != self.on:
+            self.set_state(read_state)
+
+        if self.on:
+            # Read temperature profile from file and get target for current date/time
+
+            self.profile = compile_profile(settings)
+            temp_set_point = self.profile.temp_at(current_time)
+            if temp_set_point != self.target_temp:
+                self.log("Changed temperature set point to " + str(temp_set_point))
+                self.target_temp = temp_set_point
+
+            self.heating_threshold = self.target_temp - settings[SP_HEAT_TOLERANCE]
+            self.cooling_threshold = self.target_temp + settings[SP_COOL_TOLERANCE]
+            self.sampling = settings[SP_SAMPLING]
+
+            current_temp = self.read_current_temp()
+            room_temp = self.read_room_temp()
+            self.last_temp = current_temp
+            self.last_read_time = current_time
+
+            mode = settings.get(SP_MODE, MODE_HYSTERESIS)
+
+            if mode == MODE_PID:
+                self.pid_control(settings, current_time, current_temp, room_temp)
+            elif mode == MODE_PREDICTIVE:
+                self.predictive_control(settings, current_time, current_temp, room_temp)
+            elif mode == MODE_AUTOTUNE:
+                self.autotune_control(settings, current_time, current_temp)
+            else:
+                if self.mode != MODE_HYSTERESIS:
+                    self.use_hysteresis()
+
+                state = hysteresis_state(current_temp, self.target_temp,
+                                         self.heating_threshold, self.cooling_threshold)
+
+                if self.previous_state != state:
+                    self.peltier_control.set_state(state)
+                    self.previous_state = state
+                    self.log("Set peltier state to " + str(state))
+
+            # Keep learning the model of the chamber, so the predictive control can be switched to at any time
+            if self.mode != MODE_PREDICTIVE:
+                duty = self.duty if self.mode == MODE_PID else float(self.previous_state.value)
+                self.predictive.observe(current_time, current_temp, duty, room_temp)
+
+        next_read = current_time + self.sampling
+
+        # Don't wait past a step in the temperature profile
+        next_set_point = self.profile.next_breakpoint(current_time)
+        if self.on and next_set_point is not None and next_set_point < next_read:
+            next_read = next_set_point
+
+        self.next_read = next_read
+        return next_read
+
+    def run(self) -> None:
+        try:
+            # The sampler thread has to be started in the process running the control loop
+            if self.sampler is not None and not self.sampler.is_alive():
+                self.sampler.start()
+
+            self.log("Initialized thermostat with " +
+                     str(self.target_temp) + "C set-point, " +
+                     str(self.cooling_threshold) + "C cooling threshold, and " +
+                     str(self.heating_threshold) + "C heating threshold, and " +
+                     str(self.sampling) + " seconds sampling")
+
+            next_read = self.clock.time()
+            while self.alive:
+                if self.clock.time() >= next_read:
+                    next_read = self.iterate()
 
-                time.sleep(0.5)  # This allows the thread to check for a kill signal
+                # Sleep until the next read, but wake up straight away if the settings change
+                if self.settings.wait(next_read - self.clock.time()):
+                    next_read = self.clock.time()
 
         except BaseException as e:
-            journal.write(traceback.format_exc())
-            journal.write("Exception occurred:" + str(e))
+            self.log(traceback.format_exc())
+            self.log("Exception occurred:" + str(e))
         finally:
             message = "Thermostat Control loop stopped"
-            journal.write(message)
+            self.log(message)
             self.set_state(False)
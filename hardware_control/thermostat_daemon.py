@@ -1,8 +1,10 @@
 import json
 import traceback
 
-from hardware_control.thermostat import Thermostat
-from utilities.constants import CONFIG_FILE
+from hardware_control.chambers import ChamberScheduler
+from hardware_control.sensor_sampler import SensorSampler
+from utilities.chamber_config import sensors_config
+from utilities.constants import CONFIG_FILE, CONTROL_SOCKET
 
 # You might be tempted to put this in a sub-package, but it needs to be here to function properly.
 # The thermostat also always needs its own service, so it stops cleanly.
@@ -13,11 +15,13 @@ if __name__ == '__main__':
         file_contents = config_file.read()
         config = json.loads(file_contents)
 
-    thermostat = Thermostat(config)
+    # One process and one sampler for all the chambers, taking commands from the web server on the control socket
+    scheduler = ChamberScheduler(config, SensorSampler(sensors_config(config)), control_socket=CONTROL_SOCKET,
+                                 telemetry=True)
 
     try:
-        with thermostat:
-            thermostat.process.join()
+        with scheduler:
+            scheduler.process.join()
     except KeyboardInterrupt:
         print("Thermostat was interrupted.")
     except BaseException as e:
@@ -0,0 +1,236 @@
+from collections import namedtuple
+from threading import Lock
+from typing import Dict, Tuple
+
+from hardware_control import gpio
+
+'''
+Slow PWM played back by pigpiod from DMA instead of toggled by a Python thread.
+
+The pattern of one period is built as a pigpio wave, which pigpiod repeats for as long as it runs, so the edges are
+timed by the hardware and Python does no work per edge. A duty cycle change builds a new wave, which pigpiod switches
+to at the end of the current period.
+
+pigpiod only transmits one wave at a time, so all the pin groups of the process share one wave, and with it one
+period. The wave uses the DMA and the PCM clock, pigpiod's default, so it doesn't clash with the fans' hardware PWM.
+'''
+
+WAVE_MODE_REPEAT_SYNC = 3  # pigpio.WAVE_MODE_REPEAT_SYNC: repeat the wave, starting it once the previous one ends
+DEAD_TIME = 100  # Microseconds at the start of every period with all pins off, see PWMWave.pulses
+
+# Has the same fields as pigpio.pulse, which is all wave_add_generic looks at
+Pulse = namedtuple('Pulse', ['gpio_on', 'gpio_off', 'delay'])
+
+
+class PWMWave:
+    """
+    One pigpio wave driving the slow PWM of any number of pin groups at the same frequency.
+    """
+
+    def __init__(self, frequency: float):
+        """
+        :param frequency: PWM frequency in Hz, at least 0.001 as a pulse can't be longer than about 70 minutes
+        """
+        if frequency < 0.001:
+            raise ValueError("Frequency has to be at least 0.001Hz")
+
+        self.frequency = frequency
+        self.period = int(round(1000000 / frequency))  # Microseconds
+        self.duty_cycles: Dict[Tuple[int, ...], float] = {}
+        self.wave_id = None
+        self.retired = []  # Waves that may still be playing until the end of their period
+        self.released = set()  # Pins of removed groups, which the next wave switches off
+        self.lock = Lock()
+        self.sent = 0
+
+    def set_duty_cycles(self, duty_cycles: Dict[Tuple[int, ...], float]):
+        """
+        Changes the duty cycles of some pin groups, with a single new wave.
+
+        :param duty_cycles: Duty cycles from 0 to 1, keyed by the tuple of pins of each group
+        """
+        for pins, duty_cycle in duty_cycles.items():
+            if not 0 <= duty_cycle <= 1:
+                raise ValueError("Duty cycle has to be between 0 and 1, not " + str(duty_cycle))
+
+        with self.lock:
+            if all(self.duty_cycles.get(pins) == duty for pins, duty in duty_cycles.items()):
+                return
+
+            self.duty_cycles.update(duty_cycles)
+            self.send()
+
+    def remove(self, pins: Tuple[int, ...]):
+        """
+        Stops driving a pin group and switches its pins off.
+        """
+        with self.lock:
+            if self.duty_cycles.pop(pins, None) is None:
+                return
+
+            self.released.update(pins)
+            self.send()
+
+    def pulses(self) -> list:
+        """
+        :return: The pulses of one period. Every period starts with all the pins off for DEAD_TIME, so the gates
+                 of an H-bridge are never switched on and off by the same pulse, e.g. when a new wave changes the
+                 direction. Then the pins of each group are switched on, and off again after their on time.
+        """
+        all_pins = gpio.pin_mask([pin for pins in self.duty_cycles for pin in pins] + list(self.released))
+        usable = self.period - DEAD_TIME
+
+        # Pins that switch off, keyed by the microseconds after the dead time at which they do
+        off_times = {}
+        on_mask = 0
+        for pins, duty_cycle in self.duty_cycles.items():
+            on_time = min(int(round(self.period * duty_cycle)), usable)
+            if on_time <= 0:
+                continue
+
+            on_mask |= gpio.pin_mask(pins)
+            if on_time < usable:
+                off_times.setdefault(on_time, 0)
+                off_times[on_time] |= gpio.pin_mask(pins)
+
+        edges = sorted(off_times)
+        pulses = [Pulse(0, all_pins, DEAD_TIME)]
+
+        previous = 0
+        on, off = on_mask, 0
+        for edge in edges:
+            pulses.append(Pulse(on, off, edge - previous))
+            on, off = 0, off_times[edge]
+            previous = edge
+        pulses.append(Pulse(on, off, usable - previous))
+
+        return pulses
+
+    def send(self):
+        """
+        Builds the wave and hands it to pigpiod, which starts it at the end of the current period.
+        Waves that have finished playing are deleted. If all the pins are to be off, the wave is stopped
+        straight away instead.
+        """
+        pins = gpio.pi()
+        group_pins = [pin for group in self.duty_cycles for pin in group]
+
+        if not any(self.duty_cycles.values()):
+            self.stop()
+            gpio.write_bank([], group_pins + list(self.released))
+            self.released.clear()
+            return
+
+        gpio.claim_outputs(group_pins)
+
+        pins.wave_add_new()
+        pins.wave_add_generic(self.pulses())
+        wave_id = pins.wave_create()
+        pins.wave_send_using_mode(wave_id, WAVE_MODE_REPEAT_SYNC)
+        self.sent += 1
+        self.released.clear()
+
+        if self.wave_id is not None:
+            self.retired.append(self.wave_id)
+        self.wave_id = wave_id
+
+        playing = pins.wave_tx_at()
+        for retired in list(self.retired):
+            if retired != playing:
+                pins.wave_delete(retired)
+                self.retired.remove(retired)
+
+    def stop(self):
+        """
+        Stops the wave straight away. The pins are left in whatever state they were in.
+        """
+        pins = gpio.pi()
+
+        if self.wave_id is not None:
+            pins.wave_tx_stop()
+            for wave_id in self.retired + [self.wave_id]:
+                pins.wave_delete(wave_id)
+
+        self.wave_id = None
+        self.retired = []
+
+
+class WavePWM:
+    """
+    A group of pins driven by a shared PWMWave, with the same interface as SlowPWM.
+    """
+    waves = {}  # Frequency -> PWMWave, shared by all instances
+
+    def __init__(self, pins: list, frequency: float = 1, duty_cycle: float = 0.5, wave: PWMWave = None):
+        """
+        :param pins: List of GPIO pin-numbers to control, 0 to 31
+        :param frequency: Frequency in Hz
+        :param duty_cycle: Duty cycle (0 - 1)
+        :param wave: The wave driving the pins; by default all instances with the same frequency share one
+        """
+        if not 0 <= duty_cycle <= 1:
+            raise ValueError("Duty cycle has to be between 0 and 1")
+
+        if wave is None:
+            if any(wave_frequency != frequency for wave_frequency in WavePWM.waves):
+                raise ValueError("pigpiod plays one wave at a time, so all wave PWM has to use the same frequency")
+
+            if frequency not in WavePWM.waves:
+                WavePWM.waves[frequency] = PWMWave(frequency)
+            wave = WavePWM.waves[frequency]
+
+        self.pins = tuple(pins)
+        self.frequency = frequency
+        self.wave = wave
+        self._duty_cycle = duty_cycle
+        self.on = False
+
+        gpio.pin_mask(self.pins)  # Checks the pins can be part of a wave
+
+    @property
+    def duty_cycle(self) -> float:
+        return self._duty_cycle
+
+    @duty_cycle.setter
+    def duty_cycle(self, duty_cycle: float):
+        if not 0 <= duty_cycle <= 1:
+            raise ValueError("Duty cycle was set incorrectly. "
+                             "It has to be between 0 and 1, not " + str(duty_cycle))
+
+        self._duty_cycle = duty_cycle
+        if self.on:
+            self.wave.set_duty_cycles({self.pins: duty_cycle})
+
+    def start(self):
+        """
+        Starts the PWM output on the pins.
+        """
+        self.on = True
+        self.wave.set_duty_cycles({self.pins: self._duty_cycle})
+
+    def stop(self):
+        """
+        This stops the PWM output and sets the pins off.
+        """
+        self.on = False
+        self.wave.remove(self.pins)
+
+    def kill(self):
+        self.stop()
+
+
+def set_duty_cycles(duty_cycles: Dict[WavePWM, float]):
+    """
+    Changes the duty cycles of several running groups that share a wave with a single new wave,
+    e.g. both directions of an H-bridge.
+    """
+    waves = {pwm.wave for pwm in duty_cycles}
+    if len(waves) != 1:
+        raise ValueError("The groups have to share a wave")
+
+    for pwm, duty_cycle in duty_cycles.items():
+        if not 0 <= duty_cycle <= 1:
+            raise ValueError("Duty cycle has to be between 0 and 1, not " + str(duty_cycle))
+        pwm._duty_cycle = duty_cycle
+
+    waves.pop().set_duty_cycles({pwm.pins: duty_cycle for pwm, duty_cycle in duty_cycles.items() if pwm.on})
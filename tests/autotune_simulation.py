@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import argparse
+import json
+from datetime import datetime
+
+from hardware_control.autotune import TUNING_RULES, DEFAULT_TUNING_RULE
+from hardware_control.replay import Replay, ThermostatStrategy, benchmark_profile
+from utilities.constants import SP_TEMP, SP_SAMPLING, SP_HEAT_TOLERANCE, SP_COOL_TOLERANCE, SP_MODE, \
+    MODE_AUTOTUNE, MODE_PID, SP_TUNING_RULE, SP_KP, SP_KI, SP_KD
+
+'''
+Runs the relay autotune on the simulated chamber, then replays the benchmark profile with the gains it found
+and with the default gains, to see whether the autotune helps.
+'''
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--temperature', '-t', help='Temperature to tune at', default=18)
+    parser.add_argument('--rule', '-r', help='Tuning rule', choices=list(TUNING_RULES), default=DEFAULT_TUNING_RULE)
+    parser.add_argument('--days', '-d', help='Longest the autotune may take in days', default=3)
+    parser.add_argument('--sampling', '-s', help='Seconds between thermostat samples', default=30)
+
+    args = parser.parse_args()
+
+    hold = {
+        SP_TEMP: float(args.temperature),
+        SP_SAMPLING: float(args.sampling),
+        SP_HEAT_TOLERANCE: 1,
+        SP_COOL_TOLERANCE: 0.1,
+    }
+
+    autotune = ThermostatStrategy({SP_MODE: MODE_AUTOTUNE, SP_TUNING_RULE: args.rule})
+    Replay(hold, float(args.days), start=datetime.now().timestamp()).run(autotune)
+
+    relay = autotune.thermostat.autotune
+    if not relay.done:
+        print("The autotune did not finish within", args.days, "days")
+        exit(1)
+
+    ultimate_gain, ultimate_period = relay.ultimate()
+    kp, ki, kd = relay.gains(args.rule)
+
+    print("Ultimate gain: {0:.3f}, ultimate period: {1:.0f} s".format(ultimate_gain, ultimate_period))
+    print("Measured periods:", ", ".join("{0:.0f} s".format(period) for period in relay.periods))
+    print("Measured amplitudes:", ", ".join("{0:.3f} C".format(amplitude) for amplitude in relay.amplitudes))
+    print(args.rule, "gains: Kp {0:.4g}, Ki {1:.4g}, Kd {2:.4g}".format(kp, ki, kd))
+
+    replay = Replay(benchmark_profile(), 14)
+    strategies = {
+        "Default gains": ThermostatStrategy({SP_MODE: MODE_PID}),
+        "Autotuned gains": ThermostatStrategy({SP_MODE: MODE_PID, SP_KP: kp, SP_KI: ki, SP_KD: kd}),
+    }
+
+    for name, strategy in strategies.items():
+        results = replay.run(strategy)
+        print(name + ": " + json.dumps({metric: round(value, 4) for metric, value in results.items()}))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import argparse
+import json
+import subprocess
+from datetime import datetime
+from functools import partial
+
+from hardware_control.replay import Replay, ThermostatStrategy, SimplePIDStrategy, ambient_from_log, \
+    benchmark_profile
+from hardware_control.simulation import ThermalModel
+from utilities.constants import SP_MODE, MODE_PID, MODE_PREDICTIVE
+
+'''
+Replays a temperature profile through each control strategy on the simulated chamber and stores
+the results as JSON, so changes to the control code can be compared between versions.
+'''
+
+
+def version() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--profile', '-p', help='Set point file with the profile to replay')
+    parser.add_argument('--ambient', '-a', help='Binary temperature log with a room temperature trace')
+    parser.add_argument('--ambient_sensor', help='Name of the room sensor in the log', default='Room Temperature')
+    parser.add_argument('--days', '-d', help='Length of the replay in days', default=14)
+    parser.add_argument('--output', '-o', help='JSON file to write the results to', default='control_benchmark.json')
+
+    args = parser.parse_args()
+
+    if args.profile:
+        with open(args.profile, 'r') as profile_file:
+            settings = json.load(profile_file)
+    else:
+        settings = benchmark_profile()
+
+    model = ThermalModel
+    if args.ambient:
+        model = partial(ThermalModel, ambient=ambient_from_log(args.ambient, args.ambient_sensor))
+
+    replay = Replay(settings, float(args.days), model)
+
+    strategies = {
+        "Thermostat (hysteresis)": ThermostatStrategy(),
+        "Thermostat (PID)": ThermostatStrategy({SP_MODE: MODE_PID}),
+        "Thermostat (predictive)": ThermostatStrategy({SP_MODE: MODE_PREDICTIVE}),
+        "simple_pid (pid-test)": SimplePIDStrategy(),
+    }
+
+    results = {
+        "version": version(),
+        "date": datetime.now().isoformat(),
+        "days": float(args.days),
+        "strategies": {},
+    }
+
+    for name, strategy in strategies.items():
+        try:
+            results["strategies"][name] = replay.run(strategy)
+        except ImportError as e:
+            print("Skipping", name + ":", str(e))
+            continue
+
+        print(name)
+        for metric, value in results["strategies"][name].items():
+            print("    {0}: {1:.4g}".format(metric, value))
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+
+    print("Results written to", args.output)
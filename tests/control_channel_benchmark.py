@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from hardware_control import gpio
+from hardware_control.chambers import ChamberScheduler, DEFAULT_SETTINGS
+from hardware_control.sensor_sampler import SensorSampler
+from hardware_control.simulation import SimulatedPi
+from hardware_control.thermostat import read_settings_file, write_to_settings_file
+from tests.read_temps_benchmark import create_fake_devices
+from utilities import settings_channel
+from utilities.constants import *
+from utilities.control_channel import ControlClient
+from utilities.settings_channel import write_settings_atomically
+
+'''
+Runs the thermostat in its own process, the way thermostat_daemon.py does, and measures how long a new set point
+takes to be applied when it is sent over the control channel, against rewriting the set point file the way the
+web server used to. The time a set point written to the file takes to be applied is found by asking the thermostat
+for its live state over the control channel until the target has changed. With --polling the thermostat has to
+notice the file changing without inotify, as on systems that don't have it.
+'''
+
+
+def percentiles(samples: list) -> str:
+    samples = sorted(samples)
+    return "median {0:.3f} ms, p99 {1:.3f} ms".format(statistics.median(samples) * 1000,
+                                                      samples[int(len(samples) * 0.99)] * 1000)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--changes', '-n', help='Number of set point changes each way', type=int, default=200)
+    parser.add_argument('--polling', '-p', help="Don't use inotify to watch the set point file", action='store_true')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        devices_folder = os.path.join(folder, "devices")
+        os.makedirs(devices_folder)
+        config = create_fake_devices(devices_folder, 2)
+        config[CFG_SET_POINT_FILE] = os.path.join(folder, "set_point.json")
+        control_socket = os.path.join(folder, "thermostat.sock")
+        write_settings_atomically(config[CFG_SET_POINT_FILE], dict(DEFAULT_SETTINGS, **{SP_STATE: ON}))
+
+        gpio.use_backend(SimulatedPi())
+        if args.polling:
+            settings_channel.open_inotify = lambda folder: None
+        scheduler = ChamberScheduler(config, SensorSampler(config, devices_folder), devices_folder=devices_folder,
+                                     control_socket=control_socket)
+
+        with scheduler:
+            while not os.path.exists(control_socket):
+                time.sleep(0.01)
+            client = ControlClient(control_socket)
+
+            queries = []
+            for _ in range(args.changes):
+                start = time.perf_counter()
+                client.request({CTL_COMMAND: CTL_GET_STATE})
+                queries.append(time.perf_counter() - start)
+
+            channel = []
+            for index in range(args.changes):
+                target = 15 + index % 5
+                start = time.perf_counter()
+                reply = client.request({CTL_COMMAND: CTL_UPDATE, CTL_SETTINGS: {SP_TEMP: target}})
+                channel.append(time.perf_counter() - start)
+
+                if reply[CTL_STATE][TS_TARGET] != target:
+                    raise RuntimeError("Set point wasn't applied by the time it was acknowledged")
+
+            file = []
+            for index in range(args.changes):
+                target = 21 + index % 5
+                start = time.perf_counter()
+                settings = read_settings_file(config[CFG_SET_POINT_FILE])
+                settings[SP_TEMP] = target
+                write_to_settings_file(settings, config[CFG_SET_POINT_FILE])
+
+                while client.request({CTL_COMMAND: CTL_GET_STATE})[CTL_STATE][TS_TARGET] != target:
+                    pass
+                file.append(time.perf_counter() - start)
+
+            print("State query round trip: " + percentiles(queries))
+            print("Set point applied and acknowledged over the control channel: " + percentiles(channel))
+            print("Set point applied after rewriting the set point file: " + percentiles(file))
+
+            scheduler.process.terminate()
+            scheduler.process.join()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import argparse
+import time
+from threading import Thread, Lock
+
+from utilities.metrics import Counter, Histogram
+
+'''
+Measures what recording a metric costs, from one thread and from several at once, against a counter behind a lock,
+and checks that no event is lost when the threads record at the same time.
+'''
+
+
+class LockedCounter:
+
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+
+def per_event(record, events: int, threads: int) -> float:
+    """
+    :return: Seconds per event, with the events shared out between the threads
+    """
+    def run():
+        for index in range(events // threads):
+            record(index % 10 / 10)
+
+    workers = [Thread(target=run) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return (time.perf_counter() - start) / events
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--events', '-n', help='Number of events to record', type=int, default=1000000)
+    parser.add_argument('--threads', '-t', help='Number of threads recording at once', type=int, default=4)
+
+    args = parser.parse_args()
+
+    for threads in (1, args.threads):
+        counter = Counter("benchmark_total", "Benchmark", register=False).labels()
+        histogram = Histogram("benchmark_seconds", "Benchmark", ["sensor"], register=False)
+        locked = LockedCounter()
+
+        # The loop and the call to the lambda, to be taken off the other times
+        overhead = per_event(lambda value: None, args.events, threads)
+        counting = per_event(lambda value: counter.inc(), args.events, threads) - overhead
+        observing = per_event(lambda value: histogram.labels("Sensor").observe(value), args.events, threads) - overhead
+        locking = per_event(lambda value: locked.inc(), args.events, threads) - overhead
+
+        print("{0} thread(s): counter {1:.3f} us, histogram {2:.3f} us, counter behind a lock {3:.3f} us per event"
+              .format(threads, counting * 1e6, observing * 1e6, locking * 1e6))
+
+        recorded = args.events // threads * threads
+        assert counter.value() == recorded == locked.value
+        assert sum(histogram.labels("Sensor").totals()[:-1]) == recorded
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from hardware_control import gpio
+from hardware_control.chambers import ChamberScheduler, LOOP_CPU_BUDGET
+from hardware_control.replay import benchmark_profile
+from hardware_control.sensor_sampler import SensorSampler
+from hardware_control.simulation import ThermalModel, SimulatedPi, FakeW1Bus, SimulatedChamber, AveragedPeltierPWM
+from utilities.chamber_config import sensors_config
+from utilities.clock import SimulatedClock
+from utilities.constants import *
+from utilities.settings_channel import write_settings_atomically
+from utilities.time_temp_parser import compile_profile
+
+'''
+Runs several simulated chambers from one ChamberScheduler and one SensorSampler, the way thermostat_daemon.py
+does, in simulated time, and measures the CPU every pass of the control loop takes as the number of chambers grows.
+Every chamber follows the benchmark profile in the given control mode, so the tracking error shows the chambers
+don't get in each other's way.
+'''
+
+MODES = {"hysteresis": MODE_HYSTERESIS, "pid": MODE_PID, "predictive": MODE_PREDICTIVE}
+
+
+def chamber_pins(index: int) -> tuple:
+    """
+    :return: Heating pin, cooling pin and fan pin of a chamber, 8 chambers use GPIO 2 to 25. No two fans share a
+             hardware PWM channel.
+    """
+    first = 2 + 3 * index
+    return first + 1, first + 2, first
+
+
+def run(chambers: int, modes: list, hours: float, sampling: float) -> dict:
+    with tempfile.TemporaryDirectory() as folder:
+        devices_folder = os.path.join(folder, "devices")
+        pins = SimulatedPi()
+        gpio.use_backend(pins)
+        bus = FakeW1Bus(devices_folder)
+
+        profile = benchmark_profile()
+        profile[SP_SAMPLING] = sampling
+        profile[SP_STATE] = ON
+        clock = SimulatedClock(compile_profile(profile).times[0])
+
+        config = {NAME: "Benchmark", CFG_FAN_SPEED: 0.4, CFG_SAMPLING_PERIOD: sampling, CFG_CHAMBERS: []}
+        simulations = []
+
+        for index in range(chambers):
+            name = "Chamber " + str(index + 1)
+            main_serial = "28-0000000001{0:02d}".format(index)
+            room_serial = "28-0000000002{0:02d}".format(index)
+            heating, cooling, fan = chamber_pins(index)
+            set_point_file = os.path.join(folder, "set_point-" + str(index) + ".json")
+
+            write_settings_atomically(set_point_file, dict(profile, **{SP_MODE: modes[index % len(modes)]}))
+
+            config[CFG_CHAMBERS].append({
+                NAME: name,
+                CFG_SENSORS: [
+                    {NAME: name, CFG_SENSOR_SERIAL: main_serial, TYPE: SENSOR_TYPE_MAIN},
+                    {NAME: name + " room", CFG_SENSOR_SERIAL: room_serial, TYPE: SENSOR_TYPE_ROOM},
+                ],
+                CFG_HEATING_PINS: [heating],
+                CFG_COOLING_PINS: [cooling],
+                CFG_FAN_PIN: fan,
+                CFG_SET_POINT_FILE: set_point_file,
+            })
+
+            simulations.append(SimulatedChamber(ThermalModel(), pins, bus, main_serial, room_serial,
+                                                heating_pins=[heating], cooling_pins=[cooling], fan=fan))
+
+        sampler = SensorSampler(sensors_config(config), devices_folder, clock=clock)
+        scheduler = ChamberScheduler(config, sampler, clock, devices_folder)
+
+        # Slow software PWM toggles the pins in real time, the simulation uses the average duty cycle instead
+        for thermostat in scheduler.thermostats:
+            thermostat.pwm_control = AveragedPeltierPWM()
+
+        target = compile_profile(profile).temp_at
+        sample_times, control_times, calls, errors = [], [], [], []
+        end = clock.time() + hours * 3600
+
+        while clock.time() < end:
+            calls_start = pins.calls
+
+            cpu_start = time.process_time()
+            sampler.sample()
+            sample_times.append(time.process_time() - cpu_start)
+
+            cpu_start = time.process_time()
+            scheduler.iterate()
+            control_times.append(time.process_time() - cpu_start)
+
+            calls.append(pins.calls - calls_start)
+            errors.append([simulation.model.wort_temp - target(clock.time()) for simulation in simulations])
+
+            for thermostat, simulation in zip(scheduler.thermostats, simulations):
+                duty = None
+                if thermostat.mode in (MODE_PID, MODE_PREDICTIVE):
+                    duty = thermostat.pwm_control.duty_cycle
+                simulation.step(sampling, duty)
+
+            clock.advance(sampling)
+
+        loop_times = np.array(sample_times) + np.array(control_times)
+
+        return {
+            "chambers": chambers,
+            "loops": len(loop_times),
+            "mean loop cpu ms": float(np.mean(loop_times) * 1000),
+            "p99 loop cpu ms": float(np.percentile(loop_times, 99) * 1000),
+            "max loop cpu ms": float(np.max(loop_times) * 1000),
+            "mean sample cpu ms": float(np.mean(sample_times) * 1000),
+            "mean control cpu ms per chamber": float(np.mean(control_times) * 1000 / chambers),
+            "pigpio calls per loop": float(np.mean(calls)),
+            "worst chamber rms error": float(np.max(np.sqrt(np.mean(np.square(errors), axis=0)))),
+            "within budget": bool(np.percentile(loop_times, 99) <= LOOP_CPU_BUDGET),
+        }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--chambers', '-c', help='Numbers of chambers to try', nargs='+', type=int,
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--modes', '-m', help='Control modes, assigned to the chambers in turn', nargs='+',
+                        choices=list(MODES), default=list(MODES))
+    parser.add_argument('--hours', help='Simulated hours per run', type=float, default=24)
+    parser.add_argument('--sampling', '-s', help='Seconds between samples', type=float, default=30)
+    parser.add_argument('--output', '-o', help='JSON file to write the results to')
+
+    args = parser.parse_args()
+
+    results = []
+    for count in args.chambers:
+        result = run(count, [MODES[mode] for mode in args.modes], args.hours, args.sampling)
+        results.append(result)
+
+        print(str(count) + " chambers")
+        for metric, value in result.items():
+            print("    {0}: {1:.4g}".format(metric, value) if isinstance(value, float) else
+                  "    {0}: {1}".format(metric, value))
+
+    print("CPU budget per loop: " + str(LOOP_CPU_BUDGET * 1000) + " ms")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+from hardware_control import gpio
+from hardware_control.peltier_control import SoftwarePeltierDirectControl, set_hw_pwm_peltier_control, \
+    SoftwarePeltierPWMControl
+from hardware_control.simulation import SimulatedPi
+
+'''
+Switches the Peltiers back and forth on a SimulatedPi that takes a fixed time for every call, like a round-trip to
+pigpiod, and checks after every call whether heating and cooling gates are on at the same time.
+Compares the bank writes of SoftwarePeltierDirectControl against the original pin by pin writes, and counts the
+calls made by set_hw_pwm_peltier_control. Also reverses the software PWM of SoftwarePeltierPWMControl from
+heating to cooling and back.
+'''
+
+
+class CheckedPi(SimulatedPi):
+    """
+    SimulatedPi that sleeps on every call and counts the calls after which both sides of the H-bridge were on.
+    """
+
+    def __init__(self, latency: float, heating_pins: list, cooling_pins: list):
+        super().__init__()
+        self.latency = latency
+        self.heating_pins = heating_pins
+        self.cooling_pins = cooling_pins
+        self.shoot_through = 0
+
+    def check(self):
+        time.sleep(self.latency)
+        if any(self.output(pin) for pin in self.heating_pins) and any(self.output(pin) for pin in self.cooling_pins):
+            self.shoot_through += 1
+
+    def write(self, pin: int, level: int):
+        super().write(pin, level)
+        self.check()
+
+    def set_bank_1(self, bits: int):
+        super().set_bank_1(bits)
+        self.check()
+
+    def clear_bank_1(self, bits: int):
+        super().clear_bank_1(bits)
+        self.check()
+
+    def set_PWM_range(self, pin: int, pwm_range: int):
+        super().set_PWM_range(pin, pwm_range)
+        self.check()
+
+    def set_PWM_frequency(self, pin: int, frequency: int):
+        super().set_PWM_frequency(pin, frequency)
+        self.check()
+
+    def set_PWM_dutycycle(self, pin: int, duty_cycle: int):
+        super().set_PWM_dutycycle(pin, duty_cycle)
+        self.check()
+
+
+class PinByPinControl(SoftwarePeltierDirectControl):
+    """
+    The original implementation, writing one pin per call, kept here as the baseline for the benchmark.
+    """
+
+    def stop(self):
+        pin_control = gpio.pi()
+
+        for pin in self.cooling_pin_numbers:
+            pin_control.write(pin, 0)
+
+        for pin in self.heating_pin_numbers:
+            pin_control.write(pin, 0)
+
+    def set_state(self, state: SoftwarePeltierDirectControl.State):
+        if state is self.State.OFF:
+            self.stop()
+        else:
+            pin_control = gpio.pi()
+
+            if state is self.State.HEAT:
+                for pin in self.cooling_pin_numbers:
+                    pin_control.write(pin, 0)
+
+                for pin in self.heating_pin_numbers:
+                    pin_control.write(pin, 1)
+            else:
+                for pin in self.cooling_pin_numbers:
+                    pin_control.write(pin, 1)
+
+                for pin in self.heating_pin_numbers:
+                    pin_control.write(pin, 0)
+
+
+def switch(control, switches: int, latency: float) -> dict:
+    pins = CheckedPi(latency, control.heating_pin_numbers, control.cooling_pin_numbers)
+    gpio.use_backend(pins)
+    states = [SoftwarePeltierDirectControl.State.HEAT, SoftwarePeltierDirectControl.State.COOL,
+              SoftwarePeltierDirectControl.State.OFF]
+
+    start = time.perf_counter()
+    for index in range(switches):
+        control.set_state(states[index % len(states)])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "calls per switch": pins.calls / switches,
+        "ms per switch": elapsed / switches * 1000,
+        "calls with both sides on": pins.shoot_through,
+    }
+
+
+def hardware_pwm(switches: int, latency: float) -> dict:
+    pins = CheckedPi(latency, SoftwarePeltierPWMControl.heating_pin_numbers,
+                     SoftwarePeltierPWMControl.cooling_pin_numbers)
+    gpio.use_backend(pins)
+    powers = [0.5, -0.5, 0.25, 0]
+
+    start = time.perf_counter()
+    for index in range(switches):
+        set_hw_pwm_peltier_control(powers[index % len(powers)])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "calls per switch": pins.calls / switches,
+        "ms per switch": elapsed / switches * 1000,
+        "calls with both sides on": pins.shoot_through,
+    }
+
+
+def software_pwm(reversals: int, latency: float) -> dict:
+    pins = CheckedPi(latency, SoftwarePeltierPWMControl.heating_pin_numbers,
+                     SoftwarePeltierPWMControl.cooling_pin_numbers)
+    gpio.use_backend(pins)
+    control = SoftwarePeltierPWMControl(1)
+
+    for _ in range(reversals):
+        control.set_pwm(0.8)
+        time.sleep(0.02)
+        control.set_pwm(-0.8)
+        time.sleep(0.02)
+    control.kill()
+
+    return {
+        "pigpio calls": pins.calls,
+        "calls with both sides on": pins.shoot_through,
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--switches', '-s', help='Number of state changes', type=int, default=300)
+    parser.add_argument('--latency', '-l', help='Milliseconds per pigpio round-trip', type=float, default=0.5)
+
+    args = parser.parse_args()
+    latency = args.latency / 1000
+
+    results = {
+        "Pin by pin writes": switch(PinByPinControl(), args.switches, latency),
+        "Bank writes": switch(SoftwarePeltierDirectControl(), args.switches, latency),
+        "Hardware timed PWM": hardware_pwm(args.switches, latency),
+        "Software PWM reversals": software_pwm(args.switches // 10, latency),
+    }
+
+    for name, result in results.items():
+        print(name)
+        for metric, value in result.items():
+            print("    {0}: {1:.4g}".format(metric, value))
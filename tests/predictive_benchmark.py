@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+import numpy as np
+
+from hardware_control.replay import benchmark_profile
+from hardware_control.simulation import ThermalModel
+from utilities.predictive import PredictiveController, MODEL_STEP
+from utilities.time_temp_parser import compile_profile
+
+'''
+Measures how long the predictive controller takes per update for a few horizons, while it controls the
+thermal model of the simulated chamber through the benchmark profile. Multiply by roughly 20 for a Pi Zero.
+'''
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--days', '-d', help='Simulated days per horizon', default=3)
+    parser.add_argument('--sampling', '-s', help='Seconds between updates', default=30)
+    parser.add_argument('--horizons', help='Comma separated horizons in hours', default='2,6,12,24')
+
+    args = parser.parse_args()
+    sampling = float(args.sampling)
+    profile = compile_profile(benchmark_profile())
+
+    # Start half a day before the crash, so the benchmark includes the controller working ahead of it
+    start = profile.times[-1] - float(args.days) * 24 * 3600 + 12 * 3600
+
+    for hours in args.horizons.split(','):
+        controller = PredictiveController(float(hours) * 3600)
+        model = ThermalModel(temperature=16)
+        solve_times = []
+
+        while model.time < float(args.days) * 24 * 3600:
+            now = start + model.time
+
+            solve_start = time.perf_counter()
+            duty = controller.update(now, model.wort_temp, profile.temp_at, model.ambient_temp())
+            solve_times.append(time.perf_counter() - solve_start)
+
+            model.step(sampling, duty, 0.4)
+
+        solve_times = np.array(solve_times) * 1e6
+        print("{0:>3} h horizon ({1:>3} steps): mean {2:6.0f} us, median {3:6.0f} us, 99th percentile {4:6.0f} us, "
+              "max {5:6.0f} us per update".format(hours, int(float(hours) * 3600 / MODEL_STEP), np.mean(solve_times),
+                                                  np.median(solve_times), np.percentile(solve_times, 99),
+                                                  np.max(solve_times)))
+        print("    identified", controller.identifier.model())
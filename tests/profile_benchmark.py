@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utilities.time_temp_parser import SetPoint, SetPointType, get_temperature_profile, CompiledProfile
+from utilities.vectorized_profile import get_temperature_profile_array, get_temps_for_times
+
+'''
+Compares the list based get_temperature_profile with the NumPy version on a 4 week lager profile.
+'''
+
+
+def lager_profile(start: datetime) -> list:
+    return [
+        SetPoint(10, start),
+        SetPoint(10, start + timedelta(days=7)),
+        SetPoint(16, start + timedelta(days=9), SetPointType.RAMP),
+        SetPoint(16, start + timedelta(days=12)),
+        SetPoint(2, start + timedelta(days=13), SetPointType.RAMP),
+        SetPoint(0, start + timedelta(days=28)),
+    ]
+
+
+def time_function(function, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--interval', '-i', help='Resolution of the profile in minutes', default=1)
+    parser.add_argument('--repeats', '-r', help='How many times to run each function', default=5)
+
+    args = parser.parse_args()
+    interval = int(args.interval)
+    repeats = int(args.repeats)
+
+    set_points = lager_profile(datetime(2021, 8, 5, 17, 30))
+
+    times, temps = get_temperature_profile(set_points, interval)
+    array_times, array_temps = get_temperature_profile_array(set_points, interval)
+
+    list_time = time_function(lambda: get_temperature_profile(set_points, interval), repeats)
+    array_time = time_function(lambda: get_temperature_profile_array(set_points, interval), repeats)
+
+    print("{0} time points".format(len(array_times)))
+    print("Lists: {0:.2f} ms".format(list_time * 1000))
+    print("NumPy: {0:.2f} ms ({1:.0f}x faster)".format(array_time * 1000, list_time / array_time))
+
+    # Check the NumPy version against the bisection look-up, which matches get_temp_for_time
+    profile = CompiledProfile(set_points)
+    expected = np.array([profile.temp_at(time_point.timestamp()) for time_point in array_times.astype(datetime)])
+    print("Largest difference to CompiledProfile: {0}".format(np.max(np.abs(expected - array_temps))))
+
+    # Logged reads are rarely on the minute, so also check arbitrary query times
+    query_times = array_times[:-1] + np.random.randint(0, interval * 60, len(array_times) - 1).astype('timedelta64[s]')
+    query_time = time_function(lambda: get_temps_for_times(set_points, query_times), repeats)
+    print("Arbitrary query times: {0:.2f} ms".format(query_time * 1000))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import argparse
+import os
+import tempfile
+import time
+
+from hardware_control import temperature_sensors
+from hardware_control.temperature_sensors import read_temps, read_temp_raw
+from utilities.constants import CFG_SENSORS, CFG_SENSOR_SERIAL, NAME, TYPE, CFG_SENSOR_TIMEOUT
+
+'''
+Times read_temps sweeps against a fake /sys/bus/w1/devices tree.
+Every read of a w1_slave file is delayed to simulate the DS18B20 conversion time,
+and one of the probes can be made to hang, its w1_slave replaced by a FIFO nobody writes to, to check that it
+neither stalls a sweep nor, sweep after sweep, takes up the threads the other sensors are read with.
+'''
+
+
+def create_fake_devices(folder: str, sensors: int) -> dict:
+    """
+    Creates a fake 1-wire devices folder with the given number of sensors, and returns a config using them.
+    """
+    config = {NAME: "Benchmark", CFG_SENSORS: []}
+
+    for index in range(sensors):
+        serial = "28-00000000000" + str(index)
+        os.makedirs(os.path.join(folder, serial))
+
+        with open(os.path.join(folder, serial, 'w1_slave'), 'w') as w1_slave:
+            w1_slave.write("72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n"
+                           "72 01 4b 46 7f ff 0e 10 57 t=" + str(18000 + index * 125) + "\n")
+
+        config[CFG_SENSORS].append({NAME: "Sensor " + str(index), CFG_SENSOR_SERIAL: serial, TYPE: "Main"})
+
+    return config
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sensors', '-s', help='Number of fake sensors', default=6)
+    parser.add_argument('--latency', '-l', help='Conversion time per read in seconds', default=0.75)
+    parser.add_argument('--dead', '-d', help="Make the first sensor hang", action='store_true')
+    parser.add_argument('--sweeps', '-n', help='Number of sweeps', type=int, default=1)
+
+    args = parser.parse_args()
+    latency = float(args.latency)
+
+    with tempfile.TemporaryDirectory() as devices_folder:
+        config = create_fake_devices(devices_folder, int(args.sensors))
+        config[CFG_SENSOR_TIMEOUT] = 2 * latency
+        dead_file = os.path.join(devices_folder, config[CFG_SENSORS][0][CFG_SENSOR_SERIAL], 'w1_slave')
+
+        if args.dead:
+            os.remove(dead_file)
+            os.mkfifo(dead_file)
+
+        def slow_read(device_file):
+            time.sleep(latency)
+            return read_temp_raw(device_file)
+
+        temperature_sensors.read_temp_raw = slow_read
+
+        try:
+            for sweep in range(args.sweeps):
+                start = time.monotonic()
+                temperatures = read_temps(config, devices_folder)
+                duration = time.monotonic() - start
+
+                print("Sweep {0}: read {1} of {2} sensors in {3:.2f} seconds (sequential reads would take {4:.2f} "
+                      "seconds)".format(sweep + 1, len(temperatures), args.sensors, duration,
+                                        int(args.sensors) * latency))
+
+                if len(temperatures) < int(args.sensors) - args.dead:
+                    raise RuntimeError("Healthy sensors were left out of sweep " + str(sweep + 1))
+
+            for name in temperatures:
+                print(name, ": ", temperatures[name], sep="")
+        finally:
+            if args.dead:
+                # Lets the hung read finish, so the pool can shut down
+                descriptor = os.open(dead_file, os.O_WRONLY | os.O_NONBLOCK)
+                os.close(descriptor)
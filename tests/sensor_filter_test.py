@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import argparse
+import math
+import random
+
+from hardware_control.sensor_filter import FilterStage
+from utilities.constants import CFG_SENSORS, NAME, CFG_FILTER, FILTER_KALMAN, FILTER_MEDIAN, FILTER_NONE
+
+'''
+Feeds a slowly drifting temperature with sensor noise, 85.0 C power-on resets and random glitches through each
+sensor filter, and compares the error of the raw and the filtered reads.
+'''
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--samples', '-n', help='Number of reads', default=20000)
+    parser.add_argument('--period', '-p', help='Seconds between reads', default=5)
+    parser.add_argument('--noise', help='Standard deviation of the sensor noise in C', default=0.05)
+    parser.add_argument('--glitches', '-g', help='Fraction of reads that are glitches', default=0.002)
+    parser.add_argument('--resets', '-r', help='Fraction of reads that are 85.0 C resets', default=0.001)
+
+    args = parser.parse_args()
+    period = float(args.period)
+
+    random.seed(1)
+    truth = []
+    reads = []
+    for sample in range(int(args.samples)):
+        true_temp = 18 + 2 * math.sin(sample * period / (6 * 3600) * 2 * math.pi)
+        read = round((true_temp + random.gauss(0, float(args.noise))) / 0.0625) * 0.0625
+
+        chance = random.random()
+        if chance < float(args.resets):
+            read = 85.0
+        elif chance < float(args.resets) + float(args.glitches):
+            read = true_temp + random.choice([-1, 1]) * random.uniform(2, 20)
+
+        truth.append(true_temp)
+        reads.append(read)
+
+    errors = [read - true_temp for read, true_temp in zip(reads, truth)]
+    print("    Raw: RMS error {0:.3f} C, max error {1:.3f} C".format(
+        math.sqrt(sum(error ** 2 for error in errors) / len(errors)), max(abs(error) for error in errors)))
+
+    for kind in (FILTER_NONE, FILTER_MEDIAN, FILTER_KALMAN):
+        stage = FilterStage({CFG_SENSORS: [{NAME: "Temperature"}], CFG_FILTER: kind})
+
+        errors = []
+        for sample, read in enumerate(reads):
+            filtered = stage.apply({"Temperature": str(read)}, sample * period)
+            if "Temperature" in filtered:
+                errors.append(float(filtered["Temperature"]) - truth[sample])
+
+        rms = math.sqrt(sum(error ** 2 for error in errors) / len(errors))
+        print("{0:>7}: RMS error {1:.3f} C, max error {2:.3f} C, rejected {3} reads".format(
+            kind, rms, max(abs(error) for error in errors), stage.filters["Temperature"].rejected))
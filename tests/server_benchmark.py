@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from tests.read_temps_benchmark import create_fake_devices
+from utilities.constants import CFG_SET_POINT_FILE, CLI_GET_TEMP
+
+'''
+Compares the memory, idle CPU and requests per second of the two ways of running Brewmoth with the thermostat:
+ - flask: the Flask app, served by a threaded WSGI server, with its own sampler thread and update thread, next to the
+          thermostat in a process of its own with another sampler, the way the two services run it
+ - async: the asyncio core of async_server.py, with everything as tasks on one event loop in one process
+
+Both read a fake 1-wire tree and drive a SimulatedPi, so this runs on any machine. uWSGI isn't needed, the Flask app
+is served by werkzeug's threaded server instead, which is lighter than a uWSGI worker with its threads.
+'''
+
+
+def serve(kind: str, config_path: str, devices_folder: str, port: int, ready_file: str):
+    """
+    Runs one of the servers until it is killed, writing the ids of its processes to the ready file once it is up.
+    """
+    from hardware_control import gpio
+    from hardware_control.simulation import SimulatedPi
+
+    gpio.use_backend(SimulatedPi())
+
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+
+    def ready(pids: list):
+        with open(ready_file, 'w') as file:
+            file.write(json.dumps(pids))
+
+    if kind == "flask":
+        from werkzeug.serving import make_server
+
+        from brewmoth_server import api
+        from brewmoth_server.brewmoth import app
+        from hardware_control.chambers import ChamberScheduler
+        from hardware_control.sensor_sampler import SensorSampler
+        from utilities.chamber_config import sensors_config
+
+        api.setup(False, config, devices_folder)
+        api.SAMPLER.start()
+
+        scheduler = ChamberScheduler(config, SensorSampler(sensors_config(config), devices_folder),
+                                     devices_folder=devices_folder)
+        with scheduler:
+            server = make_server("127.0.0.1", port, app, threaded=True)
+            ready([os.getpid(), scheduler.process.pid])
+            server.serve_forever()
+    else:
+        from aiohttp import web
+
+        from brewmoth_server.async_server import create_app
+
+        app = create_app(False, True, config, devices_folder)
+
+        async def on_startup(_):
+            ready([os.getpid()])
+
+        app.on_startup.append(on_startup)
+        web.run_app(app, host="127.0.0.1", port=port, print=None)
+
+
+def cpu_seconds(pid: int) -> float:
+    """
+    :return: User and system CPU time the process used so far, in seconds
+    """
+    with open("/proc/" + str(pid) + "/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def resident_memory(pid: int) -> float:
+    """
+    :return: Resident memory of the process in MB
+    """
+    with open("/proc/" + str(pid) + "/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+    return 0
+
+
+async def load(url: str, method: str, body, concurrency: int, duration: float) -> (float, int):
+    """
+    Keeps the given number of requests in flight for the duration.
+
+    :return: The completed requests per second, and the number of failed requests
+    """
+    deadline = time.monotonic() + duration
+    completed = [0]
+    failed = [0]
+
+    async def client(session: aiohttp.ClientSession):
+        while time.monotonic() < deadline:
+            async with session.request(method, url, json=body) as response:
+                await response.read()
+                if response.status == 200:
+                    completed[0] += 1
+                else:
+                    failed[0] += 1
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+
+    return completed[0] / duration, failed[0]
+
+
+def measure(kind: str, args, folder: str, config_path: str, devices_folder: str) -> dict:
+    port = 6700 + (kind == "async")
+    ready_file = os.path.join(folder, kind + ".ready")
+    base = "http://127.0.0.1:" + str(port)
+
+    process = subprocess.Popen([sys.executable, __file__, "--serve", kind, "--config", config_path,
+                                "--devices", devices_folder, "--port", str(port), "--ready", ready_file],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    pids = []
+    try:
+        while not os.path.exists(ready_file):
+            if process.poll() is not None:
+                raise RuntimeError(kind + " server failed to start")
+            time.sleep(0.1)
+        with open(ready_file) as file:
+            pids = json.load(file)
+
+        # Let the samplers and the control loop settle in before measuring
+        time.sleep(args.warm_up)
+
+        memory = sum(resident_memory(pid) for pid in pids)
+
+        cpu_start = sum(cpu_seconds(pid) for pid in pids)
+        time.sleep(args.idle)
+        idle_cpu = (sum(cpu_seconds(pid) for pid in pids) - cpu_start) / args.idle
+
+        temperatures_rps, temperatures_failed = asyncio.run(
+            load(base + "/cli", "POST", CLI_GET_TEMP, args.concurrency, args.duration))
+        history_rps, history_failed = asyncio.run(
+            load(base + "/history?sensor=Sensor%200", "GET", None, args.concurrency, args.duration))
+
+        return {
+            "processes": len(pids),
+            "resident memory (MB)": memory,
+            "idle CPU (%)": idle_cpu * 100,
+            "temperature requests per second": temperatures_rps,
+            "history requests per second": history_rps,
+            "failed requests": temperatures_failed + history_failed,
+        }
+    finally:
+        # The thermostat process doesn't get to stop on its own when the server is terminated
+        for pid in pids[1:]:
+            os.kill(pid, signal.SIGTERM)
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--duration', '-t', help='Seconds of load per endpoint', type=float, default=5)
+    parser.add_argument('--idle', '-i', help='Seconds to measure the idle CPU over', type=float, default=30)
+    parser.add_argument('--warm-up', '-w', help='Seconds to wait after starting a server', type=float, default=5)
+    parser.add_argument('--concurrency', '-c', help='Requests in flight at once', type=int, default=8)
+    parser.add_argument('--sensors', '-s', help='Number of fake sensors', type=int, default=2)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    parser.add_argument('--devices', help=argparse.SUPPRESS)
+    parser.add_argument('--port', help=argparse.SUPPRESS, type=int)
+    parser.add_argument('--ready', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.config, args.devices, args.port, args.ready)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as folder:
+        devices_folder = os.path.join(folder, "devices")
+        os.makedirs(devices_folder)
+        config = create_fake_devices(devices_folder, args.sensors)
+        config[CFG_SET_POINT_FILE] = os.path.join(folder, "set_point.json")
+
+        config_path = os.path.join(folder, "config.json")
+        with open(config_path, 'w') as config_file:
+            config_file.write(json.dumps(config))
+
+        for kind in ("flask", "async"):
+            print(kind)
+            for metric, value in measure(kind, args, folder, config_path, devices_folder).items():
+                print("    {0}: {1:.4g}".format(metric, value))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from hardware_control import gpio
+from hardware_control.fan_control import set_fan_speed
+from hardware_control.peltier_control import SoftwarePeltierDirectControl
+from hardware_control.simulation import ThermalModel, SimulatedPi, FakeW1Bus, SimulatedChamber
+from hardware_control.temperature_sensors import read_temp
+from hardware_control.thermostat import hysteresis_state
+from utilities.time_temp_parser import SetPoint, SetPointType, CompiledProfile
+
+'''
+Replays a two week fermentation profile through the on/off thermostat logic and the real Peltier and fan code,
+with the hardware replaced by the simulated chamber. Runs in seconds rather than weeks.
+'''
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--days', '-d', help='Length of the simulation in days', default=14)
+    parser.add_argument('--sampling', '-s', help='Seconds between thermostat samples', default=30)
+    parser.add_argument('--heat_tolerance', help='Heat tolerance', default=1)
+    parser.add_argument('--cool_tolerance', help='Cool tolerance', default=0.1)
+    parser.add_argument('--fan_speed', '-f', help='Fan speed', default=0.4)
+
+    args = parser.parse_args()
+    sampling = float(args.sampling)
+    heat_tolerance = float(args.heat_tolerance)
+    cool_tolerance = float(args.cool_tolerance)
+    fan_speed = float(args.fan_speed)
+
+    start = datetime(2021, 8, 5, 17, 30)
+    profile = CompiledProfile([
+        SetPoint(18, start),
+        SetPoint(18, start + timedelta(days=5)),
+        SetPoint(21, start + timedelta(days=7), SetPointType.RAMP),
+        SetPoint(21, start + timedelta(days=10)),
+        SetPoint(2, start + timedelta(days=10, hours=1)),
+    ])
+
+    pins = SimulatedPi()
+    gpio.use_backend(pins)
+
+    with tempfile.TemporaryDirectory() as devices_folder:
+        bus = FakeW1Bus(devices_folder)
+        chamber = SimulatedChamber(ThermalModel(temperature=20), pins, bus, "28-000000000001", "28-000000000002")
+
+        peltier_control = SoftwarePeltierDirectControl()
+        set_fan_speed(fan_speed)
+
+        previous_state = SoftwarePeltierDirectControl.State.OFF
+        toggles = 0
+        squared_error = 0
+        samples = 0
+
+        wall_start = time.monotonic()
+        duration = float(args.days) * 24 * 3600
+
+        while chamber.model.time < duration:
+            now = start.timestamp() + chamber.model.time
+            target = profile.temp_at(now)
+            current_temp = read_temp(bus.location(chamber.main_serial))
+
+            state = hysteresis_state(current_temp, target, target - heat_tolerance, target + cool_tolerance)
+            if state != previous_state:
+                peltier_control.set_state(state)
+                previous_state = state
+                toggles += 1
+
+            squared_error += (current_temp - target) ** 2
+            samples += 1
+
+            chamber.step(sampling)
+
+        wall_time = time.monotonic() - wall_start
+
+    print("Simulated {0} days in {1:.1f} seconds ({2:.0f}x real time)".format(
+        args.days, wall_time, duration / wall_time))
+    print("RMS error: {0:.3f} C, Peltier toggles: {1}, Peltier energy: {2:.2f} kWh".format(
+        (squared_error / samples) ** 0.5, toggles, chamber.model.energy / 3.6e6))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+import argparse
+import os
+import tempfile
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+
+from brewmoth_server.logging import LoggerWorker, OverflowPolicy
+from brewmoth_server.loggers.brewfather import BrewFatherLogging
+from utilities.constants import NAME, CFG_SENSORS, TYPE, SENSOR_TYPE_MAIN, SENSOR_TYPE_ROOM, \
+    CFG_BREWFATHER_INTERVAL
+
+'''
+Points the Brewfather logger at a local stub server that answers slowly, or fails,
+and checks that submitting temperatures never blocks, that the queue overflows as configured
+and that readings the server rejected are retried without being stored again. Then logs once per posting interval,
+the way the UpdateThread does, while every post takes a while, and checks that every reading is posted and none is
+left pending.
+'''
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    delay = 2  # Seconds
+    failures = 0  # How many requests to fail before answering normally
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.delay)
+
+        if SlowHandler.failures > 0:
+            SlowHandler.failures -= 1
+            self.send_response(503)
+        else:
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, message_format, *args):
+        print("Stub server:", message_format % args)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--delay', '-d', help='Seconds the stub server takes to answer', default=2)
+    parser.add_argument('--failures', '-f', help='Number of requests the stub server fails first', default=2)
+    parser.add_argument('--readings', '-r', help='Number of readings to submit', default=10)
+    parser.add_argument('--queue', '-q', help='Maximum queue size', default=4)
+    parser.add_argument('--overflow', '-o', help='Overflow policy', default=OverflowPolicy.DROP_OLDEST.value)
+    parser.add_argument('--interval', '-i', help='Posting interval in seconds, for the periodic logging', default=1)
+
+    args = parser.parse_args()
+
+    SlowHandler.delay = float(args.delay)
+    SlowHandler.failures = int(args.failures)
+
+    server = HTTPServer(('127.0.0.1', 0), SlowHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    config = {NAME: "Stub", CFG_SENSORS: [{NAME: "Temperature", TYPE: SENSOR_TYPE_MAIN},
+                                          {NAME: "Room Temperature", TYPE: SENSOR_TYPE_ROOM}],
+              CFG_BREWFATHER_INTERVAL: 0}
+    pending_folder = tempfile.mkdtemp()
+    logger = BrewFatherLogging(config, "http://127.0.0.1:{0}/stream".format(server.server_port),
+                               os.path.join(pending_folder, "pending.json"))
+    logger.timeout = 3 * SlowHandler.delay
+
+    stored = []
+    store = logger.pending.store
+    logger.pending.store = lambda payload: (stored.append(payload), store(payload))
+
+    worker = LoggerWorker(logger, max_queue=int(args.queue), overflow=OverflowPolicy(args.overflow), backoff=0.5)
+    worker.start()
+
+    start = time.monotonic()
+    for reading in range(int(args.readings)):
+        worker.submit({"Temperature": 18 + reading / 10, "Room Temperature": 21})
+    print("Submitted {0} readings in {1:.3f} ms".format(args.readings, (time.monotonic() - start) * 1000))
+
+    while worker.queue:
+        print(worker.metrics())
+        time.sleep(SlowHandler.delay)
+
+    worker.kill()
+    worker.join()
+    print(worker.metrics())
+    print("Readings stored: {0}, still pending: {1}".format(len(stored), logger.pending.get()))
+    # Every batch handed to the logger is stored once, on the first attempt, however often it's retried
+    if len(stored) != worker.sent + worker.failures:
+        raise RuntimeError("Retries stored readings again")
+
+    interval = float(args.interval)
+    SlowHandler.delay = interval * 0.3
+    config[CFG_BREWFATHER_INTERVAL] = interval
+    logger = BrewFatherLogging(config, "http://127.0.0.1:{0}/stream".format(server.server_port),
+                               os.path.join(pending_folder, "periodic-pending.json"))
+
+    deadline = time.monotonic()
+    for reading in range(int(args.readings)):
+        time.sleep(max(deadline - time.monotonic(), 0))
+        logger.log({"Temperature": 18 + reading / 10, "Room Temperature": 21})
+        deadline += interval
+
+    print("Logged {0} readings once every {1} seconds, with posts taking {2} seconds, {3} still pending".format(
+        args.readings, interval, SlowHandler.delay, logger.pending.get()))
+    if logger.pending.get() is not None:
+        raise RuntimeError("The last reading wasn't posted")
+
+    server.shutdown()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+import argparse
+import statistics
+import time
+from threading import Thread
+
+from gpiozero import OutputDevice
+from gpiozero.pins.mock import MockFactory, MockPin
+
+from hardware_control.slow_pwm import SlowPWM, PWMScheduler
+
+'''
+Compares the CPU use and edge jitter of SlowPWM against the original busy-spinning implementation,
+using gpiozero's mock pins so it can be run on any machine.
+'''
+
+
+class RecordingPin(MockPin):
+    """
+    Mock pin that records the absolute time (from time.monotonic) of every rising edge.
+    """
+
+    def clear_states(self):
+        super().clear_states()
+        self.rising_edges = []
+
+    def _change_state(self, value):
+        changed = super()._change_state(value)
+        if changed and value:
+            self.rising_edges.append(time.monotonic())
+        return changed
+
+
+class BusySpinPWM(Thread):
+    """
+    The original SlowPWM implementation, kept here as the baseline for the benchmark.
+    """
+
+    def __init__(self, pins: list, frequency: float, duty_cycle: float):
+        super().__init__()
+        self.pins = pins
+        self.frequency = frequency
+        self.duty_cycle = duty_cycle
+        self.on = True
+        self.daemon = True
+
+    def kill(self):
+        self.on = False
+        self.join()
+        for pin in self.pins:
+            pin.off()
+
+    def run(self) -> None:
+        period = int((1 / self.frequency) * 1000000000)
+        on_time = int(period * self.duty_cycle)
+
+        turned_off = False
+
+        start = time.time_ns()
+        for pin in self.pins:
+            pin.on()
+
+        while self.on:
+            time_lapsed_since_start = time.time_ns() - start
+
+            if self.duty_cycle != 1 and not turned_off and time_lapsed_since_start >= on_time:
+                for pin in self.pins:
+                    pin.off()
+                turned_off = True
+
+            if self.duty_cycle != 0 and turned_off and time_lapsed_since_start >= period:
+                start = time.time_ns()
+                for pin in self.pins:
+                    pin.on()
+                turned_off = False
+
+
+def edge_jitter(edges: list, period: float) -> (float, float):
+    """
+    :return: The mean and maximum absolute deviation, in milliseconds, of the rising edges from the nominal period.
+    """
+    deviations = [abs((second - first) - period) * 1000 for first, second in zip(edges, edges[1:])]
+
+    if not deviations:
+        return 0, 0
+
+    return statistics.mean(deviations), max(deviations)
+
+
+def benchmark(name: str, start, stop, pins: list, duration: float, frequency: float):
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+
+    start()
+    time.sleep(duration)
+    stop()
+
+    cpu_time = time.process_time() - cpu_start
+    wall_time = time.monotonic() - wall_start
+
+    mean_jitter, max_jitter = edge_jitter(pins[0].pin.rising_edges, 1 / frequency)
+
+    print("{0}: {1:.1f}% CPU, {2} rising edges, jitter mean {3:.3f} ms, max {4:.3f} ms".format(
+        name, 100 * cpu_time / wall_time, len(pins[0].pin.rising_edges), mean_jitter, max_jitter))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--duration', '-t', help='How long to run each implementation for in seconds', default=10)
+    parser.add_argument('--frequency', '-f', help='PWM frequency in hertz', default=5)
+    parser.add_argument('--duty_cycle', '-d', help='PWM duty cycle from 0 to 1', default=0.3)
+    parser.add_argument('--groups', '-g', help='Number of pin groups to drive at once', default=2)
+
+    args = parser.parse_args()
+
+    duration = float(args.duration)
+    frequency = float(args.frequency)
+    duty_cycle = float(args.duty_cycle)
+    groups = int(args.groups)
+
+    factory = MockFactory(pin_class=RecordingPin)
+
+    busy_pins = [[OutputDevice(2 * group, pin_factory=factory), OutputDevice(2 * group + 1, pin_factory=factory)]
+                 for group in range(groups)]
+    busy_threads = [BusySpinPWM(pins, frequency, duty_cycle) for pins in busy_pins]
+
+    def start_busy():
+        for thread in busy_threads:
+            thread.start()
+
+    def stop_busy():
+        for thread in busy_threads:
+            thread.kill()
+
+    benchmark("Busy spin", start_busy, stop_busy, busy_pins[0], duration, frequency)
+
+    scheduler = PWMScheduler()
+    offset = 2 * groups
+    scheduled = [SlowPWM([offset + 2 * group, offset + 2 * group + 1],
+                         frequency=frequency,
+                         duty_cycle=duty_cycle,
+                         scheduler=scheduler,
+                         pin_factory=factory) for group in range(groups)]
+
+    def start_scheduled():
+        for pwm in scheduled:
+            pwm.start()
+
+    def stop_scheduled():
+        for pwm in scheduled:
+            pwm.stop()
+
+    benchmark("Scheduled", start_scheduled, stop_scheduled, scheduled[0].pins, duration, frequency)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import argparse
+import tempfile
+import time
+from threading import Thread
+
+import requests
+from werkzeug.serving import make_server
+
+from brewmoth_server import api, brewmoth
+from hardware_control.sensor_sampler import SensorSampler
+from tests.read_temps_benchmark import create_fake_devices
+from utilities.constants import CFG_SAMPLING_PERIOD, STREAM_TIME
+from utilities.event_stream import parse_events
+
+'''
+Serves the /stream endpoint from a sampler sweeping a fake 1-wire tree and follows it with a number of clients,
+checking that they all get every reading from the one sweep of the sensors. A subscriber that stops taking readings
+is left to fall behind, to check that its queue stays bounded and the sampler and the other clients aren't held up.
+'''
+
+
+def follow(watched: list, count: int):
+    with requests.get("http://127.0.0.1:" + str(PORT) + "/stream", stream=True, timeout=10) as response:
+        for _, data in parse_events(response.iter_lines(decode_unicode=True)):
+            watched.append(data[STREAM_TIME])
+            if len(watched) >= count:
+                return
+
+
+PORT = 6667
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--clients', '-c', help='Number of stream clients', type=int, default=10)
+    parser.add_argument('--readings', '-r', help='Readings each client waits for', type=int, default=20)
+    parser.add_argument('--period', '-p', help='Seconds between sweeps of the sensors', type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as devices_folder:
+        config = create_fake_devices(devices_folder, 4)
+        config[CFG_SAMPLING_PERIOD] = args.period
+
+        sweeps = []
+        sampler = SensorSampler(config, devices_folder)
+        sampler.add_listener(lambda reading: sweeps.append(reading.time))
+        sampler.add_listener(lambda reading: api.BROADCASTER.publish(api.reading_event(reading)))
+        api.SAMPLER = sampler
+
+        server = make_server("127.0.0.1", PORT, brewmoth.app, threaded=True)
+        Thread(target=server.serve_forever, daemon=True).start()
+
+        lagging = api.BROADCASTER.subscribe()
+        sampler.start()
+
+        received = [[] for _ in range(args.clients)]
+        clients = [Thread(target=follow, args=(watched, args.readings)) for watched in received]
+        start = time.monotonic()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        duration = time.monotonic() - start
+
+        # All clients share the sweeps; only the first event of each is the latest reading from before it connected
+        first_sweep = min(watched[1] for watched in received)
+        swept = len([sweep for sweep in sweeps if first_sweep <= sweep <= max(max(watched) for watched in received)])
+        print("{0} clients got {1} readings each in {2:.1f} seconds, from {3} sweeps of the sensors".format(
+            args.clients, args.readings, duration, swept))
+
+        def complete(watched: list) -> bool:
+            start_index = sweeps.index(watched[1])
+            return watched[1:] == sweeps[start_index:start_index + len(watched) - 1]
+
+        missed = [watched for watched in received if not complete(watched)]
+        print("Clients with readings missing or out of order: " + str(len(missed)))
+
+        print("Lagging subscriber: {0} readings queued, {1} skipped, of {2} published".format(
+            len(lagging.queue), lagging.skipped, api.BROADCASTER.published))
+        lagging.close()
+
+        # The clients that went away must have been unsubscribed
+        time.sleep(0.5)
+        print("Subscribers left: " + str(len(api.BROADCASTER.subscriptions)))
+
+        server.shutdown()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import argparse
+import time
+from multiprocessing import get_context
+
+import numpy as np
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from utilities.telemetry import TelemetryWriter, TelemetryReader
+
+'''
+Appends to a telemetry buffer as fast as it can while another process reads it, and checks the reader only ever
+sees whole records, in order, however often the buffer wraps around. Also compares what an append costs the control
+loop with writing the same line to the journal.
+'''
+
+NAME = "brewmoth-telemetry-test"
+
+
+def append(writer: TelemetryWriter, index: int):
+    # Every field is derived from the index, so a torn record can be spotted
+    writer.append(index, index % 1000, 20, 19, 20.1, index % 3 - 1, 0.5, 1, index % 100)
+
+
+def read(reads: int, capacity: int, queue):
+    checked = 0
+    with TelemetryReader(NAME) as reader:
+        for _ in range(reads):
+            records = reader.recent()
+            times = records['time']
+
+            if len(records) > capacity or np.any(np.diff(times) != 1):
+                queue.put("Records out of order")
+                return
+            if np.any(records['temperature'] != times % 1000) or np.any(records['duration'] != times % 100):
+                queue.put("Torn record")
+                return
+
+            checked += len(records)
+
+    queue.put(checked)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--capacity', '-c', help='Records in the buffer', type=int, default=100)
+    parser.add_argument('--reads', '-r', help='Number of reads of the whole buffer', type=int, default=20000)
+    parser.add_argument('--appends', '-n', help='Number of appends to time', type=int, default=10000)
+
+    args = parser.parse_args()
+
+    writer = TelemetryWriter(NAME, args.capacity)
+    try:
+        start = time.perf_counter()
+        for index in range(args.appends):
+            append(writer, index)
+        appending = (time.perf_counter() - start) / args.appends
+
+        start = time.perf_counter()
+        for index in range(args.appends):
+            journal.write("Temperature " + str(index % 1000) + ", target 20, heating, duty 0.5, fan 1")
+        journaling = (time.perf_counter() - start) / args.appends
+
+        print("Append: {0:.2f} us, journal write: {1:.2f} us".format(appending * 1e6, journaling * 1e6))
+
+        # A reader in another process, started the way the web server would find the buffer
+        context = get_context('spawn')
+        queue = context.Queue()
+        reader = context.Process(target=read, args=(args.reads, args.capacity, queue))
+        reader.start()
+
+        index = args.appends
+        while reader.is_alive():
+            append(writer, index)
+            index += 1
+        reader.join()
+
+        result = queue.get()
+        if not isinstance(result, int):
+            raise RuntimeError(result)
+        print("Reader checked " + str(result) + " records while the buffer wrapped around " +
+              str(index // args.capacity) + " times")
+
+        with TelemetryReader(NAME) as reader:
+            assert reader.recent(10)['time'].tolist() == list(range(index - 10, index))
+            assert len(reader.recent(since=index - 5)) == 5
+    finally:
+        writer.close()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+import argparse
+import statistics
+import time
+from threading import Thread
+
+from hardware_control import gpio
+from hardware_control.simulation import SimulatedPi
+from hardware_control.slow_pwm import SlowPWM, PWMScheduler
+from hardware_control.wave_pwm import WavePWM, PWMWave
+
+'''
+Compares the edge jitter and CPU use of SlowPWM, which toggles the pins from a Python thread, against WavePWM,
+which has pigpiod play the pattern back from DMA.
+
+By default SlowPWM drives gpiozero mock pins and WavePWM a SimulatedPi, so it runs on any machine. The mock pins
+time stamp every edge, which shows how late the Python thread gets, optionally with other Python threads competing
+for the GIL. The SimulatedPi can't play a wave, so for WavePWM this measures what is left for Python to do: the CPU
+and the pigpio calls for the duty cycle changes, and how far the edges in the wave are from the requested ones.
+
+With --pigpio both run on a Raspberry Pi, and the rising edges are time stamped by pigpiod itself.
+'''
+
+
+def busy_load(stop: list):
+    """
+    Keeps the GIL busy, like the rest of the thermostat process at its worst.
+    """
+    while not stop:
+        sum(range(1000))
+
+
+def jitter(edges: list, period: float) -> (float, float):
+    """
+    :param edges: Times of the rising edges in seconds
+    :return: The mean and maximum absolute deviation, in milliseconds, of the rising edges from the nominal period
+    """
+    deviations = [abs((second - first) - period) * 1000 for first, second in zip(edges, edges[1:])]
+
+    if not deviations:
+        return 0, 0
+
+    return statistics.mean(deviations), max(deviations)
+
+
+def run(name: str, pwm, edges, args, load: int = 0) -> float:
+    """
+    Runs the PWM for the duration, changing its duty cycle back and forth.
+
+    :param edges: Returns the times of the rising edges recorded so far, or None if they can't be recorded
+    :return: CPU seconds used by the process
+    """
+    stop_load = []
+    load_threads = [Thread(target=busy_load, args=(stop_load,), daemon=True) for _ in range(load)]
+    for thread in load_threads:
+        thread.start()
+
+    cpu_start = time.process_time()
+    pwm.start()
+    for index in range(args.changes):
+        time.sleep(args.duration / args.changes)
+        pwm.duty_cycle = DUTY_CYCLES[index % len(DUTY_CYCLES)]
+    pwm.stop()
+    cpu_time = time.process_time() - cpu_start
+
+    stop_load.append(True)
+    for thread in load_threads:
+        thread.join()
+
+    recorded = edges()
+    if recorded is None:
+        print("{0}: {1:.1f} ms CPU".format(name, cpu_time * 1000))
+    else:
+        mean_jitter, max_jitter = jitter(recorded, 1 / args.frequency)
+        print("{0}: {1:.1f} ms CPU, {2} rising edges, jitter mean {3:.3f} ms, max {4:.3f} ms".format(
+            name, cpu_time * 1000, len(recorded), mean_jitter, max_jitter))
+
+    return cpu_time
+
+
+DUTY_CYCLES = [0.6, 0.3]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--duration', '-t', help='Seconds to run each implementation for', type=float, default=10)
+    parser.add_argument('--frequency', '-f', help='PWM frequency in hertz', type=float, default=5)
+    parser.add_argument('--load', '-l', help='Number of busy Python threads for the second run of each',
+                        type=int, default=2)
+    parser.add_argument('--changes', '-c', help='Number of duty cycle changes during a run', type=int, default=10)
+    parser.add_argument('--pins', '-p', help='Pins to drive', type=int, nargs='+', default=[5, 27])
+    parser.add_argument('--pigpio', help='Run on the Raspberry Pi, with pigpiod time stamping the edges',
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    if args.pigpio:
+        import pigpio
+
+        pins = gpio.pi()
+        factory = None  # SlowPWM switches the pins through the same pigpio connection
+        ticks = []
+        callback = pins.callback(args.pins[0], pigpio.RISING_EDGE, lambda pin, level, tick: ticks.append(tick))
+
+        def pigpio_edges():
+            # pigpiod's ticks are microseconds that wrap around every 72 minutes
+            edges = [0.0] if ticks else []
+            for first, second in zip(ticks, ticks[1:]):
+                edges.append(edges[-1] + ((second - first) & 0xFFFFFFFF) / 1000000)
+            ticks.clear()
+            return edges
+
+        slow_edges = wave_edges = pigpio_edges
+    else:
+        from gpiozero.pins.mock import MockFactory, MockPin
+
+        class RecordingPin(MockPin):
+            """
+            Mock pin that records the time (from time.monotonic) of every rising edge.
+            """
+
+            def clear_states(self):
+                super().clear_states()
+                self.rising_edges = []
+
+            def _change_state(self, value):
+                changed = super()._change_state(value)
+                if changed and value:
+                    self.rising_edges.append(time.monotonic())
+                return changed
+
+        factory = MockFactory(pin_class=RecordingPin)
+        pins = SimulatedPi()
+        gpio.use_backend(pins)
+
+        def slow_edges():
+            edges = list(slow.pins[0].pin.rising_edges)
+            slow.pins[0].pin.clear_states()
+            return edges
+
+        wave_edges = lambda: None
+
+    slow = SlowPWM(args.pins, frequency=args.frequency, duty_cycle=DUTY_CYCLES[0], scheduler=PWMScheduler(),
+                   pin_factory=factory)
+    run("SlowPWM", slow, slow_edges, args)
+    if args.load:
+        run("SlowPWM with " + str(args.load) + " busy threads", slow, slow_edges, args, args.load)
+    slow.kill()
+
+    wave = WavePWM(args.pins, frequency=args.frequency, duty_cycle=DUTY_CYCLES[0], wave=PWMWave(args.frequency))
+    calls_start = pins.calls if not args.pigpio else None
+    run("WavePWM", wave, wave_edges, args)
+
+    if args.pigpio:
+        if args.load:
+            run("WavePWM with " + str(args.load) + " busy threads", wave, wave_edges, args, args.load)
+        callback.cancel()
+    else:
+        # Starting, every change and stopping each cost one set of calls
+        print("WavePWM pigpio calls per duty cycle change: {0:.1f}".format(
+            (pins.calls - calls_start) / (args.changes + 2)))
+
+        period = wave.wave.period
+        for duty_cycle in DUTY_CYCLES:
+            wave.wave.duty_cycles = {wave.pins: duty_cycle}
+            on_time = wave.wave.pulses()[1].delay
+            print("WavePWM at {0}: on for {1} us of a {2} us period, {3:+.1f} us from the requested time".format(
+                duty_cycle, on_time, period, on_time - duty_cycle * period))
@@ -0,0 +1,153 @@
+import os
+import re
+from typing import List, Optional
+
+from hardware_control.fan_control import hardware_pwm_channels
+from utilities.constants import CFG_CHAMBERS, CFG_SENSORS, CFG_HEATING_PINS, CFG_COOLING_PINS, CFG_FAN_PIN, \
+    CFG_SET_POINT_FILE, NAME, SET_POINT_FILE, MOTH_LOCATION
+
+'''
+A moth can control several fermentation chambers, each with its own sensors, Peltier pins, fan and set point file.
+They are listed under "Chambers" in config.json, and everything outside that list applies to every chamber unless
+the chamber sets it itself:
+
+{
+  "Name": "Moth",
+  "Fan speed": 0.4,
+  "Chambers": [
+    {
+      "Name": "Left",
+      "Temperature sensors": [{"Name": "Left", "Serial Number": "28-3c01b5562b43", "Type": "Main"}],
+      "Heating pins": [5], "Cooling pins": [22], "Fan pin": 19
+    },
+    {
+      "Name": "Right",
+      "Temperature sensors": [{"Name": "Right", "Serial Number": "28-3c01b5562b44", "Type": "Main"}],
+      "Heating pins": [27], "Cooling pins": [25], "Fan pin": 18,
+      "Set point file": "/brewmoth/right.json"
+    }
+  ]
+}
+
+A config without "Chambers" describes a single chamber, as it always has. Two fans can't share a hardware PWM
+channel: GPIO 12 and 18 are one channel, 13 and 19 the other, so a fan on 19 needs the other fan on 12, 18 or a
+pin without hardware PWM.
+'''
+
+CHAMBER_PINS = (CFG_HEATING_PINS, CFG_COOLING_PINS, CFG_FAN_PIN)
+
+
+def chamber_file(prefix: str, name: str, extension: str) -> str:
+    """
+    :return: Location of a file in the moth folder that belongs to the named chamber, e.g. its set point file
+    """
+    return os.path.join(MOTH_LOCATION, prefix + "-" + re.sub(r'[^A-Za-z0-9_-]+', '_', name) + extension)
+
+
+def chamber_configs(config: dict) -> List[dict]:
+    """
+    :param config: the contents of a config.json type file
+    :return: A config per chamber, in the same form as a single chamber config.json. The first chamber keeps
+             the usual set point file, the others get one named after the chamber unless they set their own.
+    """
+    if CFG_CHAMBERS not in config:
+        chamber = dict(config)
+        chamber.setdefault(CFG_SET_POINT_FILE, SET_POINT_FILE)
+        return [chamber]
+
+    shared = {key: value for key, value in config.items() if key != CFG_CHAMBERS}
+    chambers = []
+
+    for index, overrides in enumerate(config[CFG_CHAMBERS]):
+        chamber = dict(shared)
+        chamber.update(overrides)
+
+        if NAME not in overrides:
+            raise ValueError("Chamber " + str(index + 1) + " has no name")
+
+        if CFG_SENSORS not in overrides:
+            raise ValueError("Chamber '" + chamber[NAME] + "' has no temperature sensors")
+
+        if index == 0:
+            chamber.setdefault(CFG_SET_POINT_FILE, SET_POINT_FILE)
+        else:
+            chamber.setdefault(CFG_SET_POINT_FILE, chamber_file("set_point", chamber[NAME], ".json"))
+
+        chambers.append(chamber)
+
+    check_chambers_are_independent(chambers)
+
+    return chambers
+
+
+def check_chambers_are_independent(chambers: List[dict]):
+    """
+    Raises a ValueError if two chambers share a name, a pin, a sensor, a set point file or the hardware PWM channel
+    of their fans, as they would fight over it.
+    """
+    def check_unique(kind: str, values: list):
+        seen = set()
+        for value in values:
+            if value in seen:
+                raise ValueError("More than one chamber uses " + kind + " " + str(value))
+            seen.add(value)
+
+    check_unique("the name", [chamber[NAME] for chamber in chambers])
+    check_unique("the set point file", [os.path.abspath(chamber[CFG_SET_POINT_FILE]) for chamber in chambers])
+    check_unique("the sensor", [sensor[NAME] for chamber in chambers for sensor in chamber[CFG_SENSORS]])
+
+    if len(chambers) > 1:
+        for chamber in chambers:
+            missing = [key for key in CHAMBER_PINS if key not in chamber]
+            if missing:
+                raise ValueError("Chamber '" + chamber[NAME] + "' has to set " + ", ".join(missing) +
+                                 " when there is more than one chamber")
+
+        pins = []
+        for chamber in chambers:
+            pins += chamber[CFG_HEATING_PINS] + chamber[CFG_COOLING_PINS] + [chamber[CFG_FAN_PIN]]
+        check_unique("pin", pins)
+
+        channels = {}
+        for chamber in chambers:
+            channel = hardware_pwm_channels.get(chamber[CFG_FAN_PIN])
+            if channel is None:
+                continue
+            if channel in channels:
+                raise ValueError("The fans of chambers '" + channels[channel][NAME] + "' and '" + chamber[NAME] +
+                                 "' are on GPIO " + str(channels[channel][CFG_FAN_PIN]) + " and " +
+                                 str(chamber[CFG_FAN_PIN]) + ", which share a hardware PWM channel")
+            channels[channel] = chamber
+
+
+def chamber_config(config: dict, name: Optional[str] = None) -> dict:
+    """
+    :param config: the contents of a config.json type file
+    :param name: Name of the chamber, the first chamber if not given
+    :return: The config of the chamber
+    """
+    chambers = chamber_configs(config)
+
+    if name is None:
+        return chambers[0]
+
+    for chamber in chambers:
+        if chamber[NAME] == name:
+            return chamber
+
+    raise KeyError("No chamber named '" + name + "', the chambers are " +
+                   ", ".join("'" + chamber[NAME] + "'" for chamber in chambers))
+
+
+def sensors_config(config: dict) -> dict:
+    """
+    :param config: the contents of a config.json type file
+    :return: The config with the sensors of all the chambers, for the one sampler that reads all of them
+    """
+    if CFG_CHAMBERS not in config:
+        return config
+
+    merged = {key: value for key, value in config.items() if key != CFG_CHAMBERS}
+    merged[CFG_SENSORS] = [sensor for chamber in chamber_configs(config) for sensor in chamber[CFG_SENSORS]]
+
+    return merged
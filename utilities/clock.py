@@ -0,0 +1,36 @@
+import time
+
+'''
+Clocks for the control loop. Code that takes a clock instead of calling time.time() directly can be run in
+simulated time, e.g. to replay a two week fermentation in a few seconds.
+'''
+
+
+class Clock:
+    """
+    The real wall clock.
+    """
+
+    def time(self) -> float:
+        """
+        :return: Seconds since the epoch
+        """
+        return time.time()
+
+
+class SimulatedClock(Clock):
+    """
+    A clock that only moves when told to.
+    """
+
+    def __init__(self, start: float):
+        """
+        :param start: Starting time in seconds since the epoch
+        """
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
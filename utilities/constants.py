@@ -2,6 +2,9 @@ MOTH_LOCATION = '/brewmoth/'
 SET_POINT_FILE = MOTH_LOCATION + "/set_point.json"
 CONFIG_FILE = MOTH_LOCATION + "/config.json"
 READS_FOLDER = MOTH_LOCATION + 'temp-reads'
+BREWFATHER_PENDING_FILE = MOTH_LOCATION + 'brewfather-pending.json'
+CONTROL_SOCKET = MOTH_LOCATION + 'thermostat.sock'
+W1_DEVICES_FOLDER = '/sys/bus/w1/devices/'
 
 TYPE = 'Type'
 NAME = 'Name'
@@ -9,10 +12,41 @@ ON = "On"
 OFF = "Off"
 
 CFG_BREWFATHER = 'Brewfather'
+CFG_BREWFATHER_INTERVAL = 'Brewfather interval'
 CFG_WRITE_TO_DISK = 'Write to disk'
 CFG_SENSORS = 'Temperature sensors'
 CFG_SENSOR_SERIAL = 'Serial Number'
 CFG_FAN_SPEED = 'Fan speed'
+# Several fermentation chambers controlled by one moth, see utilities/chamber_config.py
+CFG_CHAMBERS = 'Chambers'
+CFG_HEATING_PINS = 'Heating pins'
+CFG_COOLING_PINS = 'Cooling pins'
+CFG_FAN_PIN = 'Fan pin'
+CFG_SET_POINT_FILE = 'Set point file'
+# How the Peltiers are driven in PID and predictive mode: Python threads, or a pigpio wave played back by DMA
+CFG_PELTIER_PWM = 'Peltier PWM'
+PWM_THREAD = 'Thread'
+PWM_WAVE = 'Wave'
+CFG_SENSOR_TIMEOUT = 'Sensor timeout'
+CFG_SENSOR_ATTEMPTS = 'Sensor read attempts'
+CFG_SAMPLING_PERIOD = 'Sampling period'
+CFG_MAX_READ_AGE = 'Max read age'
+CFG_LOGGING_PERIOD = 'Logging period'
+CFG_DISK_LOGGING_PERIOD = 'Disk logging period'
+CFG_LOGGER_QUEUE_SIZE = 'Logger queue size'
+CFG_LOGGER_OVERFLOW = 'Logger overflow'
+# Filtering of the sensor reads, see hardware_control/sensor_filter.py
+CFG_FILTER = 'Sensor filter'
+CFG_PROCESS_NOISE = 'Process noise'
+CFG_MEASUREMENT_NOISE = 'Measurement noise'
+CFG_FILTER_WINDOW = 'Filter window'
+CFG_MAX_RATE = 'Max temperature rate'
+FILTER_KALMAN = 'Kalman'
+FILTER_MEDIAN = 'Median'
+FILTER_NONE = 'None'
+# Reads are written to disk in groups, once this many are waiting or the oldest one is this many seconds old
+CFG_COMMIT_RECORDS = 'Commit records'
+CFG_COMMIT_SECONDS = 'Commit seconds'
 
 SENSOR_TYPE_MAIN = 'Main'
 SENSOR_TYPE_ROOM = 'Room'
@@ -26,11 +60,56 @@ SP_SAMPLING = "Sampling"
 # The tolerances how many degrees the temperature is off before starting to heat or cool
 SP_HEAT_TOLERANCE = "Heat Tolerance"
 SP_COOL_TOLERANCE = "Cool Tolerance"
+SP_MODE = "Mode"
+MODE_HYSTERESIS = "Hysteresis"
+MODE_PID = "PID"
+# Runs a relay experiment, then stores the PID gains it found and switches to PID
+MODE_AUTOTUNE = "Autotune"
+SP_TUNING_RULE = "Tuning Rule"
+# Plans the Peltier power ahead along the temperature profile, with a model of the chamber learnt as it goes
+MODE_PREDICTIVE = "Predictive"
+# How many hours ahead the predictive control looks
+SP_HORIZON = "Horizon"
+# PID gains, the output goes from -1 (full cooling) to 1 (full heating)
+SP_KP = "Kp"
+SP_KI = "Ki"
+SP_KD = "Kd"
+# Largest change in Peltier power per second
+SP_RATE_LIMIT = "Rate Limit"
+# Peltier power per degree that the room is colder than the set point
+SP_FEED_FORWARD = "Feed Forward"
 
 CLI_URL = 'http://127.0.0.1:6666/cli'
+STREAM_URL = 'http://127.0.0.1:6666/stream'
 CLI_GET_TEMP = 'Get temperatures'
 CLI_SET_TEMP = 'Set temperature'
 CLI_RECORD = 'Record thermostat changes'
 CLI_OFF = 'Turn off temperature control'
+CLI_SET_MODE = 'Set control mode'
+CLI_CHAMBER = 'Chamber'
+CLI_GET_STATE = 'Get thermostat state'
+# Fields of the events on the temperature stream
+STREAM_TIME = 'Time'
+STREAM_TEMPERATURES = 'Temperatures'
+
+# Messages on the control channel between the server and the thermostat, see control_channel.py
+CTL_COMMAND = 'Command'
+CTL_GET_STATE = 'Get state'
+CTL_UPDATE = 'Update settings'
+CTL_SETTINGS = 'Settings'
+CTL_PREVIOUS = 'Previous'  # The values the updated settings had before
+CTL_STATE = 'State'
+CTL_ERROR = 'Error'
+# Live state of a thermostat
+TS_ON = 'On'
+TS_MODE = 'Mode'
+TS_TARGET = 'Target'
+TS_HEATING_THRESHOLD = 'Heating threshold'
+TS_COOLING_THRESHOLD = 'Cooling threshold'
+TS_PELTIER_STATE = 'Peltier state'
+TS_DUTY = 'Duty'
+TS_LAST_READ = 'Last read'
+TS_LAST_READ_TIME = 'Last read time'
+TS_NEXT_READ = 'Next read'
 
 ERROR_NO_SENSORS = "Could not find temperature sensor settings in config.json"
@@ -0,0 +1,212 @@
+import json
+import os
+import selectors
+import socket
+import struct
+from threading import Thread, Lock
+from typing import Callable
+
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from utilities.constants import CTL_ERROR
+
+'''
+Commands and live state between the web server and the thermostat process, over a Unix domain socket, so a set point
+change is applied and acknowledged within milliseconds instead of waiting for the thermostat to notice a changed file.
+
+Every message is a 4 byte big-endian length followed by that many bytes of compact JSON. A client sends one request
+and waits for its reply before sending the next. The thermostat keeps writing the settings it is given to its set
+point file, so they survive a restart, but the server no longer reads or rewrites the file while the thermostat runs.
+'''
+
+HEADER = struct.Struct('!I')
+MAX_MESSAGE = 64 * 1024  # Bytes
+TIMEOUT = 10  # Seconds a client waits for a reply, the thermostat may be waiting for a fresh reading
+
+
+def encode(message: dict) -> bytes:
+    payload = json.dumps(message, separators=(',', ':')).encode()
+
+    if len(payload) > MAX_MESSAGE:
+        raise ValueError("Message of " + str(len(payload)) + " bytes is too long")
+
+    return HEADER.pack(len(payload)) + payload
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Control channel closed")
+        data += chunk
+
+    return data
+
+
+def receive_message(connection: socket.socket) -> dict:
+    size, = HEADER.unpack(receive_exactly(connection, HEADER.size))
+
+    if size > MAX_MESSAGE:
+        raise ConnectionError("Message of " + str(size) + " bytes is too long")
+
+    return json.loads(receive_exactly(connection, size))
+
+
+class ControlServer(Thread):
+    """
+    Answers the requests of any number of clients from one thread, handing each request to the handler.
+    """
+
+    def __init__(self, path: str, handler: Callable[[dict], dict]):
+        """
+        :param path: Where to create the socket, an old socket there is replaced
+        :param handler: Gets every request and returns the reply
+        """
+        super().__init__()
+        self.daemon = True
+        self.path = path
+        self.handler = handler
+        self.selector = selectors.DefaultSelector()
+        self.buffers = {}
+        self.alive = True
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+        self.listener.setblocking(False)
+
+        # The web server runs as another user, which shares the group of the moth's folder
+        try:
+            os.chown(path, -1, os.stat(os.path.dirname(os.path.abspath(path))).st_gid)
+            os.chmod(path, 0o660)
+        except OSError as e:
+            journal.write("Could not share the control socket " + path + ": " + str(e))
+
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+    def kill(self):
+        self.alive = False
+
+    def accept(self):
+        connection, _ = self.listener.accept()
+        connection.setblocking(False)
+        self.buffers[connection] = b''
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def close(self, connection: socket.socket):
+        self.selector.unregister(connection)
+        del self.buffers[connection]
+        connection.close()
+
+    def serve(self, connection: socket.socket):
+        """
+        Reads what the client sent, and answers every complete request in it.
+        """
+        try:
+            data = connection.recv(MAX_MESSAGE + HEADER.size)
+        except ConnectionError:
+            data = b''
+
+        if not data:
+            self.close(connection)
+            return
+
+        buffer = self.buffers[connection] + data
+        while len(buffer) >= HEADER.size:
+            size, = HEADER.unpack_from(buffer)
+            if size > MAX_MESSAGE:
+                self.close(connection)
+                return
+            if len(buffer) < HEADER.size + size:
+                break
+
+            request = buffer[HEADER.size:HEADER.size + size]
+            buffer = buffer[HEADER.size + size:]
+
+            try:
+                reply = self.handler(json.loads(request))
+            except Exception as e:
+                reply = {CTL_ERROR: str(e)}
+
+            try:
+                # Replies are small, and the client is waiting for them
+                connection.setblocking(True)
+                connection.sendall(encode(reply))
+                connection.setblocking(False)
+            except OSError:
+                self.close(connection)
+                return
+
+        self.buffers[connection] = buffer
+
+    def run(self) -> None:
+        try:
+            while self.alive:
+                for key, _ in self.selector.select(timeout=1):
+                    if key.fileobj is self.listener:
+                        self.accept()
+                    else:
+                        self.serve(key.fileobj)
+        finally:
+            for connection in list(self.buffers):
+                self.close(connection)
+            self.listener.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class ControlClient:
+    """
+    Sends requests to the thermostat over one connection, shared by all the threads of the web server.
+    """
+
+    def __init__(self, path: str, timeout: float = TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.connection = None
+        self.lock = Lock()
+
+    def connect(self) -> socket.socket:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(self.path)
+        except OSError as e:
+            connection.close()
+            raise ConnectionError("Thermostat is not running: " + str(e))
+
+        return connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def request(self, message: dict) -> dict:
+        """
+        Sends a request and waits for the reply. A broken connection is made again once, as the thermostat may
+        have restarted since the last request.
+
+        :raises ConnectionError: If the thermostat can't be reached
+        """
+        data = encode(message)
+
+        with self.lock:
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = self.connect()
+
+                try:
+                    self.connection.sendall(data)
+                    return receive_message(self.connection)
+                except (OSError, ValueError) as e:
+                    self.connection.close()
+                    self.connection = None
+                    if attempt > 0 or isinstance(e, socket.timeout):
+                        raise ConnectionError("Lost the thermostat's control channel: " + str(e))
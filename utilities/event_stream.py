@@ -0,0 +1,55 @@
+import json
+from typing import Iterable, Iterator, Tuple
+
+'''
+Server-Sent Events, as served by the /stream endpoint: every event is a few "field: value" lines followed by an
+empty line, and lines starting with a colon are comments, used to keep the connection alive.
+'''
+
+
+def format_event(data: dict, event: str = None, event_id: str = None) -> str:
+    """
+    :return: The data as one event, ready to be sent
+    """
+    message = ""
+    if event is not None:
+        message += "event: " + event + "\n"
+    if event_id is not None:
+        message += "id: " + event_id + "\n"
+
+    return message + "data: " + json.dumps(data) + "\n\n"
+
+
+def format_comment(comment: str) -> str:
+    return ": " + comment + "\n\n"
+
+
+def parse_events(lines: Iterable[str]) -> Iterator[Tuple[str, dict]]:
+    """
+    Parses a stream of events line by line.
+
+    :param lines: Lines of the stream without their line endings, e.g. from requests' Response.iter_lines
+    :return: The type (message if not given) and JSON data of every event
+    """
+    event = "message"
+    data = []
+
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event = "message"
+            data = []
+            continue
+
+        if line.startswith(":"):
+            continue
+
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
@@ -1,11 +1,34 @@
+import glob
 import os
 from pathlib import Path
+from typing import List
 
 from utilities.constants import READS_FOLDER
 from utilities.formatters import timestamp
+from utilities.time_series import TimeSeriesWriter
 
 
 def create_time_stamped_csv():
     Path(READS_FOLDER).mkdir(parents=True, exist_ok=True)
 
     return open(os.path.join(READS_FOLDER, timestamp() + ".csv"), "w")
+
+
+def create_time_stamped_store(sensors: List[str], metadata: dict = None, **kwargs) -> TimeSeriesWriter:
+    """
+    Creates a binary temperature log in the reads folder, named after the current time.
+
+    :param sensors: Names of the sensors that will be logged
+    :param metadata: Anything else to keep in the header of the file
+    :param kwargs: Passed on to TimeSeriesWriter
+    """
+    Path(READS_FOLDER).mkdir(parents=True, exist_ok=True)
+
+    return TimeSeriesWriter(os.path.join(READS_FOLDER, timestamp() + ".moth"), sensors, metadata, **kwargs)
+
+
+def list_time_series() -> List[str]:
+    """
+    :return: The locations of all the binary temperature logs in the reads folder, oldest first
+    """
+    return sorted(glob.glob(os.path.join(READS_FOLDER, "*.moth")))
@@ -0,0 +1,233 @@
+import math
+import threading
+from bisect import bisect_left
+from typing import List, Tuple
+
+'''
+Counters, gauges and histograms for the /metrics endpoint, in the Prometheus text format.
+
+Every thread that records a metric gets its own shard of the values, so recording is a plain addition to a list that
+no other thread writes to: no lock is taken, and it costs a fraction of a microsecond. A scrape adds up the shards
+of every thread. It doesn't stop the threads recording, so a histogram's sum may be a few events ahead of its count
+for one scrape, which Prometheus tolerates.
+
+Metrics are created once, at import time, in the module that records them, e.g.
+
+    READ_LATENCY = Histogram("brewmoth_sensor_read_seconds", "Time a sensor read took", ["sensor"])
+    READ_LATENCY.labels(name).observe(duration)
+'''
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+REGISTRY: List['Metric'] = []
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for value in values)
+    return '{' + ','.join(name + '="' + value + '"' for name, value in zip(names, escaped)) + '}'
+
+
+class Shards:
+    """
+    Values recorded by many threads, each thread writing only to its own list.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.local = threading.local()
+        self.shards: List[list] = []  # Kept after their thread ends, so counters never go down
+
+    def shard(self) -> list:
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = [0] * self.size
+            self.shards.append(values)  # Atomic, no other thread holds this list yet
+            return values
+
+    def totals(self) -> list:
+        totals = [0] * self.size
+        for shard in list(self.shards):
+            for index, value in enumerate(shard):
+                totals[index] += value
+
+        return totals
+
+
+class Metric:
+    """
+    A family of metrics sharing a name, one per combination of label values.
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, label_names: List[str] = (), register: bool = True):
+        """
+        :param name: Name of the metric, e.g. brewmoth_sensor_read_seconds
+        :param documentation: What the metric measures, sent as its HELP line
+        :param label_names: Names of the labels, given values with labels
+        :param register: Whether to include the metric in exposition
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.children = {}
+        self.lock = threading.Lock()  # Only taken to add a new combination of label values
+
+        if register:
+            REGISTRY.append(self)
+
+    def create_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """
+        :return: The metric for these label values, in the order of label_names
+        """
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(self.name + " takes labels " + ", ".join(self.label_names))
+
+            with self.lock:
+                child = self.children.setdefault(values, self.create_child())
+
+        return child
+
+    def samples(self, label_values: tuple, child) -> List[str]:
+        raise NotImplementedError
+
+    def exposition(self) -> str:
+        lines = ["# HELP " + self.name + " " + self.documentation, "# TYPE " + self.name + " " + self.type]
+
+        for values, child in list(self.children.items()):
+            lines.extend(self.samples(values, child))
+
+        return "\n".join(lines) + "\n"
+
+
+class CounterChild(Shards):
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1):
+        try:
+            self.local.values[0] += amount
+        except AttributeError:
+            self.shard()[0] += amount
+
+    def value(self) -> float:
+        return self.totals()[0]
+
+
+class Counter(Metric):
+    """
+    A count that only goes up, e.g. of retries. Its name should end in _total.
+    """
+    type = 'counter'
+
+    def create_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self, label_values: tuple, child: CounterChild) -> List[str]:
+        return [self.name + format_labels(self.label_names, label_values) + " " + format_value(child.value())]
+
+
+class GaugeChild:
+
+    def __init__(self):
+        self.current = math.nan
+
+    def set(self, value: float):
+        self.current = value  # A single assignment, the last writer wins
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g. a target temperature. NaN until it's first set.
+    """
+    type = 'gauge'
+
+    def create_child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self, label_values: tuple, child: GaugeChild) -> List[str]:
+        return [self.name + format_labels(self.label_names, label_values) + " " + format_value(child.current)]
+
+
+class HistogramChild(Shards):
+
+    def __init__(self, bounds: tuple):
+        # One count per bucket, one for +Inf, then the sum
+        super().__init__(len(bounds) + 2)
+        self.bounds = bounds
+
+    def observe(self, value: float):
+        try:
+            shard = self.local.values
+        except AttributeError:
+            shard = self.shard()
+        shard[bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+
+class Histogram(Metric):
+    """
+    Counts of observed values by bucket, e.g. of how long sensor reads take.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: List[str] = (), buckets: tuple = LATENCY_BUCKETS,
+                 register: bool = True):
+        """
+        :param buckets: Upper bounds of the buckets, in increasing order; +Inf is added
+        """
+        self.buckets = tuple(float(bound) for bound in buckets)
+        super().__init__(name, documentation, label_names, register)
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self, label_values: tuple, child: HistogramChild) -> List[str]:
+        totals = child.totals()
+        lines = []
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), totals):
+            cumulative += count
+            labels = format_labels(self.label_names + ('le',), label_values + (format_value(bound),))
+            lines.append(self.name + "_bucket" + labels + " " + format_value(cumulative))
+
+        labels = format_labels(self.label_names, label_values)
+        lines.append(self.name + "_sum" + labels + " " + format_value(totals[-1]))
+        lines.append(self.name + "_count" + labels + " " + format_value(cumulative))
+
+        return lines
+
+
+def exposition(metrics: List[Metric] = None) -> str:
+    """
+    :param metrics: The metrics to include, all the registered ones by default
+    :return: The metrics in the Prometheus text format
+    """
+    return "".join(metric.exposition() for metric in (metrics if metrics is not None else REGISTRY))
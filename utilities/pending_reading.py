@@ -0,0 +1,44 @@
+import json
+import os
+from typing import Optional
+
+from utilities.settings_channel import write_settings_atomically
+
+
+class PendingReading:
+    """
+    The newest reading that still has to be sent, kept in a JSON file so it survives a restart.
+    Storing a reading replaces the one before it, so there is never a backlog to work through.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Location of the JSON file, created when the first reading is stored
+        """
+        self.path = path
+
+        try:
+            with open(path, 'r') as pending_file:
+                self.payload = json.loads(pending_file.read())
+        except (FileNotFoundError, ValueError):
+            self.payload = None
+
+    def store(self, payload: dict):
+        write_settings_atomically(self.path, payload)
+        self.payload = payload
+
+    def get(self) -> Optional[dict]:
+        """
+        :return: The reading waiting to be sent, or None if there is none
+        """
+        return self.payload
+
+    def clear(self):
+        """
+        Forgets the reading, once it has been sent.
+        """
+        self.payload = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from threading import Thread, Event
+from typing import List, Callable
+
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+from utilities.metrics import Histogram, Counter, LATENCY_BUCKETS
+
+JOB_LAG = Histogram("brewmoth_job_lag_seconds", "How late periodic jobs started", ["job"],
+                    buckets=LATENCY_BUCKETS + (30, 60, 300))
+JOB_FAILURES = Counter("brewmoth_job_failures_total", "Periodic jobs that raised an exception", ["job"])
+JOB_MISSED = Counter("brewmoth_job_missed_total", "Deadlines of periodic jobs skipped because they ran late", ["job"])
+
+
+class PeriodicJob:
+    """
+    A function to be called at a fixed period by a PeriodicScheduler, along with its timing statistics.
+    """
+
+    def __init__(self, name: str, period: float, function: Callable[[], None]):
+        """
+        :param name: Name used when reporting on the job
+        :param period: Time between runs in seconds
+        :param function: Function to call, without arguments
+        """
+        self.name = name
+        self.period = period
+        self.function = function
+        self.deadline = None  # time.monotonic() at which the job should next run
+        self.runs = 0
+        self.failures = 0
+        self.missed = 0  # Deadlines skipped because a previous run was still going
+        self.lag = 0.0  # How late the last run started, in seconds
+        self.max_lag = 0.0
+        self.duration = 0.0  # How long the last run took, in seconds
+
+    def metrics(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "missed": self.missed,
+            "lag": self.lag,
+            "max lag": self.max_lag,
+            "duration": self.duration,
+        }
+
+
+class PeriodicScheduler(Thread):
+    """
+    Runs several jobs, each with its own period, from a single thread.
+
+    Deadlines are calculated from the monotonic clock as start + n * period, so the period doesn't drift by the time
+    the jobs take. The thread sleeps on an Event until the earliest deadline, so it uses no CPU in between and stops
+    as soon as kill is called. If a deadline passes while another job is running, it is counted as missed rather than
+    silently shifting the schedule.
+    """
+
+    def __init__(self, jobs: List[PeriodicJob] = None):
+        super().__init__()
+        self.daemon = True
+        self.jobs = jobs if jobs is not None else []
+        self.stopping = Event()
+
+    def add_job(self, job: PeriodicJob):
+        """
+        Adds a job. This has to be called before the thread is started.
+        """
+        self.jobs.append(job)
+
+    def kill(self):
+        self.stopping.set()
+
+    def metrics(self) -> dict:
+        """
+        :return: Timing statistics for each job, keyed by the job's name
+        """
+        return {job.name: job.metrics() for job in self.jobs}
+
+    def run_job(self, job: PeriodicJob):
+        start = time.monotonic()
+        job.lag = start - job.deadline
+        job.max_lag = max(job.max_lag, job.lag)
+        JOB_LAG.labels(job.name).observe(job.lag)
+
+        try:
+            job.function()
+        except Exception as e:
+            job.failures += 1
+            JOB_FAILURES.labels(job.name).inc()
+            journal.write("Periodic job '" + job.name + "' failed: " + str(e))
+
+        job.runs += 1
+        job.duration = time.monotonic() - start
+
+        job.deadline += job.period
+        now = time.monotonic()
+        if job.deadline <= now:
+            missed = int((now - job.deadline) // job.period) + 1
+            job.missed += missed
+            JOB_MISSED.labels(job.name).inc(missed)
+            job.deadline += missed * job.period
+            journal.write("Periodic job '" + job.name + "' missed " + str(missed) + " deadline(s)")
+
+    def run(self) -> None:
+        start = time.monotonic()
+        for job in self.jobs:
+            job.deadline = start
+
+        while not self.stopping.is_set() and self.jobs:
+            for job in self.jobs:
+                if job.deadline <= time.monotonic() and not self.stopping.is_set():
+                    self.run_job(job)
+
+            next_deadline = min(job.deadline for job in self.jobs)
+            self.stopping.wait(max(next_deadline - time.monotonic(), 0))
+
+    async def run_async(self):
+        """
+        Does the same as run, as a task on the running event loop instead of in a thread of its own.
+        The jobs run in the loop's default executor, as they may block.
+        """
+        loop = asyncio.get_running_loop()
+
+        start = time.monotonic()
+        for job in self.jobs:
+            job.deadline = start
+
+        while not self.stopping.is_set() and self.jobs:
+            for job in self.jobs:
+                if job.deadline <= time.monotonic() and not self.stopping.is_set():
+                    await loop.run_in_executor(None, self.run_job, job)
+
+            next_deadline = min(job.deadline for job in self.jobs)
+            await asyncio.sleep(max(next_deadline - time.monotonic(), 0))
@@ -0,0 +1,154 @@
+from typing import Optional, Tuple
+
+'''
+A PID controller for the Peltiers, with the extras a slow thermal process needs:
+ - Anti-windup: the integral stops growing while the output is saturated, so it doesn't overshoot once the
+   temperature finally comes around.
+ - Bumpless transfer: changing the set point, the gains or the feed-forward, or switching over from another
+   controller, moves the integral so the output carries on from where it was instead of jumping.
+ - Derivative on measurement, so set point changes don't kick the output.
+ - Output rate limiting, to go easy on the Peltiers.
+ - Feed-forward from the room temperature, for the heat that leaks in or out of the chamber.
+'''
+
+
+def clamp(value: float, limits: Tuple[float, float]) -> float:
+    lower, upper = limits
+    return max(lower, min(upper, value))
+
+
+class PIDController:
+
+    def __init__(self, kp: float, ki: float, kd: float, output_limits: Tuple[float, float] = (-1, 1),
+                 rate_limit: float = None, feed_forward: float = 0):
+        """
+        :param kp: Proportional gain, in output per degree
+        :param ki: Integral gain, in output per degree second
+        :param kd: Derivative gain, in output seconds per degree
+        :param output_limits: Lowest and highest output
+        :param rate_limit: Largest change of the output per second, or None for no limit
+        :param feed_forward: Output per degree the room is colder than the set point
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limits = output_limits
+        self.rate_limit = rate_limit
+        self.feed_forward = feed_forward
+
+        self.set_point = None
+        self.integral = 0.0  # Kept in output units, so changing ki doesn't change the output
+        self.output = 0.0
+        self.last_input = None
+        self.last_room = None
+
+    def components(self) -> dict:
+        """
+        :return: The terms that made up the last output, for logging
+        """
+        if self.set_point is None or self.last_input is None:
+            return {}
+
+        return {
+            "P": self.kp * (self.set_point - self.last_input),
+            "I": self.integral,
+            "Feed forward": self.feed_forward_term(self.set_point, self.last_room),
+            "Output": self.output,
+        }
+
+    def feed_forward_term(self, set_point: float, room_temp: Optional[float]) -> float:
+        if room_temp is None:
+            return 0.0
+
+        return self.feed_forward * (set_point - room_temp)
+
+    def bumpless(self, kp: float, set_point: float, feed_forward: float):
+        """
+        Moves the integral so that the proportional and feed-forward terms with the new settings add up to the same
+        output as with the old ones.
+        """
+        if self.set_point is not None and self.last_input is not None:
+            old = self.kp * (self.set_point - self.last_input) \
+                + self.feed_forward_term(self.set_point, self.last_room)
+
+            self.kp, self.set_point, self.feed_forward = kp, set_point, feed_forward
+
+            new = self.kp * (self.set_point - self.last_input) \
+                + self.feed_forward_term(self.set_point, self.last_room)
+
+            self.integral += old - new
+        else:
+            self.kp, self.set_point, self.feed_forward = kp, set_point, feed_forward
+
+    def set_target(self, set_point: float):
+        if set_point != self.set_point:
+            self.bumpless(self.kp, set_point, self.feed_forward)
+
+    def set_gains(self, kp: float, ki: float, kd: float, feed_forward: float = None):
+        if feed_forward is None:
+            feed_forward = self.feed_forward
+
+        if kp != self.kp or feed_forward != self.feed_forward:
+            self.bumpless(kp, self.set_point, feed_forward)
+
+        self.ki = ki
+        self.kd = kd
+
+    def reset(self, output: float, current_temp: float, room_temp: float = None):
+        """
+        Takes over from whatever was controlling the Peltiers before, starting from its output.
+        """
+        self.output = clamp(output, self.output_limits)
+        self.last_input = current_temp
+        self.last_room = room_temp
+
+        if self.set_point is None:
+            self.integral = self.output
+        else:
+            self.integral = self.output - self.kp * (self.set_point - current_temp) \
+                - self.feed_forward_term(self.set_point, room_temp)
+
+    def update(self, current_temp: float, dt: float, room_temp: float = None) -> float:
+        """
+        Works out the new output.
+
+        :param current_temp: The measured temperature
+        :param dt: Seconds since the previous update
+        :param room_temp: Temperature around the chamber, for the feed-forward. None to leave it out.
+        :return: The new output
+        """
+        if self.set_point is None:
+            raise ValueError("The PID controller needs a set point before it can be updated")
+
+        if self.last_input is None:
+            self.reset(self.output, current_temp, room_temp)
+
+        if room_temp is not None and self.last_room is None:
+            # The feed-forward appears, so hand over part of the integral to it
+            self.integral -= self.feed_forward_term(self.set_point, room_temp)
+        elif room_temp is None and self.last_room is not None:
+            self.integral += self.feed_forward_term(self.set_point, self.last_room)
+
+        error = self.set_point - current_temp
+        proportional = self.kp * error
+        derivative = -self.kd * (current_temp - self.last_input) / dt if dt > 0 else 0.0
+        integration = self.ki * error * dt
+
+        self.integral += integration
+        unlimited = proportional + self.integral + derivative + self.feed_forward_term(self.set_point, room_temp)
+
+        output = clamp(unlimited, self.output_limits)
+        if self.rate_limit is not None:
+            max_change = self.rate_limit * dt
+            output = clamp(output, (self.output - max_change, self.output + max_change))
+
+        # Anti-windup: don't integrate further in the direction the output can't follow
+        if output != unlimited and (output - unlimited) * integration < 0:
+            self.integral -= integration
+        self.integral = clamp(self.integral, self.output_limits)
+
+        self.output = output
+        self.last_input = current_temp
+        self.last_room = room_temp
+
+        return output
@@ -0,0 +1,313 @@
+import math
+from bisect import bisect_right
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+'''
+Model predictive control for the Peltiers.
+
+The chamber is modelled as first order plus dead time (FOPDT): the temperature T moves towards
+T_ref + c·τ + K·u with time constant τ, where u is the Peltier power from θ seconds ago, T_ref the room temperature
+(if there is a room sensor) and c an offset for everything else. The model is identified online with recursive
+least squares on the rate of change of the temperature, for a few candidate dead times at once, keeping whichever
+predicts best.
+
+Every update, the controller predicts the temperature over the coming hours for a sequence of Peltier powers, and
+picks the sequence that best follows the temperature profile over that time, with a penalty on changing the power.
+Since the profile is known ahead of time, a crash or ramp is started early enough for the temperature to keep up,
+rather than only once the set point has already moved. Only the first power of the sequence is used, and the whole
+thing is worked out again at the next update.
+'''
+
+MODEL_STEP = 600  # Seconds between model updates, and the length of a step of the prediction
+DEAD_TIMES = (0, 600, 1200, 1800, 3600)  # Candidate dead times in seconds
+PRIOR_TIME_CONSTANT = 12  # Hours
+PRIOR_GAIN = 30  # Degrees per unit of Peltier power
+MIN_TIME_CONSTANT = 0.25  # Hours
+FORGETTING = 0.995  # Per model update, so the model follows changes over about a day
+
+
+class RecursiveLeastSquares:
+    """
+    Fits y = θ·x one observation at a time, slowly forgetting old observations.
+    """
+
+    def __init__(self, parameters: np.ndarray, covariance: np.ndarray, forgetting: float = FORGETTING):
+        self.parameters = parameters.astype(np.float64)
+        self.covariance = covariance.astype(np.float64)
+        self.forgetting = forgetting
+
+    def update(self, x: np.ndarray, y: float) -> float:
+        """
+        :return: The error of the prediction made before the update
+        """
+        px = self.covariance @ x
+        gain = px / (self.forgetting + x @ px)
+        error = y - x @ self.parameters
+
+        self.parameters = self.parameters + gain * error
+        self.covariance = (self.covariance - np.outer(gain, px)) / self.forgetting
+
+        return error
+
+
+class FOPDTModel:
+    """
+    A fitted first order plus dead time model.
+    """
+
+    def __init__(self, time_constant: float, gain: float, offset: float, dead_time: float):
+        """
+        :param time_constant: τ, in hours
+        :param gain: K, in degrees per unit of Peltier power
+        :param offset: c, in degrees per hour
+        :param dead_time: θ, in seconds
+        """
+        self.time_constant = time_constant
+        self.gain = gain
+        self.offset = offset
+        self.dead_time = dead_time
+
+    def __repr__(self):
+        return "FOPDT(τ={0:.2f} h, K={1:.2f} C, c={2:.3f} C/h, θ={3:.0f} s)".format(
+            self.time_constant, self.gain, self.offset, self.dead_time)
+
+
+class ModelIdentifier:
+    """
+    Identifies the FOPDT model online from the temperature reads and the Peltier power that was used.
+    """
+
+    def __init__(self, step: float = MODEL_STEP, dead_times: Tuple[float, ...] = DEAD_TIMES):
+        self.step = step
+        self.dead_times = dead_times
+
+        # Parameters are [1/τ, K/τ, c] with times in hours, for observations x = [T_ref - T, u, 1]
+        prior = np.array([1 / PRIOR_TIME_CONSTANT, PRIOR_GAIN / PRIOR_TIME_CONSTANT, 0])
+        covariance = np.diag([0.01, 1.0, 0.1])
+        self.estimators = [RecursiveLeastSquares(prior, covariance) for _ in dead_times]
+        self.scores = [0.0] * len(dead_times)  # Running mean squared prediction error of each estimator
+        self.updates = 0
+
+        self.duty_times = []  # Times at which the Peltier power changed
+        self.duties = []
+        self.last_time = None
+        self.last_temp = None
+        self.last_reference = 0.0
+
+    def duty_at(self, time_stamp: float) -> float:
+        index = bisect_right(self.duty_times, time_stamp) - 1
+        return self.duties[index] if index >= 0 else 0.0
+
+    def average_duty(self, start: float, end: float) -> float:
+        """
+        :return: The mean Peltier power between two times
+        """
+        if end <= start:
+            return self.duty_at(start)
+
+        total = 0.0
+        time_stamp = start
+        index = bisect_right(self.duty_times, start)
+
+        while index < len(self.duty_times) and self.duty_times[index] < end:
+            total += self.duty_at(time_stamp) * (self.duty_times[index] - time_stamp)
+            time_stamp = self.duty_times[index]
+            index += 1
+
+        total += self.duty_at(time_stamp) * (end - time_stamp)
+
+        return total / (end - start)
+
+    def applied(self, time_stamp: float, duty: float):
+        """
+        Records the Peltier power used from the given time on, from -1 to 1.
+        """
+        if not self.duties or self.duties[-1] != duty:
+            self.duty_times.append(time_stamp)
+            self.duties.append(duty)
+
+    def record(self, time_stamp: float, temp: float, reference: float = 0.0):
+        """
+        Adds a temperature read. The model is updated once at least a model step has passed since the last update.
+
+        :param time_stamp: Time in seconds
+        :param temp: The measured temperature
+        :param reference: Room temperature, or 0 if there is no room sensor
+        """
+        elapsed = time_stamp - self.last_time if self.last_time is not None else None
+
+        # Start over after a gap, e.g. while the thermostat was off
+        if elapsed is None or elapsed > 4 * self.step:
+            self.last_time, self.last_temp, self.last_reference = time_stamp, temp, reference
+            return
+
+        if elapsed < self.step:
+            return
+
+        rate = (temp - self.last_temp) / elapsed * 3600
+        reference_difference = (self.last_reference + reference) / 2 - self.last_temp
+
+        for index, dead_time in enumerate(self.dead_times):
+            duty = self.average_duty(self.last_time - dead_time, time_stamp - dead_time)
+            error = self.estimators[index].update(np.array([reference_difference, duty, 1.0]), rate)
+            self.scores[index] = FORGETTING * self.scores[index] + (1 - FORGETTING) * error ** 2
+
+        self.updates += 1
+        self.last_time, self.last_temp, self.last_reference = time_stamp, temp, reference
+
+        # Only the power over the longest dead time is needed from here on
+        keep = bisect_right(self.duty_times, time_stamp - max(self.dead_times) - self.step) - 1
+        if keep > 0:
+            del self.duty_times[:keep]
+            del self.duties[:keep]
+
+    def model(self) -> FOPDTModel:
+        """
+        :return: The model of the dead time that predicts best. Falls back to the prior when the fit is not
+                 physically sensible, e.g. while there isn't enough data yet.
+        """
+        best = min(range(len(self.dead_times)), key=lambda index: self.scores[index])
+        inverse_time_constant, gain_rate, offset = self.estimators[best].parameters
+
+        if inverse_time_constant <= 1 / (30 * 24) or gain_rate <= 0:
+            return FOPDTModel(PRIOR_TIME_CONSTANT, PRIOR_GAIN, 0.0, 0.0)
+
+        time_constant = max(1 / inverse_time_constant, MIN_TIME_CONSTANT)
+
+        return FOPDTModel(time_constant, gain_rate * time_constant, offset, self.dead_times[best])
+
+
+def box_qp(hessian: np.ndarray, gradient: np.ndarray, lower: float, upper: float, iterations: int = 30) \
+        -> np.ndarray:
+    """
+    Minimises ½·uᵀHu + gᵀu with every u between lower and upper, with an active set method: variables that
+    would go past a bound are fixed at it, and released again if the gradient pulls them back in.
+    """
+    size = len(gradient)
+    u = np.zeros(size)
+    free = np.ones(size, dtype=bool)
+
+    for _ in range(iterations):
+        if np.any(free):
+            fixed_part = hessian[np.ix_(free, ~free)] @ u[~free]
+            u[free] = np.linalg.solve(hessian[np.ix_(free, free)], -(gradient[free] + fixed_part))
+
+        outside = free & ((u < lower) | (u > upper))
+        if np.any(outside):
+            u[outside] = np.clip(u[outside], lower, upper)
+            free &= ~outside
+            continue
+
+        slope = hessian @ u + gradient
+        release = ~free & (((u <= lower) & (slope < 0)) | ((u >= upper) & (slope > 0)))
+        if not np.any(release):
+            break
+        free |= release
+
+    return np.clip(u, lower, upper)
+
+
+class PredictiveController:
+
+    def __init__(self, horizon: float = 6 * 3600, step: float = MODEL_STEP, move_weight: float = 1.0,
+                 power_weight: float = 0.01, output_limits: Tuple[float, float] = (-1, 1)):
+        """
+        :param horizon: How far ahead to look, in seconds
+        :param step: Length of each step of the prediction, in seconds
+        :param move_weight: Cost of changing the power by 1 between steps, in squared degrees of error
+        :param power_weight: Cost of running at full power for a step, in squared degrees of error
+        :param output_limits: Lowest and highest output
+        """
+        self.horizon = horizon
+        self.step = step
+        self.move_weight = move_weight
+        self.power_weight = power_weight
+        self.output_limits = output_limits
+
+        self.identifier = ModelIdentifier(step)
+        self.output = 0.0
+        self.prediction = None
+        self.cached_matrices = None
+
+    def matrices(self, model: FOPDTModel, steps: int) -> Tuple[np.ndarray, np.ndarray, float]:
+        """
+        :return: G, how each step's power changes the predicted temperatures; the part of the QP Hessian that
+                 doesn't depend on the current state; and the per step decay of the temperature.
+                 Cached, as the model only changes every model step.
+        """
+        key = (model.time_constant, model.gain, steps)
+        if self.cached_matrices is not None and self.cached_matrices[0] == key:
+            return self.cached_matrices[1]
+
+        decay = math.exp(-self.step / 3600 / model.time_constant)
+        powers = decay ** np.arange(steps)
+        lags = np.subtract.outer(np.arange(steps), np.arange(steps))
+        effect = np.where(lags >= 0, powers[np.clip(lags, 0, None)], 0.0) * (1 - decay) * model.gain
+
+        moves = np.eye(steps) - np.eye(steps, k=-1)
+        hessian = 2 * (effect.T @ effect + self.move_weight * moves.T @ moves + self.power_weight * np.eye(steps))
+
+        result = (effect, hessian, decay)
+        self.cached_matrices = (key, result)
+
+        return result
+
+    def observe(self, time_stamp: float, temp: float, duty: float, reference: Optional[float] = None):
+        """
+        Keeps identifying the model while something else controls the Peltiers, so the model is ready
+        when the predictive control takes over.
+
+        :param duty: Peltier power used from now on
+        """
+        self.identifier.record(time_stamp, temp, 0.0 if reference is None else reference)
+        self.identifier.applied(time_stamp, duty)
+        self.output = duty
+
+    def update(self, time_stamp: float, temp: float, target: Callable[[float], float],
+               reference: Optional[float] = None) -> float:
+        """
+        Works out the new output.
+
+        :param time_stamp: Time in seconds since the epoch
+        :param temp: The measured temperature
+        :param target: The temperature profile, a function of the time in seconds since the epoch
+        :param reference: Room temperature, or None if there is no room sensor
+        :return: The new output
+        """
+        reference = 0.0 if reference is None else reference
+        self.identifier.record(time_stamp, temp, reference)
+
+        model = self.identifier.model()
+        steps = max(int(self.horizon / self.step), 1)
+        delay_steps = int(round(model.dead_time / self.step))
+        effect, hessian, decay = self.matrices(model, steps)
+        base = reference + model.offset * model.time_constant
+
+        # The power already applied plays out over the dead time
+        predicted = temp
+        for step in range(delay_steps):
+            start = time_stamp - model.dead_time + step * self.step
+            duty = self.identifier.average_duty(start, start + self.step)
+            predicted = decay * predicted + (1 - decay) * (base + model.gain * duty)
+
+        # Without any further power, the temperature would drift towards base from there
+        decays = decay ** np.arange(1, steps + 1)
+        free_response = decays * predicted + (1 - decays) * base
+
+        times = time_stamp + (delay_steps + np.arange(1, steps + 1)) * self.step
+        references = np.array([target(t) for t in times])
+
+        first_move = np.zeros(steps)
+        first_move[0] = 1
+        gradient = 2 * (effect.T @ (free_response - references) - self.move_weight * first_move * self.output)
+
+        lower, upper = self.output_limits
+        powers = box_qp(hessian, gradient, lower, upper)
+
+        self.prediction = (times, free_response + effect @ powers)
+        self.output = float(powers[0])
+        self.identifier.applied(time_stamp, self.output)
+
+        return self.output
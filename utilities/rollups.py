@@ -0,0 +1,217 @@
+from threading import Lock
+from typing import List, Iterable, Tuple
+
+import numpy as np
+
+from utilities.time_series import TimeSeries
+
+'''
+Min/mean/max summaries of the temperature history at a few fixed resolutions.
+
+Every new read updates the summaries incrementally, so charting weeks of data only means slicing
+a few thousand pre-computed buckets instead of scanning the raw logs.
+
+Each resolution only keeps a fixed window of history, in preallocated NumPy arrays used as a ring: the bucket starting
+at time t lives in slot t // resolution % capacity. A new bucket takes the slot of the one a whole window older, so
+the memory used never grows, however long the Brewmoth runs.
+'''
+
+DAY = 24 * 3600
+# Seconds between buckets and how far back they go: 1 minute for a week, 15 minutes for 90 days, 1 hour for a year
+ROLLUP_WINDOWS = ((60, 7 * DAY), (900, 90 * DAY), (3600, 365 * DAY))
+
+
+class Rollup:
+    """
+    Summaries of one sensor at one resolution, over a fixed window before the newest bucket.
+    """
+
+    def __init__(self, resolution: int, window: int):
+        """
+        :param resolution: Length of a bucket in seconds
+        :param window: Seconds of history to keep, buckets older than that are dropped
+        """
+        self.resolution = resolution
+        self.capacity = max(1, window // resolution)
+        self.starts = np.full(self.capacity, -1, dtype=np.int64)  # -1 for a slot that was never used
+        self.minimums = np.zeros(self.capacity, dtype=np.float64)
+        self.maximums = np.zeros(self.capacity, dtype=np.float64)
+        self.sums = np.zeros(self.capacity, dtype=np.float64)
+        self.counts = np.zeros(self.capacity, dtype=np.int64)
+        self.newest = None  # Start of the newest bucket
+
+    def oldest(self) -> int:
+        """
+        :return: Start of the oldest bucket still in the window
+        """
+        return self.newest - (self.capacity - 1) * self.resolution
+
+    def covers(self, time_stamp: float) -> bool:
+        return self.newest is None or time_stamp >= self.oldest()
+
+    def merge(self, starts: np.ndarray, minimums: np.ndarray, maximums: np.ndarray, sums: np.ndarray,
+              counts: np.ndarray):
+        """
+        Merges summaries of several reads into the buckets starting at the given times, which must all be different.
+        Buckets that are already out of the window are ignored.
+        """
+        if len(starts) == 0:
+            return
+
+        self.newest = max(int(starts.max()), self.newest if self.newest is not None else -1)
+        kept = starts >= self.oldest()
+        starts = starts[kept]
+        slots = starts // self.resolution % self.capacity
+
+        # A slot holding a different start has a bucket a whole window older, which is replaced
+        same = self.starts[slots] == starts
+        fresh = slots[~same]
+        self.starts[fresh] = starts[~same]
+        self.minimums[fresh] = minimums[kept][~same]
+        self.maximums[fresh] = maximums[kept][~same]
+        self.sums[fresh] = sums[kept][~same]
+        self.counts[fresh] = counts[kept][~same]
+
+        existing = slots[same]
+        self.minimums[existing] = np.minimum(self.minimums[existing], minimums[kept][same])
+        self.maximums[existing] = np.maximum(self.maximums[existing], maximums[kept][same])
+        self.sums[existing] += sums[kept][same]
+        self.counts[existing] += counts[kept][same]
+
+    def add(self, time_stamp: float, temperature: float):
+        start = int(time_stamp) // self.resolution * self.resolution
+        if self.newest is not None and start < self.oldest():
+            return
+
+        self.newest = max(start, self.newest if self.newest is not None else start)
+        slot = start // self.resolution % self.capacity
+
+        if self.starts[slot] != start:
+            self.starts[slot] = start
+            self.minimums[slot] = self.maximums[slot] = self.sums[slot] = temperature
+            self.counts[slot] = 1
+        else:
+            self.minimums[slot] = min(self.minimums[slot], temperature)
+            self.maximums[slot] = max(self.maximums[slot], temperature)
+            self.sums[slot] += temperature
+            self.counts[slot] += 1
+
+    def query(self, start: float, end: float) -> dict:
+        """
+        :return: The buckets between the two times (seconds since the epoch) that are still in the window, as lists
+                 of bucket start times, minimums, means and maximums
+        """
+        if self.newest is None:
+            wanted = np.zeros(0, dtype=np.int64)
+        else:
+            first = max(int(start) // self.resolution * self.resolution, self.oldest())
+            wanted = np.arange(first, min(int(np.ceil(end)), self.newest + 1), self.resolution, dtype=np.int64)
+
+        slots = wanted // self.resolution % self.capacity
+        slots = slots[self.starts[slots] == wanted]  # Skip the buckets without any reads
+
+        return {
+            "resolution": self.resolution,
+            "time": self.starts[slots].tolist(),
+            "min": self.minimums[slots].tolist(),
+            "mean": (self.sums[slots] / self.counts[slots]).tolist(),
+            "max": self.maximums[slots].tolist(),
+        }
+
+
+class RollupStore:
+    """
+    Rollups for every sensor at every resolution in ROLLUP_WINDOWS.
+    """
+
+    def __init__(self, windows: Iterable[Tuple[int, int]] = ROLLUP_WINDOWS):
+        """
+        :param windows: Pairs of a resolution and the seconds of history to keep at that resolution
+        """
+        self.windows = sorted(windows)
+        self.rollups = {}
+        self.lock = Lock()
+
+    @property
+    def longest_window(self) -> int:
+        """
+        :return: Seconds of history kept at the coarsest resolution, older reads are never needed
+        """
+        return max(window for resolution, window in self.windows)
+
+    def sensor_rollups(self, sensor: str) -> List[Rollup]:
+        if sensor not in self.rollups:
+            self.rollups[sensor] = [Rollup(resolution, window) for resolution, window in self.windows]
+
+        return self.rollups[sensor]
+
+    def add(self, time_stamp: float, temperatures: dict):
+        """
+        Adds one sweep of the sensors.
+
+        :param time_stamp: Time of the read in seconds since the epoch
+        :param temperatures: Temperatures keyed by sensor name, as returned by read_temps
+        """
+        with self.lock:
+            for sensor in temperatures:
+                temperature = float(temperatures[sensor])
+
+                for rollup in self.sensor_rollups(sensor):
+                    rollup.add(time_stamp, temperature)
+
+    def add_series(self, series: TimeSeries):
+        """
+        Adds all the reads in a binary temperature log, summarising them with NumPy rather than one at a time.
+        Only the reads inside the window of a rollup are summarised for it.
+        """
+        if len(series) == 0:
+            return
+
+        order = np.argsort(series.times, kind='stable')
+        times = series.times[order]
+
+        with self.lock:
+            for column, sensor in enumerate(series.sensors):
+                temps = series.temps[order, column]
+                valid = ~np.isnan(temps)
+                if not np.any(valid):
+                    continue
+
+                sensor_times = times[valid]
+                sensor_temps = temps[valid].astype(np.float64)
+
+                for rollup in self.sensor_rollups(sensor):
+                    newest = int(sensor_times[-1]) // rollup.resolution * rollup.resolution
+                    if rollup.newest is not None:
+                        newest = max(newest, rollup.newest)
+                    first = np.searchsorted(sensor_times, newest - (rollup.capacity - 1) * rollup.resolution)
+                    if first == len(sensor_times):
+                        continue
+
+                    window_temps = sensor_temps[first:]
+                    buckets = sensor_times[first:] // rollup.resolution * rollup.resolution
+                    starts, first_indices, counts = np.unique(buckets, return_index=True, return_counts=True)
+
+                    rollup.merge(starts, np.minimum.reduceat(window_temps, first_indices),
+                                 np.maximum.reduceat(window_temps, first_indices),
+                                 np.add.reduceat(window_temps, first_indices), counts)
+
+    def query(self, sensor: str, start: float, end: float, resolution: float = 0) -> dict:
+        """
+        Returns min/mean/max summaries of a sensor between two times.
+
+        :param sensor: Name of the sensor
+        :param start: Start of the range in seconds since the epoch
+        :param end: End of the range in seconds since the epoch
+        :param resolution: Desired time between points in seconds. The finest stored resolution that is at least as
+                           coarse and still goes back to the start is used, or the coarsest one if none of them do.
+        """
+        if sensor not in self.rollups:
+            raise KeyError("No history for sensor '" + sensor + "'")
+
+        with self.lock:
+            rollups = [rollup for rollup in self.rollups[sensor] if rollup.resolution >= resolution]
+            rollups = rollups or self.rollups[sensor][-1:]
+            chosen = next((rollup for rollup in rollups if rollup.covers(start)), rollups[-1])
+
+            return chosen.query(start, end)
@@ -0,0 +1,202 @@
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import tempfile
+import time
+from typing import List
+
+'''
+The web server and the thermostat share their settings through set_point.json.
+This module makes that channel safe and cheap:
+ - Writers never modify the file in place. They write a temporary file next to it and rename it over the original,
+   so a reader sees either the old or the new settings but never a half-written file.
+ - Readers only re-parse the file when it has actually changed, and can block until it does, using inotify when
+   available and falling back to checking the file's modification time and size.
+'''
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+POLLING_INTERVAL = 0.5  # Seconds, only used when inotify isn't available
+
+
+def write_settings_atomically(path: str, settings: dict):
+    """
+    Writes the settings as JSON to the given path by writing a temporary file and renaming it over the original.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o664
+
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(file_descriptor, 'w') as temporary_file:
+            temporary_file.write(json.dumps(settings, indent=2))
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+
+        os.chmod(temporary_path, mode)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def open_inotify(folder: str):
+    """
+    :return: A non-blocking inotify file descriptor watching the given folder for new or rewritten files,
+             or None if inotify isn't available.
+    """
+    library = ctypes.util.find_library('c')
+    if library is None:
+        return None
+
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        file_descriptor = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+
+    if file_descriptor < 0:
+        return None
+
+    if libc.inotify_add_watch(file_descriptor, folder.encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(file_descriptor)
+        return None
+
+    return file_descriptor
+
+
+class SettingsWatcher:
+    """
+    Reads a settings file, only parsing it again when it has changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.signature = None
+        self.settings = None
+        self.inotify = open_inotify(os.path.dirname(os.path.abspath(path)))
+
+    def file_signature(self):
+        """
+        :return: Something that changes whenever the file gets replaced or rewritten
+        """
+        stat = os.stat(self.path)
+
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def changed(self) -> bool:
+        """
+        :return: Whether the file changed since it was last read
+        """
+        try:
+            return self.file_signature() != self.signature
+        except FileNotFoundError:
+            return False
+
+    def read(self) -> dict:
+        """
+        :return: The settings, parsed again only if the file changed since the last call
+        """
+        signature = self.file_signature()
+
+        if signature != self.signature or self.settings is None:
+            with open(self.path, 'r') as settings_file:
+                self.settings = json.load(settings_file)
+            self.signature = signature
+
+        return self.settings
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until the file changes or the timeout runs out.
+
+        :param timeout: Maximum time to wait, in seconds
+        :return: Whether the file changed
+        """
+        return wait_for_any([self], timeout)
+
+    def close(self):
+        if self.inotify is not None:
+            os.close(self.inotify)
+            self.inotify = None
+
+
+def wait_for_any(watchers: List[SettingsWatcher], timeout: float) -> bool:
+    """
+    Blocks until any of the watched files changes or the timeout runs out.
+
+    :param watchers: The files to watch
+    :param timeout: Maximum time to wait, in seconds
+    :return: Whether a file changed
+    """
+    deadline = time.monotonic() + timeout
+    inotify = [watcher.inotify for watcher in watchers if watcher.inotify is not None]
+
+    while not any(watcher.changed() for watcher in watchers):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        if len(inotify) < len(watchers):
+            time.sleep(min(remaining, POLLING_INTERVAL))
+            continue
+
+        for file_descriptor in select.select(inotify, [], [], remaining)[0]:
+            drain(file_descriptor)
+
+    return True
+
+
+async def wait_for_any_async(watchers: List[SettingsWatcher], timeout: float) -> bool:
+    """
+    Does the same as wait_for_any, without blocking the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = time.monotonic() + timeout
+    inotify = [watcher.inotify for watcher in watchers if watcher.inotify is not None]
+
+    while not any(watcher.changed() for watcher in watchers):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        if len(inotify) < len(watchers):
+            await asyncio.sleep(min(remaining, POLLING_INTERVAL))
+            continue
+
+        readable = asyncio.Event()
+        for file_descriptor in inotify:
+            loop.add_reader(file_descriptor, readable.set)
+
+        try:
+            await asyncio.wait_for(readable.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for file_descriptor in inotify:
+                loop.remove_reader(file_descriptor)
+                drain(file_descriptor)
+
+    return True
+
+
+def drain(file_descriptor: int):
+    """
+    Reads all the pending events of an inotify file descriptor, we only care that something in the folder changed.
+    """
+    try:
+        while os.read(file_descriptor, 4096):
+            pass
+    except BlockingIOError:
+        pass
@@ -0,0 +1,166 @@
+import mmap
+import os
+import re
+import struct
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+# noinspection PyUnresolvedReferences
+from systemd import journal
+
+'''
+The recent control history of a thermostat, in a fixed-size ring buffer in shared memory.
+
+The control loop appends a record on every run of a thermostat, and the web server maps the same memory to chart
+or export the history, without parsing logs, copying between processes or writing to the SD card.
+
+The block starts with a 64 byte header: 8 magic bytes, the capacity and the record size as little-endian uint32,
+and at offset 16 the number of records ever appended as a little-endian uint64. The records follow as a NumPy
+structured array, record n stored at n % capacity. There is one writer, which stores the record before it bumps
+the count, and readers take the count before and after copying records, dropping any that were overwritten in
+between, so neither side ever waits for the other.
+'''
+
+MAGIC = b'MOTHTL01'
+HEADER_SIZE = 64
+COUNT_OFFSET = 16
+CAPACITY = 8640  # Records, 12 hours at the default 5 second sampling
+SHARED_MEMORY_FOLDER = '/dev/shm/'  # Where Linux keeps the POSIX shared memory blocks
+
+TELEMETRY_TYPE = np.dtype([
+    ('time', '<f8'),  # Seconds since the epoch
+    ('temperature', '<f4'),  # The temperature acted on, NaN while the control is off
+    ('target', '<f4'),
+    ('heating_threshold', '<f4'),
+    ('cooling_threshold', '<f4'),
+    ('state', '<i1'),  # Peltier state: 1 heating, -1 cooling, 0 off, see SoftwarePeltierDirectControl.State
+    ('duty', '<f4'),  # Peltier power in PID and predictive control, from -1 to 1
+    ('fan_speed', '<f4'),
+    ('duration', '<f4'),  # Seconds the run of the thermostat took
+])
+
+
+def telemetry_name(chamber: str) -> str:
+    """
+    :return: Name of the shared memory block of the named chamber
+    """
+    return "brewmoth-telemetry-" + re.sub(r'[^A-Za-z0-9_-]+', '_', chamber)
+
+
+def record_views(buffer, capacity: int) -> (np.ndarray, np.ndarray):
+    """
+    :return: The records and the count, as arrays on the shared memory
+    """
+    records = np.ndarray((capacity,), dtype=TELEMETRY_TYPE, buffer=buffer, offset=HEADER_SIZE)
+    count = np.ndarray((1,), dtype='<u8', buffer=buffer, offset=COUNT_OFFSET)
+
+    return records, count
+
+
+class TelemetryWriter:
+    """
+    Creates a telemetry ring buffer and appends to it. There must only be one writer per buffer.
+    """
+
+    def __init__(self, name: str, capacity: int = CAPACITY):
+        """
+        :param name: Name of the shared memory block, see telemetry_name. A block left behind by a writer that
+                     didn't get to close is replaced.
+        :param capacity: Number of records kept
+        """
+        size = HEADER_SIZE + capacity * TELEMETRY_TYPE.itemsize
+
+        try:
+            self.memory = SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.memory = SharedMemory(name, create=True, size=size)
+
+        # The web server runs as another user, it only ever needs to read the buffer
+        try:
+            os.chmod(SHARED_MEMORY_FOLDER + name, 0o644)
+        except OSError as e:
+            journal.write("Could not share the telemetry buffer " + name + ": " + str(e))
+
+        self.name = name
+        self.capacity = capacity
+        self.memory.buf[:COUNT_OFFSET] = MAGIC + struct.pack('<II', capacity, TELEMETRY_TYPE.itemsize)
+        self.records, self.count = record_views(self.memory.buf, capacity)
+        self.count[0] = 0
+
+    def append(self, time: float, temperature: float, target: float, heating_threshold: float,
+               cooling_threshold: float, state: int, duty: float, fan_speed: float, duration: float):
+        count = int(self.count[0])
+        self.records[count % self.capacity] = (time, temperature, target, heating_threshold, cooling_threshold,
+                                               state, duty, fan_speed, duration)
+        self.count[0] = count + 1
+
+    def close(self):
+        """
+        Removes the buffer, readers that still have it mapped keep their copy.
+        """
+        self.records = self.count = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class TelemetryReader:
+    """
+    Maps a telemetry ring buffer created by a TelemetryWriter in another process, read-only.
+    """
+
+    def __init__(self, name: str):
+        """
+        :raises FileNotFoundError: If there is no buffer with that name, e.g. because the thermostat isn't running
+        """
+        # Mapped directly rather than through SharedMemory, which would have the block removed when this process exits
+        descriptor = os.open(SHARED_MEMORY_FOLDER + name, os.O_RDONLY)
+        try:
+            self.memory = mmap.mmap(descriptor, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(descriptor)
+
+        magic = self.memory[:len(MAGIC)]
+        capacity, record_size = struct.unpack_from('<II', self.memory, len(MAGIC))
+        if magic != MAGIC or record_size != TELEMETRY_TYPE.itemsize:
+            self.memory.close()
+            raise ValueError("Not a telemetry buffer: " + name)
+
+        self.capacity = capacity
+        self.records, self.count = record_views(self.memory, capacity)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, e_t, e_v, trc):
+        self.close()
+
+    def recent(self, limit: int = None, since: float = None) -> np.ndarray:
+        """
+        :param limit: Most records to return, all the buffer holds by default
+        :param since: Only return the records from this time on, in seconds since the epoch
+        :return: A copy of the most recent records, oldest first
+        """
+        end = int(self.count[0])
+        start = max(end - self.capacity, 0)
+        if limit is not None:
+            start = max(start, end - limit)
+
+        records = self.records[np.arange(start, end) % self.capacity]
+
+        # Whatever the writer got to overwrite while the records were being copied is thrown away, including the
+        # record it may be in the middle of storing
+        overwritten = int(self.count[0]) - self.capacity + 1
+        if overwritten > start:
+            records = records[overwritten - start:]
+
+        if since is not None:
+            records = records[records['time'] >= since]
+
+        return records
+
+    def close(self):
+        self.records = self.count = None
+        self.memory.close()
@@ -0,0 +1,192 @@
+import json
+import os
+import struct
+import time
+from typing import List
+
+import numpy as np
+
+'''
+A compact binary format for temperature logs.
+
+A file starts with a small header: 8 magic bytes, the length of a JSON blob as a little-endian uint32,
+and the JSON blob itself (the sensor names and any extra metadata), padded to a multiple of 64 bytes.
+After that come fixed-width records: the time in seconds since the epoch as an int64,
+followed by one float32 temperature per sensor, in the order of the sensor names. Missing reads are stored as NaN.
+
+Since every record has the same size, the file can be memory-mapped and read as a NumPy structured array
+without parsing or copying anything. Records are written in groups, so the SD card sees a few larger writes
+instead of one small write per read.
+'''
+
+MAGIC = b'MOTHTS01'
+HEADER_ALIGNMENT = 64
+
+
+def record_type(sensor_count: int) -> np.dtype:
+    return np.dtype([('time', '<i8'), ('temps', '<f4', (sensor_count,))])
+
+
+def encode_header(sensors: List[str], metadata: dict) -> bytes:
+    header = dict(metadata)
+    header["sensors"] = sensors
+    contents = json.dumps(header).encode()
+
+    header = MAGIC + struct.pack('<I', len(contents)) + contents
+    padding = -len(header) % HEADER_ALIGNMENT
+
+    return header + b'\0' * padding
+
+
+def decode_header(file) -> (dict, int):
+    """
+    :return: The header contents and its size in bytes, i.e. the offset of the first record
+    """
+    magic = file.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not a temperature log: " + str(file.name))
+
+    length = struct.unpack('<I', file.read(4))[0]
+    header = json.loads(file.read(length).decode())
+    size = len(MAGIC) + 4 + length
+
+    return header, size + (-size % HEADER_ALIGNMENT)
+
+
+class TimeSeriesWriter:
+    """
+    Appends temperature reads to a binary log file, committing them to disk in groups.
+    At most commit_records records, or commit_seconds worth of records, can be lost on a power failure.
+    """
+
+    def __init__(self, path: str, sensors: List[str], metadata: dict = None,
+                 commit_records: int = 10, commit_seconds: float = 60):
+        """
+        :param path: Location of the file. If it already exists, records are appended to it.
+        :param sensors: Names of the sensors, in the order their temperatures are stored
+        :param metadata: Anything else to keep in the header of a new file
+        :param commit_records: Write to disk once this many records are waiting
+        :param commit_seconds: Write to disk once the oldest waiting record is this old
+        """
+        self.path = path
+        self.sensors = list(sensors)
+        self.dtype = record_type(len(self.sensors))
+        self.commit_records = commit_records
+        self.commit_seconds = commit_seconds
+        self.buffer = np.zeros(commit_records, dtype=self.dtype)
+        self.waiting = 0
+        self.first_waiting = None
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as existing:
+                header, offset = decode_header(existing)
+
+            if header["sensors"] != self.sensors:
+                raise ValueError("Sensors " + str(self.sensors) + " don't match the ones in " + path)
+
+            self.file = open(path, 'r+b')
+            # Drop any half written record left by a power failure
+            records = (os.path.getsize(path) - offset) // self.dtype.itemsize
+            self.file.truncate(offset + records * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(encode_header(self.sensors, metadata or {}))
+            self.sync()
+
+    @property
+    def name(self) -> str:
+        return self.path
+
+    def append(self, temperatures: dict, time_stamp: float = None):
+        """
+        :param temperatures: Temperatures keyed by sensor name, as returned by read_temps
+        :param time_stamp: Time of the read in seconds since the epoch, defaults to now
+        """
+        if time_stamp is None:
+            time_stamp = time.time()
+
+        record = self.buffer[self.waiting]
+        record['time'] = int(time_stamp)
+        record['temps'] = [float(temperatures[sensor]) if sensor in temperatures else np.nan
+                           for sensor in self.sensors]
+
+        if self.waiting == 0:
+            self.first_waiting = time.monotonic()
+        self.waiting += 1
+
+        if self.waiting >= self.commit_records or time.monotonic() - self.first_waiting >= self.commit_seconds:
+            self.commit()
+
+    def commit(self):
+        """
+        Writes all waiting records to disk.
+        """
+        if self.waiting == 0:
+            return
+
+        self.file.write(self.buffer[:self.waiting].tobytes())
+        self.sync()
+        self.waiting = 0
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+
+class TimeSeries:
+    """
+    Read-only, memory-mapped view of a binary temperature log.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.header, offset = decode_header(file)
+
+        self.sensors = self.header["sensors"]
+        dtype = record_type(len(self.sensors))
+        records = (os.path.getsize(path) - offset) // dtype.itemsize
+
+        if records > 0:
+            self.records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(records,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def times(self) -> np.ndarray:
+        """
+        :return: Times of the reads as seconds since the epoch (int64), without copying
+        """
+        return self.records['time']
+
+    @property
+    def temps(self) -> np.ndarray:
+        """
+        :return: A (reads x sensors) float32 array of the temperatures, without copying
+        """
+        return self.records['temps']
+
+    def sensor(self, name: str) -> np.ndarray:
+        """
+        :return: The temperatures of one sensor (float32), without copying
+        """
+        return self.temps[:, self.sensors.index(name)]
+
+    def to_csv(self, output):
+        """
+        Writes the log as CSV, with the same time stamps as the old CSV logs.
+
+        :param output: A file-like object open for writing text
+        """
+        output.write("Time, " + ", ".join(self.sensors) + "\n")
+
+        for record in self.records:
+            time_stamp = time.strftime('%Y-%m-%d_%H.%M.%S', time.localtime(int(record['time'])))
+            output.write(time_stamp + ", " + ", ".join('{0:g}'.format(temp) for temp in record['temps']) + "\n")
@@ -1,7 +1,10 @@
+import hashlib
+import json as json_module
+from bisect import bisect_right
 from collections import deque
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import List, Tuple, Union
+from typing import List, Tuple, Union, Optional
 
 from utilities.constants import SP_TEMP, SP_DATE, TYPE, SP_TARGET, SP_RAMP
 
@@ -259,3 +262,93 @@ def get_temperature_profile(set_points: List[SetPoint], interval: int) -> Tuple[
     temps.append(last.temp)
 
     return times, temps
+
+
+class CompiledProfile:
+    """
+    A temperature profile prepared for fast, repeated look-ups.
+
+    The set points are parsed and sorted once, and kept as parallel lists of epoch times, temperatures and ramp
+    flags, so the target for any time can be found with a binary search instead of re-parsing the JSON.
+    """
+
+    def __init__(self, set_points: List[SetPoint]):
+        """
+        :param set_points: A sorted list of temperature set points, see parse_json_temps
+        """
+        self.times = [set_point.date.timestamp() for set_point in set_points]
+        self.temps = [set_point.temp for set_point in set_points]
+        self.ramps = [set_point.type is SetPointType.RAMP for set_point in set_points]
+
+    def temp_at(self, time_stamp: float) -> float:
+        """
+        Same as get_temp_for_time, but in O(log n).
+
+        :param time_stamp: Time as seconds since the epoch, e.g. from time.time()
+        :return: The target temperature.
+        """
+        index = bisect_right(self.times, time_stamp) - 1
+
+        if index < 0:
+            return self.temps[0]
+
+        if index >= len(self.times) - 1:
+            return self.temps[-1]
+
+        if self.ramps[index + 1]:
+            ramp = (self.temps[index + 1] - self.temps[index]) / (self.times[index + 1] - self.times[index])
+            return self.temps[index] + (time_stamp - self.times[index]) * ramp
+
+        return self.temps[index]
+
+    def is_ramping(self, time_stamp: float) -> bool:
+        """
+        :return: Whether the target temperature is changing continuously at the given time
+        """
+        index = bisect_right(self.times, time_stamp)
+
+        return 0 < index < len(self.times) and self.ramps[index]
+
+    def next_breakpoint(self, time_stamp: float) -> Optional[float]:
+        """
+        :param time_stamp: Time as seconds since the epoch
+        :return: The time of the next set point after the given time, or None if the profile has finished.
+        """
+        index = bisect_right(self.times, time_stamp)
+
+        if index < len(self.times):
+            return self.times[index]
+
+        return None
+
+
+def profile_hash(json: dict) -> str:
+    """
+    :param json: A set point file's contents
+    :return: A hash of the "Temperatures" entry, which changes whenever the temperature profile does
+    """
+    contents = json_module.dumps(json[SP_TEMP], sort_keys=True)
+
+    return hashlib.sha1(contents.encode()).hexdigest()
+
+
+compiled_profiles = {}
+MAX_COMPILED_PROFILES = 8
+
+
+def compile_profile(json: dict) -> CompiledProfile:
+    """
+    Returns the compiled temperature profile for a set point file's contents.
+    Profiles are cached by the hash of their content, so they only get parsed once.
+
+    :param json: A set point file's contents, including a "Temperatures" entry
+    """
+    key = profile_hash(json)
+
+    if key not in compiled_profiles:
+        if len(compiled_profiles) >= MAX_COMPILED_PROFILES:
+            compiled_profiles.clear()
+
+        compiled_profiles[key] = CompiledProfile(parse_json_temps(json))
+
+    return compiled_profiles[key]
@@ -0,0 +1,78 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from utilities.time_temp_parser import SetPoint, SetPointType
+
+'''
+NumPy versions of the temperature profile functions in time_temp_parser.
+
+These evaluate a whole series of time points in one pass, which is what we need to plot a profile
+or to compare it against logged reads. Times are naive local date-times, like the dates in the set points,
+stored as numpy datetime64 values.
+'''
+
+
+def set_point_arrays(set_points: List[SetPoint]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param set_points: A sorted list of temperature set points
+    :return: The times of the set points as datetime64[s], their temperatures as float64
+             and whether each set point is the end of a ramp, as booleans
+    """
+    times = np.array([set_point.date for set_point in set_points], dtype='datetime64[s]')
+    temps = np.array([set_point.temp for set_point in set_points], dtype=np.float64)
+    ramps = np.array([set_point.type is SetPointType.RAMP for set_point in set_points], dtype=bool)
+
+    return times, temps, ramps
+
+
+def get_temps_for_times(set_points: List[SetPoint], query_times) -> np.ndarray:
+    """
+    Vectorised version of get_temp_for_time: determines the target temperature at each of the given times.
+
+    Between two set points the target either holds the first temperature (a crash or step) or, if the second set
+    point is a ramp, interpolates linearly between them. Before the profile starts the first temperature is used
+    and after it finishes the last one.
+
+    :param set_points: A sorted list of temperature set points
+    :param query_times: Anything numpy can turn into a datetime64 array, e.g. a list of datetimes
+    :return: The target temperatures, as a float64 array of the same length
+    """
+    times, temps, ramps = set_point_arrays(set_points)
+    times = times.astype(np.int64)
+    query_times = np.asarray(query_times, dtype='datetime64[s]').astype(np.int64)
+
+    last = len(times) - 1
+    index = np.searchsorted(times, query_times, side='right') - 1
+    previous = np.clip(index, 0, last)
+    following = np.clip(index + 1, 0, last)
+
+    targets = temps[previous]
+
+    ramping = (index >= 0) & (index < last) & ramps[following]
+    if np.any(ramping):
+        start = times[previous[ramping]]
+        end = times[following[ramping]]
+        fraction = (query_times[ramping] - start) / (end - start)
+        targets[ramping] += fraction * (temps[following[ramping]] - temps[previous[ramping]])
+
+    return targets
+
+
+def get_temperature_profile_array(set_points: List[SetPoint], interval: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised version of get_temperature_profile.
+    Generates time points every interval minutes from the first to the last set point, and the
+    temperature the set points define at each of them.
+
+    :param set_points: A sorted list of temperature set points
+    :param interval: The time, in minutes, between each of the generated time points.
+    :return: A datetime64 array of the time points, and a float64 array of the respective temps
+    """
+    first = np.datetime64(set_points[0].date, 's')
+    last = np.datetime64(set_points[-1].date, 's')
+
+    times = np.arange(first, last, np.timedelta64(interval, 'm'))
+    times = np.append(times, last)
+
+    return times, get_temps_for_times(set_points, times)